@@ -0,0 +1,271 @@
+# !/usr/bin/python
+
+##############################################################################
+# @file    avalanche.py
+# @brief   Batched avalanche analysis of the Feistel cipher. All single bit
+# flips of many plaintexts or keys are encrypted in one batch and the
+# differences are counted with popcounts, giving the distribution of
+# flipped output bits and a matrix of how every input bit affects every
+# output bit.
+###############################################################################
+
+
+import random
+
+from bitarray import bitarray
+
+from bitops import bits_to_int, popcount
+from feistel_cipher import FeistelCipher
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Without NumPy, the bitsliced backend overtakes the int backend from about
+# this many blocks per call under one key. Measured on CPython 2.7.
+BITSLICED_MIN_BLOCKS = 256
+
+
+def fastest_backend(blocks=1):
+    """
+    NumPy is the fastest at every batch size. Without it, the bitsliced
+    backend wins for large batches under one key, and the int backend for
+    small batches and for batches with a key per block, which the bitsliced
+    backend can only encrypt one block at a time.
+
+    :param blocks: number of blocks encrypted under the same key per call.
+    :return: name of the fastest backend available for the batches.
+    """
+
+    if numpy is not None:
+        return 'numpy'
+    return 'bitsliced' if blocks >= BITSLICED_MIN_BLOCKS else 'int'
+
+
+class AvalancheReport(object):
+    def __init__(self, input_bits, output_bits=64):
+        """
+        :param input_bits: number of input bit positions that are flipped.
+        :param output_bits: number of bits in a ciphertext block.
+        """
+
+        self.input_bits = input_bits
+        self.output_bits = output_bits
+        # distribution[d] is the number of flips that changed d output bits.
+        self.distribution = [0] * (output_bits + 1)
+        # matrix[i][j] is the number of times flipping input bit i flipped
+        # output bit j. Bits are counted from the most significant bit.
+        self.matrix = [[0] * output_bits for _ in range(input_bits)]
+        self.samples = 0
+
+    def add(self, diffs):
+        """
+        Adds the output differences of one batch.
+
+        :param diffs: list of lists (or 2D array) of XOR differences between
+        the ciphertext of a sample and the ciphertext with input bit i
+        flipped, indexed [sample][i].
+        """
+
+        if numpy is not None:
+            self.add_array(numpy.asarray(diffs, dtype=numpy.uint64))
+            return
+
+        for row in diffs:
+            self.samples += 1
+            for i, diff in enumerate(row):
+                self.distribution[popcount(diff)] += 1
+                counts = self.matrix[i]
+                for j in range(self.output_bits):
+                    if (diff >> (self.output_bits - 1 - j)) & 1:
+                        counts[j] += 1
+
+    def add_array(self, diffs):
+        samples, inputs = diffs.shape
+        # One row of 64 bits per difference, most significant bit first.
+        bits = numpy.unpackbits(
+            diffs.astype('>u8').view(numpy.uint8).reshape(samples, inputs, 8),
+            axis=2)[:, :, 64 - self.output_bits:]
+
+        weights = bits.sum(axis=2, dtype=numpy.int64)
+        distribution = numpy.bincount(weights.ravel(),
+                                      minlength=self.output_bits + 1)
+        matrix = bits.sum(axis=0, dtype=numpy.int64)
+
+        for d, count in enumerate(distribution):
+            self.distribution[d] += int(count)
+        for i in range(inputs):
+            row = self.matrix[i]
+            for j in range(self.output_bits):
+                row[j] += int(matrix[i, j])
+        self.samples += samples
+
+    def flips(self):
+        return sum(self.distribution)
+
+    def min(self):
+        return next(d for d, c in enumerate(self.distribution) if c)
+
+    def max(self):
+        return max(d for d, c in enumerate(self.distribution) if c)
+
+    def mean(self):
+        total = sum(d * c for d, c in enumerate(self.distribution))
+        return float(total) / self.flips()
+
+    def dependence(self):
+        """
+        :return: matrix of the probability that flipping input bit i flips
+        output bit j.
+        """
+
+        return [[float(c) / self.samples for c in row] for row in self.matrix]
+
+    def as_dict(self):
+        return {
+            'samples': self.samples,
+            'flips': self.flips(),
+            'min': self.min(),
+            'max': self.max(),
+            'mean': self.mean(),
+            'distribution': list(self.distribution),
+            'dependence': self.dependence(),
+        }
+
+
+def plaintext_avalanche(key, plaintexts=None, samples=1000, bits=None,
+                        number_of_rounds=16, triple=False, backend=None,
+                        batch_size=4096, seed=None):
+    """
+    Measures how single bit flips in the plaintext spread to the ciphertext.
+
+    :param key: key, or 168 bit key if triple is True.
+    :param plaintexts: list of plaintexts, each either an integer block or
+    text of at most one block that is parsed like FeistelCipher.encrypt()
+    does. If omitted, random blocks are used.
+    :param samples: number of random plaintexts if none are given.
+    :param bits: input bit positions to flip, counted from the most
+    significant bit of the block. Defaults to all 64.
+    :param number_of_rounds: number of rounds of the analysed cipher.
+    :param triple: If set to True, triple encryption is analysed.
+    :param backend: backend to use. Defaults to fastest_backend() for the
+    size of a batch.
+    :param batch_size: number of plaintexts encrypted per batch.
+    :param seed: seed for the random plaintexts.
+    :return: an AvalancheReport.
+    """
+
+    if plaintexts is None:
+        rng = random.Random(seed)
+        plaintexts = [rng.getrandbits(64) for _ in range(samples)]
+    if bits is None:
+        bits = range(64)
+    masks = [1 << (63 - i) for i in bits]
+
+    blocks = min(batch_size, len(plaintexts)) * (len(masks) + 1)
+    cipher = FeistelCipher(number_of_rounds, backend=backend or
+                           fastest_backend(blocks))
+    if triple:
+        stages = cipher.triple_stages(key, True)
+    else:
+        stages = [cipher.key_schedule(key).sub_keys(True)]
+
+    plaintexts = [p if isinstance(p, (int, long)) else
+                  bits_to_int(cipher.parse_text(p))
+                  for p in plaintexts]
+    report = AvalancheReport(len(masks))
+
+    for start in range(0, len(plaintexts), batch_size):
+        batch = plaintexts[start:start + batch_size]
+        # Every plaintext followed by all of its single bit flips.
+        blocks = []
+        for p in batch:
+            blocks.append(p)
+            blocks.extend(p ^ m for m in masks)
+
+        encrypted = cipher.process_blocks(blocks, stages)
+        report.add(differences(encrypted, len(masks)))
+
+    return report
+
+
+def key_avalanche(plaintext=0, keys=None, samples=100, bits=None,
+                  number_of_rounds=16, backend=None, batch_size=256,
+                  seed=None):
+    """
+    Measures how single bit flips in the key spread to the ciphertext.
+
+    :param plaintext: integer block that is encrypted under every key.
+    :param keys: list of raw keys. If omitted, random 56 bit keys are used.
+    :param samples: number of random keys if none are given.
+    :param bits: key bit positions to flip. Defaults to every bit of the key.
+    :param number_of_rounds: number of rounds of the analysed cipher.
+    :param backend: backend to use. Defaults to fastest_backend().
+    :param batch_size: number of keys encrypted per batch.
+    :param seed: seed for the random keys.
+    :return: an AvalancheReport.
+    """
+
+    cipher = FeistelCipher(number_of_rounds, backend=backend or
+                           fastest_backend())
+
+    if keys is None:
+        rng = random.Random(seed)
+        keys = [''.join(chr(rng.getrandbits(8)) for _ in range(7))
+                for _ in range(samples)]
+    keys = [cipher.parse_text(k) for k in keys]
+
+    if bits is None:
+        bits = range(len(keys[0]))
+    report = AvalancheReport(len(bits))
+
+    for start in range(0, len(keys), batch_size):
+        schedules = []
+        for key in keys[start:start + batch_size]:
+            schedules.append(cipher.expand_key(key.to01()).sub_keys())
+            for i in bits:
+                flipped = bitarray(key)
+                flipped[i] = not flipped[i]
+                schedules.append(cipher.expand_key(flipped.to01()).sub_keys())
+
+        encrypted = encrypt_under_keys(cipher, plaintext, schedules)
+        report.add(differences(encrypted, len(bits)))
+
+    return report
+
+
+def encrypt_under_keys(cipher, plaintext, schedules):
+    """
+    Encrypts one block under many key schedules.
+
+    :return: list or array of ciphertext blocks, one per schedule.
+    """
+
+    if numpy is not None and hasattr(cipher.engine, 'encrypt_batch'):
+        keys = numpy.array(schedules, dtype=numpy.uint64)
+        blocks = numpy.full(len(schedules), plaintext, dtype=numpy.uint64)
+        stage = [keys[:, r] for r in range(keys.shape[1])]
+        return cipher.engine.encrypt_batch(blocks, [stage])
+
+    return [cipher.process_blocks([plaintext], [sub_keys])[0]
+            for sub_keys in schedules]
+
+
+def differences(encrypted, flips):
+    """
+    Splits a batch laid out as [base, flip 1, ..., flip n, base, ...] into
+    the XOR differences between every flip and its base.
+
+    :return: list of lists, or 2D array, indexed [sample][flip].
+    """
+
+    if numpy is not None:
+        encrypted = numpy.asarray(encrypted, dtype=numpy.uint64)
+        rows = encrypted.reshape(-1, flips + 1)
+        return rows[:, 1:] ^ rows[:, :1]
+
+    rows = [encrypted[i:i + flips + 1]
+            for i in range(0, len(encrypted), flips + 1)]
+    return [[int(c) ^ int(row[0]) for c in row[1:]] for row in rows]
@@ -0,0 +1,155 @@
+# !/usr/bin/python
+
+##############################################################################
+# @file    bitops.py
+# @brief   Bit manipulation on native integers and byte buffers. Values are
+# kept as integers of a known width instead of lists of bits, and bulk
+# conversions go through binascii or NumPy rather than one bit at a time.
+# Shared by both assignments.
+###############################################################################
+
+
+import binascii
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def mask(width):
+    """
+    :return: integer with the lowest width bits set.
+    """
+
+    return (1 << width) - 1
+
+
+def rotl(value, places, width):
+    """
+    Rotates an integer of the given width to the left.
+    """
+
+    places %= width
+    return ((value << places) | (value >> (width - places))) & mask(width)
+
+
+def rotr(value, places, width):
+    """
+    Rotates an integer of the given width to the right.
+    """
+
+    return rotl(value, width - places % width, width)
+
+
+def split(value, width):
+    """
+    Splits an integer of the given width into halves. Like
+    bitutils.split_list(), the left half gets width // 2 bits and the right
+    half the rest.
+
+    :return: tuple of the left and the right half.
+    """
+
+    right_width = width - width // 2
+    return value >> right_width, value & mask(right_width)
+
+
+def swap(value, width):
+    """
+    Swaps the halves returned by split(), like bitutils.swap_list().
+    """
+
+    left, right = split(value, width)
+    return (right << (width // 2)) | left
+
+
+def bytes_to_int(data):
+    """
+    :param data: byte string or buffer, read as a big endian number.
+    :return: integer value of the bytes.
+    """
+
+    if not len(data):
+        return 0
+    return int(binascii.hexlify(data), 16)
+
+
+def int_to_bytes(value, length):
+    """
+    :param value: non negative integer below 2**(8 * length).
+    :param length: number of bytes.
+    :return: big endian byte string of the value.
+    """
+
+    if not length:
+        return ''
+    return binascii.unhexlify('%0*x' % (2 * length, value))
+
+
+def bits_to_int(bits):
+    """
+    :param bits: string of '0' and '1' characters, bitarray, or sequence of
+    bits, most significant bit first.
+    :return: integer value of the bits.
+    """
+
+    if not isinstance(bits, basestring):
+        to01 = getattr(bits, 'to01', None)
+        if to01 is not None:
+            bits = to01()
+        else:
+            bits = ''.join('1' if b else '0' for b in bits)
+    return int(bits or '0', 2)
+
+
+def int_to_bits(value, width=0):
+    """
+    :param width: smallest number of bits in the result. Shorter values
+    are padded with leading zeros.
+    :return: string of '0' and '1' characters of the value.
+    """
+
+    return '{0:0{1}b}'.format(value, width)
+
+
+def bytes_to_bits(data):
+    """
+    :param data: byte string or buffer.
+    :return: string of '0' and '1' characters, eight per byte.
+    """
+
+    if numpy is not None:
+        bits = numpy.unpackbits(numpy.frombuffer(data, dtype=numpy.uint8))
+        return (bits + ord('0')).tobytes()
+    return int_to_bits(bytes_to_int(data), 8 * len(data))
+
+
+def bits_to_bytes(bits):
+    """
+    :param bits: string of '0' and '1' characters. Like bitarray.tobytes(),
+    a last byte that is not whole is padded with trailing zeros.
+    :return: byte string of the bits.
+    """
+
+    bits += '0' * (-len(bits) % 8)
+    if numpy is not None:
+        values = numpy.frombuffer(bits, dtype=numpy.uint8) - ord('0')
+        return numpy.packbits(values).tobytes()
+    return int_to_bytes(int(bits or '0', 2), len(bits) // 8)
+
+
+def popcount(value):
+    """
+    :return: number of set bits of a non negative integer.
+    """
+
+    return bin(value).count('1')
+
+
+def popcount_bytes(data):
+    """
+    :return: number of set bits of a byte string or buffer.
+    """
+
+    return popcount(bytes_to_int(data))
@@ -0,0 +1,233 @@
+# !/usr/bin/python
+
+##############################################################################
+# @file    bitsliced_engine.py
+# @brief   This class provides a bitsliced round engine for the Feistel
+# cipher. Many blocks are transposed so that every bit position of the
+# cipher becomes one Python integer holding that bit of every block. The
+# permutations then become renamings and the S-boxes boolean circuits.
+###############################################################################
+
+
+from bitarray import bitarray
+
+import bitops
+from des import DES
+from int_engine import IntEngine
+import bitutils
+
+
+def s_box_minterms(box):
+    """
+    Describes an S-box as a boolean function of its five used input bits.
+    Like FeistelCipher.substitute(), the row is given by bits 0 and 5 and the
+    column by bits 1-3 of the 6-bit input, and an output wider than four
+    bits is truncated to its four most significant bits.
+
+    :param box: S-box lookup table.
+    :return: for each of the four output bits, the list of minterms (input
+    values b0 b5 b1 b2 b3, most significant bit first) for which the output
+    bit is set.
+    """
+
+    outputs = [[], [], [], []]
+
+    for m in range(32):
+        row = m >> 3
+        col = m & 7
+        b = '{0:04b}'.format(box[row][col])[:4]
+        for j in range(4):
+            if b[j] == '1':
+                outputs[j].append(m)
+
+    return outputs
+
+
+class BitslicedEngine(IntEngine):
+
+    # Below this number of blocks the fixed cost of a bitsliced pass
+    # outweighs the gain, so the scalar loop of IntEngine is used instead.
+    MIN_VECTOR_SIZE = 64
+
+    def __init__(self, number_of_rounds=16, block_size=64, tables=DES,
+                 batch_size=1 << 13):
+        """
+        :param batch_size: number of blocks transposed into one pass. Must be
+        a multiple of 8.
+        """
+
+        super(BitslicedEngine, self).__init__(number_of_rounds, block_size,
+                                              tables)
+
+        self.batch_size = batch_size
+        # Slice indices read by the expansion and the permutation.
+        self.e_index = [e - 1 for e in tables.E]
+        self.p_index = [p - 1 for p in tables.P]
+        self.minterms = [s_box_minterms(box) for box in tables.S]
+
+    @classmethod
+    def compile_round_loops(cls, s_boxes):
+        """
+        The bitsliced round loop works for any number of S-boxes, so only
+        the scalar loop from IntEngine.specialized() is generated.
+        """
+
+        return {}
+
+    def encrypt_blocks(self, blocks, *stages):
+        """
+        Bitsliced counterpart of IntEngine.encrypt_blocks().
+
+        :param blocks: list of 64 bit integer blocks.
+        :param stages: one list of 48 bit integer sub keys per stage.
+        :return: list of encrypted blocks.
+        """
+
+        if len(blocks) < self.MIN_VECTOR_SIZE:
+            return super(BitslicedEngine, self).encrypt_blocks(blocks,
+                                                               *stages)
+
+        data = self.encrypt_data(IntEngine.pack_blocks(blocks), stages)
+        return IntEngine.unpack_blocks(data)
+
+    def encrypt_bytes(self, data, *stages):
+        """
+        Bitsliced counterpart of IntEngine.encrypt_bytes().
+
+        :param data: byte string of plaintext or ciphertext.
+        :param stages: one list of integer sub keys per encryption stage.
+        :return: byte string of the encrypted/decrypted data.
+        """
+
+        if len(data) < 8 * self.MIN_VECTOR_SIZE:
+            return super(BitslicedEngine, self).encrypt_bytes(data, *stages)
+
+        data = bitutils.to_bytes(data)
+        short = len(data) % 8
+        if short:
+            full = len(data) - short
+            data = data[:full] + '\x00' * (8 - short) + data[full:]
+
+        return self.encrypt_data(data, stages)
+
+    def encrypt_data(self, data, stages):
+        """
+        Encrypts whole blocks of data one bitsliced batch at a time.
+
+        :param data: byte string whose length is a multiple of 8.
+        :param stages: one list of integer sub keys per encryption stage.
+        :return: byte string of the encrypted/decrypted data.
+        """
+
+        width = len(self.e_index)
+        key_bits = [[[(k >> (width - 1 - i)) & 1 for i in range(width)]
+                     for k in sub_keys] for sub_keys in stages]
+        step = 8 * self.batch_size
+        result = []
+
+        for start in range(0, len(data), step):
+            batch = data[start:start + step]
+            slices, count = self.transpose_in(batch)
+            slices = self.encrypt_slices(slices, key_bits, (1 << count) - 1)
+            result.append(self.transpose_out(slices, count)[:len(batch)])
+
+        return ''.join(result)
+
+    def encrypt_slices(self, slices, key_bits, ones):
+        """
+        Applies every round of every stage to a set of bit slices.
+
+        :param slices: list of 64 integers, one per bit position.
+        :param key_bits: for every stage, a list of sub keys given as lists
+        of bits, one per bit of the expansion.
+        :param ones: integer with one set bit per block in the slices.
+        :return: list of 64 encrypted slices.
+        """
+
+        e_index = self.e_index
+        p_index = self.p_index
+        left = slices[:32]
+        right = slices[32:]
+
+        for sub_keys in key_bits:
+            for k in sub_keys:
+                # Expansion is a renaming; a set key bit inverts its slice.
+                x = [right[e] ^ ones if k[i] else right[e]
+                     for i, e in enumerate(e_index)]
+
+                out = []
+                for i, minterms in enumerate(self.minterms):
+                    out.extend(self.s_box(x[6 * i:6 * i + 6], minterms, ones))
+
+                left, right = right, [left[i] ^ out[p]
+                                      for i, p in enumerate(p_index)]
+
+            left, right = right, left
+
+        return left + right
+
+    @staticmethod
+    def s_box(bits, minterms, ones):
+        """
+        Evaluates an S-box as a boolean circuit. All 32 minterms of the five
+        used input bits are decoded with a tree of AND gates, and every
+        output bit is the OR of its minterms.
+
+        :param bits: six input slices.
+        :param minterms: output of s_box_minterms() for the box.
+        :param ones: integer with one set bit per block in the slices.
+        :return: four output slices.
+        """
+
+        b0, b1, b2, b3, _, b5 = bits
+
+        terms = [b0 ^ ones, b0]
+        for var in (b5, b1, b2, b3):
+            inv = var ^ ones
+            terms = [t for term in terms for t in (term & inv, term & var)]
+
+        out = []
+        for indices in minterms:
+            value = 0
+            for m in indices:
+                value |= terms[m]
+            out.append(value)
+        return out
+
+    @staticmethod
+    def transpose_in(data):
+        """
+        Transposes blocks into bit slices. Slice i holds bit i of every
+        block, counting from the most significant bit of the block, with the
+        first block in the most significant bit of the slice.
+
+        :param data: byte string whose length is a multiple of 8.
+        :return: tuple of the 64 slices and the number of blocks in them,
+        rounded up to a multiple of 8.
+        """
+
+        count = len(data) // 8
+        pad = -count % 8
+        bits = bitarray()
+        bits.frombytes(data + '\x00' * (8 * pad))
+
+        slices = [bitops.bytes_to_int(bits[i::64].tobytes())
+                  for i in range(64)]
+        return slices, count + pad
+
+    @staticmethod
+    def transpose_out(slices, count):
+        """
+        Reverses transpose_in().
+
+        :param slices: list of 64 slices.
+        :param count: number of blocks in the slices, a multiple of 8.
+        :return: byte string of the blocks.
+        """
+
+        bits = bitarray(64 * count)
+        for i, s in enumerate(slices):
+            column = bitarray()
+            column.frombytes(bitops.int_to_bytes(s, count // 8))
+            bits[i::64] = column
+        return bits.tobytes()
@@ -6,19 +6,20 @@
 # @version V1.0.0
 # @date    9-Sep-2014
 # @brief   Some self explaining utility functions for bit and list
-# manipulation.
+# manipulation. The conversions are built on bitops, which also holds the
+# integer counterparts of the list functions.
 ###############################################################################
 
 
+import bitops
+
+
 def int_to_bin(s):
-    return str(s) if s <= 1 else bin(s >> 1) + str(s & 1)
+    return str(s) if s <= 1 else bin(s)
 
 
 def bin_to_int(bits):
-    out = 0
-    for bit in bits:
-        out = (out << 1) | bit
-    return out
+    return bitops.bits_to_int(bits)
 
 
 def rotate(arr, places):
@@ -45,3 +46,25 @@ def split_list(a_list):
 def swap_list(a_list):
     left, right = split_list(a_list)
     return right + left
+
+
+def to_bytes(data):
+    """
+    Returns the contents of a byte string, bytearray, memoryview or other
+    buffer as a byte string. Byte strings are returned as they are.
+    """
+    if isinstance(data, str):
+        return data
+    if isinstance(data, memoryview):
+        return data.tobytes()
+    if isinstance(data, unicode):
+        raise TypeError('unicode text must be encoded before encryption')
+    return str(bytearray(data))
+
+
+def xor_bytes(a, b):
+    """
+    XORs two byte strings of equal length.
+    """
+    return bitops.int_to_bytes(
+        bitops.bytes_to_int(a) ^ bitops.bytes_to_int(b), len(a))
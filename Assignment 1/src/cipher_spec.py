@@ -0,0 +1,120 @@
+# !/usr/bin/python
+
+##############################################################################
+# @file    cipher_spec.py
+# @brief   This class describes a variant of the Feistel cipher by its lookup
+# tables and sizes. A spec is validated once and then compiled into a
+# FeistelCipher whose backend has its lookup tables, and if needed its
+# round loops, built for exactly those tables.
+###############################################################################
+
+
+from des import DES
+from feistel_cipher import FeistelCipher
+
+
+class CipherSpec(object):
+    def __init__(self, S=None, P=None, E=None, PC2=None, key_shifts=None,
+                 number_of_rounds=None, block_size=64, key_size=56):
+        """
+        Tables that are not given are taken from DES. Positions in the
+        permutation tables are 1-indexed, like the tables in DES.
+
+        :param S: list of S-boxes, each with 4 rows of at least 8 columns.
+        :param P: permutation of the S-box outputs into a half block.
+        :param E: expansion of a half block into 6 bits per S-box.
+        :param PC2: selection of the sub key bits from the shifted key.
+        :param key_shifts: rotation of the key halves in every round.
+        :param number_of_rounds: number of rounds. Defaults to one round per
+        key shift.
+        :param block_size: number of bits in a block.
+        :param key_size: number of bits in a key.
+        """
+
+        self.S = [[list(row) for row in box] for box in
+                  (DES.S if S is None else S)]
+        self.P = list(DES.P if P is None else P)
+        self.E = list(DES.E if E is None else E)
+        self.PC2 = list(DES.PC2 if PC2 is None else PC2)
+        self.key_shifts = list(DES.key_shifts if key_shifts is None
+                               else key_shifts)
+        if number_of_rounds is None:
+            number_of_rounds = len(self.key_shifts)
+        self.number_of_rounds = number_of_rounds
+        self.block_size = block_size
+        self.key_size = key_size
+
+        self.validate()
+
+    def validate(self):
+        """
+        Checks that the tables fit together and with the sizes of the spec.
+
+        :raise ValueError: if the spec does not describe a valid cipher.
+        """
+
+        if self.block_size <= 0 or self.block_size % 2:
+            raise ValueError('Block size must be a positive even number')
+        half_size = self.block_size // 2
+
+        if not 0 < self.number_of_rounds <= len(self.key_shifts):
+            raise ValueError('Need one key shift for each of the %d rounds'
+                             % self.number_of_rounds)
+        if any(shift < 0 for shift in self.key_shifts):
+            raise ValueError('Key shifts must not be negative')
+
+        if not self.S:
+            raise ValueError('At least one S-box is required')
+        for i, box in enumerate(self.S):
+            if len(box) != 4 or any(len(row) < 8 for row in box):
+                raise ValueError('S-box %d must have 4 rows of at least 8 '
+                                 'columns' % (i + 1))
+            # Like DES.S8, the last box may hold values wider than four
+            # bits, which are truncated to their four most significant bits.
+            limit = None if i == len(self.S) - 1 else 16
+            for row in box:
+                for value in row[:8]:
+                    if value < 0 or (limit is not None and value >= limit):
+                        raise ValueError('S-box %d holds %d, which does not '
+                                         'fit in four bits' % (i + 1, value))
+
+        self.check_table('E', self.E, 6 * len(self.S), half_size)
+        self.check_table('P', self.P, half_size, 4 * len(self.S))
+        self.check_table('PC2', self.PC2, len(self.E), self.key_size)
+
+    @staticmethod
+    def check_table(name, table, length, width):
+        """
+        :param name: name of the table, used in error messages.
+        :param table: permutation table to check.
+        :param length: required number of entries.
+        :param width: number of bits the entries may point into.
+        :raise ValueError: if the table does not have the given length, or
+        points outside of the given width.
+        """
+
+        if len(table) != length:
+            raise ValueError('%s must have %d entries, not %d'
+                             % (name, length, len(table)))
+        for p in table:
+            if not 1 <= p <= width:
+                raise ValueError('%s entry %d is outside of 1-%d'
+                                 % (name, p, width))
+
+    def compile(self, backend='int', key_cache_size=64):
+        """
+        Builds a cipher for this spec. The lookup tables of the backend are
+        computed from the tables of the spec, and backends whose round loops
+        are written for the eight S-boxes of DES get loops generated for the
+        number of S-boxes in the spec, so every variant runs on the same
+        fast path as DES.
+
+        :param backend: one of FeistelCipher.BACKENDS. The integer based
+        backends require 64 bit blocks.
+        :param key_cache_size: number of key schedules kept by the cipher.
+        :return: a FeistelCipher.
+        """
+
+        return FeistelCipher(self.number_of_rounds, self.block_size,
+                             self.key_size, backend, key_cache_size,
+                             tables=self)
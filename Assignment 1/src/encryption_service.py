@@ -0,0 +1,507 @@
+# !/usr/bin/python
+
+##############################################################################
+# @file    encryption_service.py
+# @brief   Local encryption service for many clients encrypting small
+# records. Requests arrive over a Unix socket or local TCP with a length
+# prefixed protocol, and concurrent requests using the same key and
+# operation are coalesced into one call of the cipher.
+###############################################################################
+
+import argparse
+import os
+import Queue
+import socket
+import SocketServer
+import struct
+import threading
+import timeit
+
+from feistel_cipher import FeistelCipher
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# A request is a header followed by the key and the data. The header holds
+# the operation, the length of the key and the length of the data.
+REQUEST_HEADER = struct.Struct('>BHI')
+
+# A response is a header followed by the result, or by an error message if
+# the status is not OK. The header holds the status and the payload length.
+RESPONSE_HEADER = struct.Struct('>BI')
+
+OK = 0
+ERROR = 1
+
+# Operations, numbered by their position in the list.
+OPERATIONS = ['encrypt', 'decrypt', 'triple_encrypt', 'triple_decrypt']
+
+# Largest record accepted by the service.
+MAX_RECORD_SIZE = 1 << 24
+
+
+def read_exactly(sock, size):
+    """
+    :return: the next size bytes from the socket, or None if the connection
+    is closed before the first byte arrives.
+    """
+
+    chunks = []
+    remaining = size
+
+    while remaining:
+        chunk = sock.recv(remaining)
+        if not chunk:
+            if remaining == size:
+                return None
+            raise IOError('Connection closed in the middle of a message')
+        chunks.append(chunk)
+        remaining -= len(chunk)
+
+    return ''.join(chunks)
+
+
+def pad(data, block):
+    """
+    Pads a record to whole blocks the way FeistelCipher.encrypt_bytes()
+    does, i.e. with zeros in front of the bytes of a short last block, so
+    that records joined into one call are encrypted exactly as they would
+    be on their own.
+    """
+
+    full = len(data) - len(data) % block
+    if full == len(data):
+        return data
+    return data[:full] + data[full:].rjust(block, '\x00')
+
+
+class LatencyHistogram(object):
+    def __init__(self, buckets=32):
+        """
+        Histogram with buckets that double in width. Bucket i counts the
+        latencies below 2**i microseconds that fall in no earlier bucket,
+        and the last bucket counts everything above.
+
+        :param buckets: number of buckets.
+        """
+
+        self.counts = [0] * buckets
+        self.total = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        """
+        :param seconds: latency of one request.
+        """
+
+        bucket = min(int(seconds * 1e6).bit_length(), len(self.counts) - 1)
+        with self.lock:
+            self.counts[bucket] += 1
+            self.total += seconds
+
+    def count(self):
+        return sum(self.counts)
+
+    def mean(self):
+        return self.total / self.count() if self.count() else 0.0
+
+    def percentile(self, p):
+        """
+        :param p: percentile between 0 and 100.
+        :return: upper bound in seconds of the bucket holding the given
+        percentile.
+        """
+
+        rank = p / 100.0 * self.count()
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if c and seen >= rank:
+                return (1 << i) / 1e6
+        return 0.0
+
+    def as_dict(self):
+        return {
+            'count': self.count(),
+            'mean': self.mean(),
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'buckets': list(self.counts),
+        }
+
+
+class Request(object):
+    def __init__(self, operation, key, data):
+        """
+        :param operation: index into OPERATIONS.
+        :param key: raw key of the operation.
+        :param data: byte string to be processed.
+        """
+
+        self.operation = operation
+        self.key = key
+        self.data = data
+        self.received = timeit.default_timer()
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def finish(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.done.set()
+
+
+class Batcher(object):
+    def __init__(self, cipher, max_batch_size=256, max_wait=0.001,
+                 max_pending=4096):
+        """
+        Collects requests from all connections and processes them in
+        batches on a single thread. A batch is closed when it holds
+        max_batch_size requests or when max_wait has passed since its first
+        request arrived. The records of the requests in a batch that share a
+        key and an operation are padded to whole blocks, joined and run
+        through the cipher in one call.
+
+        :param cipher: FeistelCipher or ParallelCipher doing the work.
+        :param max_batch_size: largest number of requests in a batch.
+        :param max_wait: longest time in seconds a batch waits for more
+        requests.
+        :param max_pending: number of requests that may wait for a batch.
+        Connections block when it is reached, which stops them from reading
+        more requests off their sockets.
+        """
+
+        self.cipher = cipher
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = Queue.Queue(max_pending)
+        self.latency = LatencyHistogram()
+        self.batches = 0
+        self.requests = 0
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+
+    def submit(self, request):
+        """
+        Queues a request and waits for its result.
+
+        :return: the finished request.
+        """
+
+        self.queue.put(request)
+        request.done.wait()
+        return request
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            if not batch:
+                return
+            self.process(batch)
+            if batch[-1] is None:
+                return
+
+    def next_batch(self):
+        """
+        :return: list of requests, ending with None if the batcher was
+        stopped while it was collected.
+        """
+
+        first = self.queue.get()
+        if first is None:
+            return []
+
+        batch = [first]
+        deadline = first.received + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - timeit.default_timer()
+            try:
+                if remaining > 0:
+                    request = self.queue.get(timeout=remaining)
+                else:
+                    request = self.queue.get_nowait()
+            except Queue.Empty:
+                break
+            batch.append(request)
+            if request is None:
+                break
+
+        return batch
+
+    def process(self, batch):
+        groups = {}
+        for request in batch:
+            if request is not None:
+                groups.setdefault((request.operation, request.key),
+                                  []).append(request)
+
+        outcomes = []
+        for (operation, key), requests in groups.items():
+            try:
+                results = self.process_group(operation, key, requests)
+                outcomes.extend((r, result, None)
+                                for r, result in zip(requests, results))
+            except Exception as e:
+                error = str(e) or e.__class__.__name__
+                outcomes.extend((r, None, error) for r in requests)
+
+        # The counters are updated before any request is answered, so a
+        # client that has its answer also sees it in stats().
+        finished = timeit.default_timer()
+        for request, _, _ in outcomes:
+            self.latency.record(finished - request.received)
+        self.requests += len(outcomes)
+        self.batches += 1
+
+        for request, result, error in outcomes:
+            request.finish(result, error)
+
+    def process_group(self, operation, key, requests):
+        """
+        :return: list of the results of the requests, which share an
+        operation and a key.
+        """
+
+        name = OPERATIONS[operation]
+        encrypt = name.endswith('encrypt')
+        if name.startswith('triple'):
+            stages = self.cipher.triple_stages(key, encrypt)
+        else:
+            stages = [self.cipher.key_schedule(key).sub_keys(encrypt)]
+
+        block = self.cipher.block_size // 8
+        sizes = [-(-len(r.data) // block) * block for r in requests]
+        data = ''.join(pad(r.data, block) for r in requests)
+        result = self.cipher.process_bytes(data, stages)
+
+        results = []
+        offset = 0
+        for size in sizes:
+            results.append(result[offset:offset + size])
+            offset += size
+        return results
+
+    def stats(self):
+        """
+        :return: dictionary of the batch counts and the latency histogram.
+        """
+
+        return {
+            'requests': self.requests,
+            'batches': self.batches,
+            'mean_batch_size': (float(self.requests) / self.batches
+                                if self.batches else 0.0),
+            'latency': self.latency.as_dict(),
+        }
+
+
+class ConnectionHandler(SocketServer.BaseRequestHandler):
+    def handle(self):
+        sock = self.request
+
+        while True:
+            header = read_exactly(sock, REQUEST_HEADER.size)
+            if header is None:
+                return
+            operation, key_length, data_length = REQUEST_HEADER.unpack(header)
+
+            if data_length > MAX_RECORD_SIZE:
+                self.respond(ERROR, 'Record is too large')
+                return
+            key = read_exactly(sock, key_length) if key_length else ''
+            data = read_exactly(sock, data_length) if data_length else ''
+            if key is None or data is None:
+                return
+
+            if operation >= len(OPERATIONS):
+                self.respond(ERROR, 'Unknown operation')
+                continue
+
+            request = self.server.batcher.submit(
+                Request(operation, key, data))
+            if request.error is not None:
+                self.respond(ERROR, request.error)
+            else:
+                self.respond(OK, request.result)
+
+    def respond(self, status, payload):
+        self.request.sendall(RESPONSE_HEADER.pack(status, len(payload)) +
+                             payload)
+
+
+class TCPEncryptionServer(SocketServer.ThreadingMixIn,
+                          SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+if hasattr(SocketServer, 'UnixStreamServer'):
+    class UnixEncryptionServer(SocketServer.ThreadingMixIn,
+                               SocketServer.UnixStreamServer):
+        daemon_threads = True
+
+
+class EncryptionService(object):
+    def __init__(self, address, cipher=None, max_batch_size=256,
+                 max_wait=0.001, max_pending=4096):
+        """
+        :param address: (host, port) tuple for local TCP, or a path for a
+        Unix socket.
+        :param cipher: FeistelCipher or ParallelCipher doing the work.
+        Defaults to the 'numpy' backend if NumPy is installed, else the
+        'int' backend.
+        :param max_batch_size: see Batcher.
+        :param max_wait: see Batcher.
+        :param max_pending: see Batcher.
+        """
+
+        if cipher is None:
+            cipher = FeistelCipher(backend='numpy' if numpy else 'int')
+
+        self.batcher = Batcher(cipher, max_batch_size, max_wait, max_pending)
+        if isinstance(address, tuple):
+            self.server = TCPEncryptionServer(address, ConnectionHandler)
+        else:
+            self.server = UnixEncryptionServer(address, ConnectionHandler)
+        self.server.batcher = self.batcher
+        self.thread = None
+
+    @property
+    def address(self):
+        return self.server.server_address
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start(self):
+        """
+        Serves requests on a background thread.
+        """
+
+        self.batcher.start()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def serve_forever(self):
+        """
+        Serves requests on the calling thread.
+        """
+
+        self.batcher.start()
+        try:
+            self.server.serve_forever()
+        finally:
+            self.close()
+
+    def close(self):
+        if self.thread is not None:
+            self.server.shutdown()
+            self.thread.join()
+            self.thread = None
+        self.server.server_close()
+        if not isinstance(self.address, tuple) and os.path.exists(
+                self.address):
+            os.remove(self.address)
+        if self.batcher.thread is not None:
+            self.batcher.stop()
+
+    def stats(self):
+        return self.batcher.stats()
+
+
+class EncryptionClient(object):
+    def __init__(self, address):
+        """
+        :param address: address of an EncryptionService.
+        """
+
+        if isinstance(address, tuple):
+            self.sock = socket.create_connection(address)
+        else:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(address)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.sock.close()
+
+    def request(self, operation, data, key):
+        """
+        :param operation: name of an operation in OPERATIONS.
+        :param data: byte string to be processed.
+        :param key: raw key.
+        :return: byte string of the result, padded to whole blocks.
+        """
+
+        self.sock.sendall(REQUEST_HEADER.pack(OPERATIONS.index(operation),
+                                              len(key), len(data)) +
+                          key + data)
+        status, length = RESPONSE_HEADER.unpack(
+            read_exactly(self.sock, RESPONSE_HEADER.size))
+        payload = read_exactly(self.sock, length) if length else ''
+        if status != OK:
+            raise ValueError(payload)
+        return payload
+
+    def encrypt(self, data, key):
+        return self.request('encrypt', data, key)
+
+    def decrypt(self, data, key):
+        return self.request('decrypt', data, key)
+
+    def triple_encrypt(self, data, key):
+        return self.request('triple_encrypt', data, key)
+
+    def triple_decrypt(self, data, key):
+        return self.request('triple_decrypt', data, key)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Serve FeistelCipher requests to local clients.')
+    parser.add_argument('--unix', help='path of a Unix socket to listen on')
+    parser.add_argument('--port', type=int, default=5100,
+                        help='local TCP port to listen on')
+    parser.add_argument('-b', '--backend', default=None,
+                        choices=FeistelCipher.BACKENDS)
+    parser.add_argument('--max-batch-size', type=int, default=256)
+    parser.add_argument('--max-wait', type=float, default=0.001,
+                        help='seconds a batch waits for more requests')
+    parser.add_argument('--max-pending', type=int, default=4096)
+    args = parser.parse_args()
+
+    cipher = None
+    if args.backend is not None:
+        cipher = FeistelCipher(backend=args.backend)
+    address = args.unix or ('127.0.0.1', args.port)
+
+    EncryptionService(address, cipher, args.max_batch_size, args.max_wait,
+                      args.max_pending).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -13,27 +13,526 @@
 from bitarray import bitarray
 
 from des import DES
+from int_engine import IntEngine
+from key_schedule import KeySchedule
+from lru_cache import LRUCache
 import bitutils
 
 
 class FeistelCipher(object):
-    def __init__(self, number_of_rounds=16, block_size=64, key_size=56):
+
+    # Available round engines. 'bitarray' is the reference implementation
+    # found in this class, 'int' keeps every block as an integer and uses
+    # precomputed lookup tables, 'numpy' applies those tables to every
+    # block of a message at once (requires NumPy) and 'bitsliced' transposes
+    # batches of blocks into one integer per bit position.
+    BACKENDS = ('bitarray', 'int', 'numpy', 'bitsliced')
+
+    # Number of bytes read from a stream at a time.
+    STREAM_BUFFER_SIZE = 1 << 16
+
+    def __init__(self, number_of_rounds=16, block_size=64, key_size=56,
+                 backend='bitarray', key_cache_size=64, tables=DES,
+                 block_cache_size=0):
+        """
+        :param tables: lookup tables of the cipher, i.e. DES or a CipherSpec.
+        :param block_cache_size: If set, the results of up to this many
+        blocks are cached per key schedule, so that a block that has been
+        seen before under the same key skips all rounds. Off by default.
+        """
+
+        if backend not in FeistelCipher.BACKENDS:
+            raise ValueError('Unknown backend: %s' % backend)
 
         self.number_of_rounds = number_of_rounds
         self.block_size = block_size
         self.key_size = key_size
+        self.backend = backend
+        self.tables = tables
+
+        engine = None
+        if backend == 'int':
+            engine = IntEngine
+        elif backend == 'numpy':
+            from numpy_engine import NumpyEngine
+            engine = NumpyEngine
+        elif backend == 'bitsliced':
+            from bitsliced_engine import BitslicedEngine
+            engine = BitslicedEngine
+
+        self.engine = None
+        if engine is not None:
+            self.engine = engine.specialized(len(tables.S))(
+                number_of_rounds, block_size, tables)
+
+        self.key_cache = LRUCache(key_cache_size)
+
+        # One LRUCache of blocks per set of stages, keyed by the sub keys.
+        self.block_cache_size = block_cache_size
+        self.block_caches = None
+        if block_cache_size:
+            self.block_caches = LRUCache(key_cache_size)
 
     def triple_encrypt(self, text, key):
-        cipher1 = self.encrypt(text, key[:7])
-        cipher2 = self.encrypt(cipher1.to01(), key[7:14])
-        cipher3 = self.encrypt(cipher2.to01(), key[14:21])
-        return cipher3
+        """
+        Encrypts the text three times using the three 56 bit parts of the
+        key. Every block passes through all three encryptions before the
+        next block is processed, so the intermediate results never leave
+        their native form.
+
+        :param text: plaintext to be encrypted.
+        :param key: 168 bit key, or three keys or KeySchedules.
+        :return: a bitarray of the encrypted data.
+        """
+
+        return self.process_text(text, self.triple_stages(key, True))
 
     def triple_decrypt(self, text, key):
-        plaintext1 = self.decrypt(text, key[14:21])
-        plaintext2 = self.decrypt(plaintext1.to01(), key[7:14])
-        plaintext3 = self.decrypt(plaintext2.to01(), key[:7])
-        return plaintext3
+        """
+        Reverses triple_encrypt().
+
+        :param text: ciphertext to be decrypted.
+        :param key: the key that was used for encryption.
+        :return: a bitarray of the decrypted data.
+        """
+
+        return self.process_text(text, self.triple_stages(key, False))
+
+    def encrypt_bytes(self, data, key, out=None):
+        """
+        Encrypts a byte string. Unlike encrypt(), the input is always treated
+        as raw bytes, so no attempt is made at detecting binary strings.
+
+        :param data: byte string, bytearray or memoryview to be encrypted.
+        :param key: key used to encrypt the data, either raw or as a
+        KeySchedule.
+        :param out: optional writable buffer to write the ciphertext into.
+        It must have room for len(data) rounded up to a whole block.
+        :return: byte string of the encrypted data, or the number of bytes
+        written if out was given.
+        """
+
+        return self.process_bytes(data,
+                                  [self.key_schedule(key).sub_keys(True)],
+                                  out)
+
+    def decrypt_bytes(self, data, key, out=None):
+        """
+        Reverses encrypt_bytes().
+
+        :param data: byte string, bytearray or memoryview to be decrypted.
+        :param key: key that was used for encryption.
+        :param out: optional writable buffer to write the plaintext into.
+        :return: byte string of the decrypted data, or the number of bytes
+        written if out was given.
+        """
+
+        return self.process_bytes(data,
+                                  [self.key_schedule(key).sub_keys(False)],
+                                  out)
+
+    def triple_encrypt_bytes(self, data, key, out=None):
+        """
+        Byte string counterpart of triple_encrypt().
+
+        :param data: byte string, bytearray or memoryview to be encrypted.
+        :param key: 168 bit key, or three keys or KeySchedules.
+        :param out: optional writable buffer to write the ciphertext into.
+        :return: byte string of the encrypted data, or the number of bytes
+        written if out was given.
+        """
+
+        return self.process_bytes(data, self.triple_stages(key, True), out)
+
+    def triple_decrypt_bytes(self, data, key, out=None):
+        """
+        Byte string counterpart of triple_decrypt().
+
+        :param data: byte string, bytearray or memoryview to be decrypted.
+        :param key: the key that was used for encryption.
+        :param out: optional writable buffer to write the plaintext into.
+        :return: byte string of the decrypted data, or the number of bytes
+        written if out was given.
+        """
+
+        return self.process_bytes(data, self.triple_stages(key, False), out)
+
+    def triple_stages(self, key, encrypt=True):
+        """
+        Returns the sub keys of every stage of triple encryption, in the order
+        they should be applied.
+
+        :param key: 168 bit key, or three keys or KeySchedules.
+        :param encrypt: If set to False, the stages for decryption are
+        returned.
+        :return: list of three sub key lists.
+        """
+
+        schedules = self.triple_key_schedule(key)
+        if not encrypt:
+            schedules = reversed(schedules)
+        return [schedule.sub_keys(encrypt) for schedule in schedules]
+
+    def process_bytes(self, data, stages, out=None):
+        """
+        Runs a byte string through the given stages.
+
+        :param data: byte string, bytearray or memoryview to be processed.
+        :param stages: one list of sub keys per stage.
+        :param out: optional writable buffer to write the result into.
+        :return: byte string of the result, or the number of bytes written
+        if out was given.
+        """
+
+        if self.block_caches is not None:
+            result = IntEngine.pack_blocks(self.cached_blocks(
+                IntEngine.unpack_blocks(data), stages))
+            if out is None:
+                return result
+            out[:len(result)] = result
+            return len(result)
+
+        if out is not None:
+            return self.process_into(data, out, stages)
+
+        if self.engine is not None:
+            return self.engine.encrypt_bytes(data, *stages)
+
+        bits = bitarray()
+        bits.frombytes(bitutils.to_bytes(data))
+        return self.encrypt_bits(bits, stages).tobytes()
+
+    def process_blocks(self, blocks, stages):
+        """
+        Runs a list of integer blocks through the given stages.
+
+        :param blocks: list of integers of block_size bits.
+        :param stages: one list of sub keys per stage.
+        :return: list of processed integer blocks.
+        """
+
+        if self.engine is not None:
+            return self.engine.encrypt_blocks(blocks, *stages)
+
+        bits = bitarray()
+        bits.frombytes(IntEngine.pack_blocks(blocks))
+        result = self.encrypt_bits(bits, stages)
+        return IntEngine.unpack_blocks(result.tobytes())
+
+    def cached_blocks(self, blocks, stages):
+        """
+        Counterpart of process_blocks() that looks every block up in the
+        block cache of the stages first. Only blocks that are in neither
+        the cache nor earlier in the list are processed.
+
+        :param blocks: list of integers of block_size bits.
+        :param stages: one list of sub keys per stage.
+        :return: list of processed integer blocks.
+        """
+
+        cache = self.block_cache(stages)
+        result = [None] * len(blocks)
+        # Positions of every block that is missing from the cache.
+        pending = {}
+
+        for i, block in enumerate(blocks):
+            if block in pending:
+                pending[block].append(i)
+                cache.hits += 1
+                continue
+            value = cache.get(block)
+            if value is None:
+                pending[block] = [i]
+            else:
+                result[i] = value
+
+        if pending:
+            missing = list(pending)
+            for block, value in zip(missing,
+                                    self.process_blocks(missing, stages)):
+                value = int(value)
+                cache.put(block, value)
+                for i in pending[block]:
+                    result[i] = value
+
+        return result
+
+    def block_cache(self, stages):
+        """
+        :param stages: one list of sub keys per stage.
+        :return: the LRUCache of blocks processed with the stages.
+        """
+
+        if self.engine is None:
+            key = tuple(tuple(k.to01() for k in s) for s in stages)
+        else:
+            key = tuple(tuple(s) for s in stages)
+
+        cache = self.block_caches.get(key)
+        if cache is None:
+            cache = LRUCache(self.block_cache_size)
+            self.block_caches.put(key, cache)
+        return cache
+
+    def block_cache_stats(self):
+        """
+        :return: dictionary of the hits, misses and cached blocks of the
+        block caches of all key schedules that are still cached.
+        """
+
+        caches = []
+        if self.block_caches is not None:
+            caches = self.block_caches.entries.values()
+
+        return {
+            'hits': sum(c.hits for c in caches),
+            'misses': sum(c.misses for c in caches),
+            'blocks': sum(len(c) for c in caches),
+            'schedules': len(caches),
+        }
+
+    def process_into(self, src, dst, stages):
+        """
+        Runs the bytes of one buffer through the given stages and writes the
+        result into another buffer. The integer based backends convert the
+        blocks straight from and into the buffers; the reference backend
+        goes through a byte string.
+
+        :param src: readable buffer, e.g. an mmap.
+        :param dst: writable buffer with room for len(src) rounded up to a
+        whole number of blocks. May be the same buffer as src.
+        :param stages: one list of sub keys per stage.
+        :return: number of bytes written to dst.
+        """
+
+        if self.engine is not None:
+            return self.engine.encrypt_into(src, dst, *stages)
+
+        result = self.process_bytes(src, stages)
+        dst[:len(result)] = result
+        return len(result)
+
+    def encrypt_stream(self, reader, writer, key, buffer_size=None):
+        """
+        Encrypts everything that can be read from reader and writes the
+        ciphertext to writer. Only a single buffer is held in memory at a
+        time. The plaintext is padded with add_padding(), so that
+        decrypt_stream() restores it byte for byte, whatever its length.
+
+        :param reader: file-like object with a read(size) method.
+        :param writer: file-like object with a write(data) method.
+        :param key: key used to encrypt the data, either raw or as a
+        KeySchedule.
+        :param buffer_size: number of bytes to read at a time.
+        :return: number of bytes written.
+        """
+
+        stages = [self.key_schedule(key).sub_keys(True)]
+        return self.write_stream(writer,
+                                 self.process_stream(reader, stages,
+                                                     buffer_size, 'add'))
+
+    def decrypt_stream(self, reader, writer, key, buffer_size=None):
+        """
+        Reverses encrypt_stream(), removing the padding again.
+
+        :param reader: file-like object with a read(size) method.
+        :param writer: file-like object with a write(data) method.
+        :param key: key that was used for encryption.
+        :param buffer_size: number of bytes to read at a time.
+        :return: number of bytes written.
+        """
+
+        stages = [self.key_schedule(key).sub_keys(False)]
+        return self.write_stream(writer,
+                                 self.process_stream(reader, stages,
+                                                     buffer_size, 'remove'))
+
+    def triple_encrypt_stream(self, reader, writer, key, buffer_size=None):
+        """
+        Triple encryption counterpart of encrypt_stream().
+
+        :param reader: file-like object with a read(size) method.
+        :param writer: file-like object with a write(data) method.
+        :param key: 168 bit key, or three keys or KeySchedules.
+        :param buffer_size: number of bytes to read at a time.
+        :return: number of bytes written.
+        """
+
+        return self.write_stream(
+            writer, self.process_stream(reader, self.triple_stages(key, True),
+                                        buffer_size, 'add'))
+
+    def triple_decrypt_stream(self, reader, writer, key, buffer_size=None):
+        """
+        Reverses triple_encrypt_stream().
+
+        :param reader: file-like object with a read(size) method.
+        :param writer: file-like object with a write(data) method.
+        :param key: the key that was used for encryption.
+        :param buffer_size: number of bytes to read at a time.
+        :return: number of bytes written.
+        """
+
+        return self.write_stream(
+            writer, self.process_stream(reader, self.triple_stages(key, False),
+                                        buffer_size, 'remove'))
+
+    def process_stream(self, reader, stages, buffer_size=None, padding=None):
+        """
+        Generator that reads a stream buffer by buffer and yields the
+        processed bytes of every buffer. Bytes that do not fill a whole
+        block are carried over to the next buffer until the end of the
+        stream.
+
+        :param reader: file-like object with a read(size) method.
+        :param stages: one list of sub keys per stage.
+        :param buffer_size: number of bytes to read at a time.
+        :param padding: 'add' to pad the input with add_padding() before it
+        is processed, 'remove' to strip that padding from the output, or
+        None to pad a short last block with leading zeros like
+        process_bytes() does.
+        :return: generator of byte strings.
+        """
+
+        block_bytes = self.block_size // 8
+        buffer_size = buffer_size or FeistelCipher.STREAM_BUFFER_SIZE
+        buffer_size = max(block_bytes, buffer_size - buffer_size % block_bytes)
+        pending = ''
+        # With padding to remove, the last processed block is held back
+        # until it is known to be the last one of the stream.
+        held = ''
+
+        while True:
+            data = reader.read(buffer_size)
+            if not data:
+                break
+
+            if pending:
+                data = pending + data
+            full = len(data) - len(data) % block_bytes
+            pending = data[full:]
+
+            if full:
+                result = self.process_bytes(data[:full], stages)
+                if padding == 'remove':
+                    result, held = (held + result[:-block_bytes],
+                                    result[-block_bytes:])
+                yield result
+
+        if padding == 'add':
+            yield self.process_bytes(self.add_padding(pending), stages)
+        elif padding == 'remove':
+            if pending:
+                raise ValueError('Padded ciphertext must be a whole number '
+                                 'of blocks')
+            yield self.remove_padding(held)
+        elif pending:
+            yield self.process_bytes(pending, stages)
+
+    def add_padding(self, data):
+        """
+        Pads data to a whole number of blocks with n bytes of value n, where
+        n is between 1 and the number of bytes in a block. Unlike the
+        leading zeros of a short last block, this padding can be removed
+        again without knowing the length of the data.
+
+        :param data: byte string.
+        :return: the padded byte string.
+        """
+
+        n = self.block_size // 8 - len(data) % (self.block_size // 8)
+        return data + chr(n) * n
+
+    def remove_padding(self, data):
+        """
+        Reverses add_padding().
+
+        :param data: padded byte string, or at least its last block.
+        :return: the byte string without the padding.
+        """
+
+        n = ord(data[-1]) if data else 0
+        if (not 0 < n <= min(len(data), self.block_size // 8) or
+                data[-n:] != data[-1] * n):
+            raise ValueError('Invalid padding')
+        return data[:-n]
+
+    @staticmethod
+    def write_stream(writer, chunks):
+        """
+        Writes every chunk produced by a generator.
+
+        :param writer: file-like object with a write(data) method.
+        :param chunks: iterable of byte strings.
+        :return: number of bytes written.
+        """
+
+        written = 0
+        for chunk in chunks:
+            writer.write(chunk)
+            written += len(chunk)
+        return written
+
+    def key_schedule(self, key):
+        """
+        Returns the expanded key schedule for a key. Schedules are kept in a
+        bounded LRU cache keyed by the key material, so repeated use of the
+        same key only pays for the expansion once.
+
+        :param key: raw key or a KeySchedule returned by this function.
+        :return: a KeySchedule holding the forward and reverse sub keys.
+        """
+
+        if isinstance(key, KeySchedule):
+            if (key.backend != self.backend or
+                    key.number_of_rounds != self.number_of_rounds or
+                    key.tables is not self.tables):
+                raise ValueError('Key schedule was prepared for a different '
+                                 'cipher configuration')
+            return key
+
+        schedule = self.key_cache.get(key)
+        if schedule is None:
+            schedule = self.expand_key(key)
+            self.key_cache.put(key, schedule)
+
+        return schedule
+
+    def triple_key_schedule(self, key):
+        """
+        Returns the three key schedules used by triple encryption.
+
+        :param key: raw 168 bit key, or a sequence of three keys or
+        KeySchedules.
+        :return: tuple of three KeySchedules.
+        """
+
+        if isinstance(key, (tuple, list)):
+            if len(key) != 3:
+                raise ValueError('Triple encryption requires three keys')
+            keys = key
+        else:
+            keys = (key[:7], key[7:14], key[14:21])
+
+        return tuple(self.key_schedule(k) for k in keys)
+
+    def expand_key(self, key):
+        """
+        Expands a raw key into a KeySchedule without consulting the cache.
+
+        :param key: raw key.
+        :return: a KeySchedule holding the forward and reverse sub keys.
+        """
+
+        bits = self.parse_text(key)
+
+        if self.engine is not None:
+            sub_keys = self.engine.generate_sub_keys(bits)
+        else:
+            sub_keys = self.generate_sub_keys(bits)
+
+        return KeySchedule(sub_keys, self.backend, self.tables)
 
     def encrypt(self, text, key, encrypt=True):
         """
@@ -45,41 +544,92 @@ class FeistelCipher(object):
             1. Plaintext/cipher gets parsed.
             2. Input is split into chunks of 64 bits (zero padding is applied
                to the last block if needed.
-            3. A list of sub keys are generated. The will be one unique key per
+            3. The key schedule is looked up, or generated if the key has
+               not been seen recently. There will be one unique key per
                round.
-            4. If decryption should be applied, the list of sub keys will be
-               reversed.
+            4. If decryption should be applied, the reversed list of sub
+               keys will be used.
             5. Apply a 16 round encryption to every block of data.
 
         :param text: Data that will be encrypted/decrypted. Could be either
         plaintext or ciphertext.
-        :param key: key used to encrypt/decrypt the data.
+        :param key: key used to encrypt/decrypt the data, either raw or as a
+        KeySchedule.
         :param encrypt: If set to False, decryption will be applied. Default
         value is True.
         :return: a bitarray of the encrypted/decrypted data.
         """
 
+        return self.process_text(text,
+                                 [self.key_schedule(key).sub_keys(encrypt)])
+
+    def process_text(self, text, stages):
+        """
+        Compatibility layer between the text based API and the bytes API.
+        Binary strings of '0' and '1' are parsed into bits, anything else is
+        handed to the backend as raw bytes.
+
+        :param text: plaintext, ciphertext or binary string.
+        :param stages: one list of sub keys per stage.
+        :return: a bitarray of the result.
+        """
+
+        if self.block_caches is not None:
+            result = bitarray()
+            result.frombytes(IntEngine.pack_blocks(self.cached_blocks(
+                IntEngine.to_blocks(self.parse_text(text)), stages)))
+            return result
+
+        if self.engine is None or self.is_binary(text):
+            return self.encrypt_bits(self.parse_text(text), stages)
+
         result = bitarray()
+        result.frombytes(self.engine.encrypt_bytes(text, *stages))
+        return result
 
-        bits = self.parse_text(text)
+    def encrypt_bits(self, bits, stages):
+        """
+        Applies one or more encryption stages to parsed data. Every block is
+        pushed through all of the stages before the next block is processed,
+        which gives the same result as encrypting the whole output of one
+        stage with the next.
+
+        :param bits: bitarray of plaintext or ciphertext.
+        :param stages: one list of sub keys per stage, in the order they
+        should be applied.
+        :return: a bitarray of the encrypted/decrypted data.
+        """
 
-        blocks = FeistelCipher.chunks(bits, self.block_size)
+        if self.engine is not None:
+            return self.engine.encrypt(bits, *stages)
 
-        sub_keys = self.generate_sub_keys(self.parse_text(key))
+        result = []
 
-        if not encrypt:
-            sub_keys.reverse()
+        blocks = self.chunks(bits, self.block_size)
 
         for i in range(len(blocks)):
             block = blocks[i]
 
-            for rnd in range(self.number_of_rounds):
-                block = self.encrypt_round(block, sub_keys[rnd])
+            for sub_keys in stages:
+                for rnd in range(self.number_of_rounds):
+                    block = self.encrypt_round(block, sub_keys[rnd])
 
-            block = bitutils.swap_list(block)
+                block = bitutils.swap_list(block)
 
-            result.extend(block)
+            result.append(block)
+
+        return self.join_blocks(result)
+
+    @staticmethod
+    def join_blocks(blocks):
+        """
+        :param blocks: list of bitarrays.
+        :return: a bitarray of the blocks one after another.
+        """
 
+        result = bitarray()
+        for block in blocks:
+            result.extend(block)
         return result
 
     def decrypt(self, ciphertext, key):
@@ -125,21 +675,22 @@ class FeistelCipher(object):
         """
 
         # 32 bit => 48 bit
-        bits = self.permute(bits, DES.E)
+        bits = self.permute(bits, self.tables.E)
         # 48 bit XOR 48 bit
         bits ^= sub_key
         # 48 bit => 32 bit
         bits = self.substitute(bits)
         # 32 bit => 32 bit
-        bits = self.permute(bits, DES.P)
+        bits = self.permute(bits, self.tables.P)
 
         return bits
 
     def substitute(self, bits):
         """
         This is the "heart" of the algorithm. The function applies
-        substitution to the data according to the well defined S-boxes used in
-        DES.
+        substitution to the data according to the S-boxes of the cipher,
+        which are the well defined S-boxes used in DES unless other tables
+        were given.
 
         :param bits: the data to substitute.
         :return: diffused data.
@@ -157,7 +708,7 @@ class FeistelCipher(object):
             row = bitutils.bin_to_int(outer_bits)
             col = bitutils.bin_to_int(inner_bits)
 
-            s = DES.S[i][row][col]
+            s = self.tables.S[i][row][col]
             b = '{0:04b}'.format(s)
             new_bits.extend(b)
 
@@ -179,12 +730,13 @@ class FeistelCipher(object):
         left, right = bitutils.split_list(key)
 
         for i in range(self.number_of_rounds):
-            left = bitutils.rotate(left, -DES.key_shifts[i])
-            right = bitutils.rotate(right, DES.key_shifts[i])
+            shift = self.tables.key_shifts[i]
+            left = bitutils.rotate(left, -shift)
+            right = bitutils.rotate(right, shift)
 
             shifted_key = left + right
 
-            sub_key = self.permute(shifted_key, DES.PC2)
+            sub_key = self.permute(shifted_key, self.tables.PC2)
 
             sub_keys.append(sub_key)
 
@@ -236,16 +788,20 @@ class FeistelCipher(object):
         :return: a bitarray of the parsed plaintext.
         """
 
-        binary = True
-
-        for c in plaintext:
-            if c is not "0" and c is not "1":
-                binary = False
-
-        if binary:
+        if FeistelCipher.is_binary(plaintext):
             parsed = bitarray(plaintext)
         else:
             parsed = bitarray()
             parsed.frombytes(plaintext)
 
         return parsed
+
+    @staticmethod
+    def is_binary(text):
+        """
+        :param text: text to check.
+        :return: True if the text only consists of the characters '0' and
+        '1'.
+        """
+
+        return not text.strip('01')
@@ -10,12 +10,38 @@
 ###############################################################################
 
 
+import os
+import shutil
+import tempfile
+import threading
 import unittest
 import time
+from StringIO import StringIO
 
 from bitarray import bitarray
 
 from feistel_cipher import FeistelCipher
+from key_search import KeySearch
+import bitops
+import bitutils
+from lru_cache import LRUCache
+import avalanche
+from encryption_service import EncryptionClient, EncryptionService
+from cipher_spec import CipherSpec
+from des import DES
+from modes import CBCMode, CTRMode
+import mapped_file
+from parallel_cipher import ParallelCipher
+from profiler import Profiler
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Backends that can be exercised in this environment.
+BACKENDS = [b for b in FeistelCipher.BACKENDS
+            if b != 'numpy' or numpy is not None]
 
 
 def encrypt_ascii(text_to_encrypt):
@@ -184,6 +210,618 @@ class FeistelCipherTestCase(unittest.TestCase):
 
         self.assertGreaterEqual(min, 20)
 
+    def test_backends_match_reference(self):
+        """
+        Every backend must produce output identical to the reference
+        bitarray implementation for ascii, binary and triple encryption.
+        """
+
+        from bitsliced_engine import BitslicedEngine
+
+        reference = FeistelCipher()
+        # Long enough for the bitsliced engine not to fall back to integers.
+        long_text = self.long_string * 2
+        self.assertGreater(len(long_text) // 8,
+                           BitslicedEngine.MIN_VECTOR_SIZE)
+
+        for backend in BACKENDS:
+            fast = FeistelCipher(backend=backend)
+
+            for text in [long_text, 'ssssssss',
+                         '1010010100101010100001']:
+                for key in ['sandvest', 'stiansa']:
+                    cipher = reference.encrypt(text, key)
+                    self.assertEquals(cipher, fast.encrypt(text, key))
+                    self.assertEquals(reference.decrypt(cipher.to01(), key),
+                                      fast.decrypt(cipher.to01(), key))
+
+            key = 'stiansandvestiansandv'
+            text = long_text
+            cipher = reference.triple_encrypt(text, key)
+            self.assertEquals(cipher, fast.triple_encrypt(text, key))
+            self.assertEquals(reference.triple_decrypt(cipher.to01(), key),
+                              fast.triple_decrypt(cipher.to01(), key))
+
+    def test_compiled_cipher_spec(self):
+        """
+        A cipher compiled from custom tables, here with six S-boxes, must
+        give the same output on every backend as the reference
+        implementation using those tables.
+        """
+
+        from bitsliced_engine import BitslicedEngine
+
+        spec = CipherSpec(S=DES.S[:6], E=DES.E[:36],
+                          P=[p % 24 + 1 for p in DES.P],
+                          PC2=DES.PC2[:36], number_of_rounds=10)
+        reference = spec.compile('bitarray')
+        key = 'sandves'
+        # Long enough for the bitsliced engine not to fall back to integers.
+        data = (self.long_string * 2)[:8 * (BitslicedEngine.MIN_VECTOR_SIZE
+                                            + 5)]
+        cipher = reference.encrypt_bytes(data, key)
+
+        for backend in BACKENDS:
+            fast = spec.compile(backend)
+            self.assertEquals(cipher, fast.encrypt_bytes(data, key))
+            self.assertEquals(data, fast.decrypt_bytes(cipher, key))
+
+        self.assertRaises(ValueError, CipherSpec, E=DES.E[:47])
+        self.assertRaises(ValueError, CipherSpec, number_of_rounds=17)
+        self.assertRaises(ValueError, reference.key_schedule,
+                          FeistelCipher(10).key_schedule(key))
+
+    def test_bitsliced_transpose(self):
+        """
+        Transposing blocks into bit slices and back must be lossless.
+        """
+
+        from bitsliced_engine import BitslicedEngine
+
+        data = self.long_string[:8 * 37]
+        slices, count = BitslicedEngine.transpose_in(data)
+        self.assertEquals(40, count)
+        self.assertEquals(
+            data, BitslicedEngine.transpose_out(slices, count)[:len(data)])
+
+    def test_prepared_key_schedule(self):
+        """
+        A prepared key schedule must give the same result as the raw key, and
+        repeated use of a key must be served from the cache.
+        """
+
+        for backend in BACKENDS:
+            f = FeistelCipher(backend=backend)
+            schedule = f.key_schedule('sandvest')
+            self.assertIs(schedule, f.key_schedule('sandvest'))
+
+            cipher = f.encrypt(self.long_string, 'sandvest')
+            self.assertEquals(cipher, f.encrypt(self.long_string, schedule))
+            self.assertEquals(f.decrypt(cipher.to01(), 'sandvest'),
+                              f.decrypt(cipher.to01(), schedule))
+
+            key = 'stiansandvestiansandv'
+            schedules = f.triple_key_schedule(key)
+            cipher = f.triple_encrypt(self.long_string, key)
+            self.assertEquals(cipher,
+                              f.triple_encrypt(self.long_string, schedules))
+            self.assertEquals(f.triple_decrypt(cipher.to01(), key),
+                              f.triple_decrypt(cipher.to01(), schedules))
+
+        other = FeistelCipher(number_of_rounds=8)
+        self.assertRaises(ValueError, other.encrypt, 'ssssssss', schedule)
+
+    def test_triple_bytes_encryption(self):
+        """
+        The bytes API must agree with the bitarray API and round trip.
+        """
+
+        key = 'stiansandvestiansandv'
+
+        for backend in BACKENDS:
+            f = FeistelCipher(backend=backend)
+            cipher = f.triple_encrypt_bytes(self.long_string, key)
+            self.assertEquals(
+                cipher, f.triple_encrypt(self.long_string, key).tobytes())
+            decrypted = f.triple_decrypt_bytes(cipher, key)
+            self.assertEquals(self.long_string, decrypted.replace('\x00', ''))
+
+            cipher = f.encrypt_bytes('ssssssss', 'sandvest')
+            self.assertEquals('ssssssss', f.decrypt_bytes(cipher, 'sandvest'))
+
+    def test_parallel_encryption(self):
+        """
+        Sharded encryption in a worker pool must give the same result as the
+        single process cipher, in the original block order.
+        """
+
+        f = FeistelCipher(backend='int')
+        key = 'stiansandvestiansandv'
+        text = self.long_string * 4
+
+        with ParallelCipher(f, processes=2, threshold=0) as parallel:
+            cipher = parallel.triple_encrypt(text, key)
+            self.assertEquals(cipher, f.triple_encrypt(text, key))
+            self.assertEquals(parallel.triple_decrypt(cipher.to01(), key),
+                              f.triple_decrypt(cipher.to01(), key))
+
+            cipher = parallel.encrypt_bytes(text, 'sandvest')
+            self.assertEquals(cipher, f.encrypt_bytes(text, 'sandvest'))
+            self.assertEquals(parallel.decrypt_bytes(cipher, 'sandvest'),
+                              f.decrypt_bytes(cipher, 'sandvest'))
+
+            # Every schedule is published once, however often it is used.
+            self.assertEquals(4, len(parallel.schedule_ids))
+            self.assertEquals(cipher, parallel.encrypt_bytes(text, 'sandvest'))
+            self.assertEquals(4, len(parallel.schedule_ids))
+
+    def test_stream_encryption(self):
+        """
+        Encrypting a stream in small buffers must give the same result as
+        encrypting the whole padded input at once, and decrypting it must
+        give back the input whatever its length.
+        """
+
+        f = FeistelCipher(backend='int')
+        key = 'stiansandvestiansandv'
+
+        for text in [self.long_string, '', 'hello world', 'x' * 64]:
+            expected = f.triple_encrypt_bytes(f.add_padding(text), key)
+
+            for buffer_size in [1, 8, 13, 64, 4096]:
+                out = StringIO()
+                written = f.triple_encrypt_stream(StringIO(text), out, key,
+                                                  buffer_size)
+                self.assertEquals(expected, out.getvalue())
+                self.assertEquals(len(expected), written)
+
+                out = StringIO()
+                written = f.triple_decrypt_stream(StringIO(expected), out,
+                                                  key, buffer_size)
+                self.assertEquals(text, out.getvalue())
+                self.assertEquals(len(text), written)
+
+        self.assertEquals('abc\x05\x05\x05\x05\x05', f.add_padding('abc'))
+        self.assertEquals('\x08' * 8, f.add_padding(''))
+        for bad in ['', 'abc', 'abcdefg\x00', 'abcdefg\x09', 'abcde\x02\x03']:
+            self.assertRaises(ValueError, f.remove_padding, bad)
+        self.assertRaises(ValueError, f.triple_decrypt_stream,
+                          StringIO('abcdefghij'), StringIO(), key)
+
+    def test_file_mode(self):
+        """
+        The command line file mode must restore a file whose length is not
+        a multiple of the block size byte for byte.
+        """
+
+        import main
+
+        directory = tempfile.mkdtemp()
+        paths = [os.path.join(directory, name)
+                 for name in ['plain', 'cipher', 'decrypted']]
+        key = 'stiansandvestiansandv'
+
+        try:
+            with open(paths[0], 'wb') as out:
+                out.write('hello world')
+
+            main.process_file(main.parse_args(
+                ['encrypt', paths[0], paths[1], '-k', key]))
+            main.process_file(main.parse_args(
+                ['decrypt', paths[1], paths[2], '-k', key]))
+
+            with open(paths[1], 'rb') as result:
+                self.assertEquals(16, len(result.read()))
+            with open(paths[2], 'rb') as result:
+                self.assertEquals('hello world', result.read())
+
+            # The same in place through memory-mapped windows.
+            main.process_file(main.parse_args(
+                ['encrypt', paths[0], paths[0], '-k', key, '--mmap']))
+            with open(paths[0], 'rb') as result:
+                self.assertEquals(16, len(result.read()))
+            main.process_file(main.parse_args(
+                ['decrypt', paths[0], paths[0], '-k', key, '--mmap']))
+            with open(paths[0], 'rb') as result:
+                self.assertEquals('hello world', result.read())
+        finally:
+            shutil.rmtree(directory)
+
+    def test_mapped_file_encryption(self):
+        """
+        Encrypting a memory-mapped file in small windows, both into a new
+        file and in place, must give the same result as the bytes API on the
+        padded input, and decrypting it must restore the exact file.
+        """
+
+        key = 'stiansandvestiansandv'
+        directory = tempfile.mkdtemp()
+        plain = os.path.join(directory, 'plain')
+        cipher = os.path.join(directory, 'cipher')
+
+        try:
+            for backend in BACKENDS:
+                f = FeistelCipher(backend=backend)
+                # Spans several windows, both with a partial last block and
+                # with a whole one.
+                for text in [self.long_string * 10, 'y' * 8192, '']:
+                    expected = f.triple_encrypt_bytes(f.add_padding(text), key)
+
+                    with open(plain, 'wb') as out:
+                        out.write(text)
+                    self.assertEquals(len(expected),
+                                      mapped_file.triple_encrypt_file(
+                                          f, key, plain, cipher, 4096))
+                    with open(cipher, 'rb') as result:
+                        self.assertEquals(expected, result.read())
+
+                    mapped_file.triple_encrypt_file(f, key, plain, None, 4096)
+                    self.assertEquals(len(text),
+                                      mapped_file.triple_decrypt_file(
+                                          f, key, plain, None, 4096))
+                    with open(plain, 'rb') as result:
+                        self.assertEquals(text, result.read())
+
+            with open(plain, 'wb') as out:
+                out.write('abcdefghij')
+            self.assertRaises(ValueError, mapped_file.triple_decrypt_file,
+                              f, key, plain)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_cbc_mode(self):
+        """
+        CBC must round trip, chain the blocks, and match a CBC decryption
+        running through a worker pool.
+        """
+
+        text = self.long_string
+        key = 'stiansandvestiansandv'
+        iv = 'initvect'
+
+        for backend in BACKENDS:
+            f = FeistelCipher(backend=backend)
+            cbc = CBCMode(f, key, iv, triple=True)
+            cipher = cbc.encrypt(text)
+            self.assertEquals(text, cbc.decrypt(cipher).replace('\x00', ''))
+
+            first = f.triple_encrypt_bytes(
+                bitutils.xor_bytes(text[:8], iv), key)
+            self.assertEquals(first, cipher[:8])
+
+        with ParallelCipher(f, processes=2, threshold=0) as parallel:
+            cbc = CBCMode(f, key, iv, triple=True, parallel=parallel)
+            self.assertEquals(text, cbc.decrypt(cipher).replace('\x00', ''))
+
+        # The pool may run another backend than the chaining cipher.
+        reference = FeistelCipher()
+        with ParallelCipher(FeistelCipher(backend='int'), processes=2,
+                            threshold=0) as parallel:
+            cbc = CBCMode(reference, key, iv, triple=True, parallel=parallel)
+            self.assertEquals(cipher, cbc.encrypt(text))
+            self.assertEquals(text, cbc.decrypt(cipher).replace('\x00', ''))
+
+            ctr = CTRMode(reference, 'sandvest', 'noncenon',
+                          parallel=parallel)
+            self.assertEquals(
+                CTRMode(reference, 'sandvest', 'noncenon').encrypt(text),
+                ctr.encrypt(text))
+
+            schedule = reference.key_schedule('sandvest')
+            self.assertRaises(ValueError, CTRMode, reference, schedule,
+                              'noncenon', parallel=parallel)
+
+    def test_ctr_mode_random_access(self):
+        """
+        CTR must round trip without padding and allow any byte range to be
+        decrypted on its own.
+        """
+
+        text = self.long_string
+
+        for backend in BACKENDS:
+            ctr = CTRMode(FeistelCipher(backend=backend), 'sandvest',
+                          'noncenon')
+            cipher = ctr.encrypt(text)
+            self.assertEquals(len(text), len(cipher))
+            self.assertEquals(text, ctr.decrypt(cipher))
+
+            for start, length in [(0, 1), (5, 3), (8, 8), (13, 100),
+                                  (len(text) - 7, 7)]:
+                self.assertEquals(text[start:start + length],
+                                  ctr.decrypt_range(cipher, start, length))
+
+    def test_buffer_input_and_output(self):
+        """
+        The bytes API must accept bytearrays and memoryviews and be able to
+        write its result into a caller supplied buffer.
+        """
+
+        text = self.long_string
+        key = 'stiansandvestiansandv'
+
+        for backend in BACKENDS:
+            f = FeistelCipher(backend=backend)
+            expected = f.triple_encrypt_bytes(text, key)
+
+            for data in [bytearray(text), memoryview(bytearray(text))]:
+                self.assertEquals(expected, f.triple_encrypt_bytes(data, key))
+
+                out = bytearray(len(expected))
+                written = f.triple_encrypt_bytes(data, key, memoryview(out))
+                self.assertEquals(len(expected), written)
+                self.assertEquals(expected, str(out))
+
+            out = bytearray(len(expected))
+            f.triple_decrypt_bytes(memoryview(bytearray(expected)), key, out)
+            self.assertEquals(text, str(out).replace('\x00', ''))
+
+    def test_profiler(self):
+        """
+        An attached profiler must count the stages of the reference cipher
+        and leave no trace on the cipher once detached.
+        """
+
+        f = FeistelCipher()
+
+        with Profiler(f) as profiler:
+            f.encrypt('ssssssss', 'sandvest')
+
+        stats = profiler.stats
+        self.assertEquals(16, stats['cipher.substitute'].calls)
+        self.assertEquals(16 * 3, stats['cipher.permute'].calls)
+        self.assertEquals(1, stats['backend.bitarray'].calls)
+        self.assertEquals(8, stats['backend.bitarray'].bytes)
+        self.assertEquals(1, stats.as_dict()['cipher.expand_key.calls'])
+        self.assertEquals(1, stats['cipher.join_blocks'].calls)
+        self.assertNotIn('permute', f.__dict__)
+
+        # The breakdown accounts for all of the time, output assembly
+        # included, on every backend.
+        for backend in BACKENDS:
+            f = FeistelCipher(backend=backend)
+            with Profiler(f) as profiler:
+                f.encrypt(self.long_string, 'sandvest')
+                f.triple_encrypt_bytes(self.long_string * 4,
+                                       'stiansandvestiansandv')
+
+            parts = profiler.stats.breakdown()
+            total = parts.pop('total')
+            self.assertGreater(total, 0)
+            self.assertAlmostEqual(total, sum(parts.values()))
+
+    def test_batched_avalanche(self):
+        """
+        The batched avalanche analysis must agree with flipping one bit at a
+        time and counting the differing ciphertext bits.
+        """
+
+        key = 'stiansandvestiansandv'
+        text = '10101101001011110100101111010010'
+        report = avalanche.plaintext_avalanche(key, [text],
+                                               bits=range(32, 64),
+                                               triple=True)
+
+        f = FeistelCipher(backend='int')
+        cipher1 = f.triple_encrypt(text, key)
+        distribution = [0] * 65
+        for idx in range(len(text)):
+            flipped = bitarray(text)
+            flipped[idx] = not flipped[idx]
+            cipher2 = f.triple_encrypt(flipped.to01(), key)
+            distribution[(cipher1 ^ cipher2).count()] += 1
+            self.assertEquals(cipher1[32 + idx] != cipher2[32 + idx],
+                              report.matrix[idx][32 + idx] == 1)
+
+        self.assertEquals(distribution, report.distribution)
+        self.assertEquals(32, report.flips())
+
+    def test_key_avalanche_backends(self):
+        """
+        The key avalanche analysis must give the same report on every
+        backend, including the reference backend without an engine.
+        """
+
+        keys = ['sandves', 'stianst']
+        reports = [avalanche.key_avalanche(12345, keys, bits=range(0, 56, 5),
+                                           number_of_rounds=4,
+                                           backend=backend).as_dict()
+                   for backend in ['bitarray'] + BACKENDS]
+        for report in reports[1:]:
+            self.assertEquals(reports[0], report)
+
+        self.assertEquals('numpy' if numpy is not None else 'int',
+                          avalanche.fastest_backend())
+        if numpy is None:
+            self.assertEquals('bitsliced', avalanche.fastest_backend(1 << 16))
+
+    def test_key_search(self):
+        """
+        A reduced key search must find the key a plaintext was encrypted
+        with, and resuming from a finished checkpoint must not search again.
+        """
+
+        key = '01' * 28
+        plaintext = 'stiansan'
+        directory = tempfile.mkdtemp()
+
+        try:
+            for backend in ['int'] + (['numpy'] if numpy else []):
+                f = FeistelCipher(4, backend=backend)
+                ciphertext = f.encrypt(plaintext, key)
+                search = KeySearch([(plaintext, ciphertext)], 10,
+                                   base_key=key, cipher=f, processes=1,
+                                   chunk_size=256, batch_size=64)
+                checkpoint = os.path.join(directory, backend + '.json')
+                reports = []
+
+                found = search.search(find_all=True, progress=reports.append,
+                                      checkpoint=checkpoint)
+                self.assertIn(key, found)
+                self.assertEquals(search.size, reports[-1].done)
+                for k in found:
+                    self.assertEquals(ciphertext, f.encrypt(plaintext, k))
+
+                self.assertEquals(found, search.search(
+                    find_all=True, progress=self.fail, checkpoint=checkpoint))
+        finally:
+            shutil.rmtree(directory)
+
+    @unittest.skipIf(numpy is None, 'requires NumPy')
+    def test_meet_in_the_middle(self):
+        """
+        The meet-in-the-middle attack must recover both keys of a double
+        encryption, whether the index fits in memory or is spilled to disk.
+        """
+
+        from meet_in_middle import MeetInTheMiddle
+
+        f = FeistelCipher(4, backend='numpy')
+        keys = ('stiansa', 'ndvesti')
+        plaintext = 'abcdefgh'
+        ciphertext = f.encrypt(f.encrypt(plaintext, keys[0]).to01(), keys[1])
+        expected = tuple(f.parse_text(k).to01() for k in keys)
+
+        for memory_budget in [1 << 20, 1 << 10]:
+            attack = MeetInTheMiddle([(plaintext, ciphertext)], 10,
+                                     base_key=keys, cipher=f, processes=1,
+                                     chunk_size=256,
+                                     memory_budget=memory_budget)
+            self.assertIn(expected, attack.search())
+
+    @unittest.skipIf(numpy is None, 'requires NumPy')
+    def test_hash_index(self):
+        """
+        The hash index must find every inserted key, including the largest
+        32 bit key, after the slots have been filled by other entries.
+        """
+
+        from hash_index import HashIndex
+
+        index = HashIndex(100)
+        keys = numpy.array([0, 1, 2 ** 32 - 1] + range(3, 90),
+                           dtype=numpy.uint32)
+        values = numpy.arange(len(keys), dtype=numpy.uint64) * 12345
+        index.insert(values, keys)
+        self.assertEquals(len(keys), len(index))
+
+        positions, found = index.lookup(values)
+        self.assertEquals(sorted(zip(range(len(keys)), keys.tolist())),
+                          sorted(zip(positions.tolist(), found.tolist())))
+        positions, found = index.lookup(numpy.array([2 * 12345],
+                                                    dtype=numpy.uint64))
+        self.assertEquals([2 ** 32 - 1], found.tolist())
+
+    def test_encryption_service(self):
+        """
+        Concurrent clients of the encryption service must get the same
+        results as separate calls to the cipher, with requests for the same
+        key batched together.
+        """
+
+        f = FeistelCipher(backend='int')
+        keys = ['sandves', 'stianst']
+        results = {}
+
+        def client(n):
+            with EncryptionClient(service.address) as c:
+                for i in range(20):
+                    record = 'record %d from client %d' % (i, n)
+                    key = keys[n % 2]
+                    results[record] = (key, c.encrypt(record, key))
+
+        with EncryptionService(('127.0.0.1', 0), f, max_wait=0.01) as service:
+            threads = [threading.Thread(target=client, args=(n,))
+                       for n in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+            with EncryptionClient(service.address) as c:
+                data = c.triple_encrypt('stiansan', keys[0] * 3)
+                self.assertEquals('stiansan',
+                                  c.triple_decrypt(data, keys[0] * 3))
+                self.assertRaises(ValueError, c.triple_encrypt, 'x', 'short')
+
+            stats = service.stats()
+
+        for record, (key, ciphertext) in results.items():
+            self.assertEquals(f.encrypt_bytes(record, key), ciphertext)
+        self.assertEquals(8 * 20 + 3, stats['requests'])
+        self.assertEquals(8 * 20 + 3, stats['latency']['count'])
+        self.assertLess(stats['batches'], stats['requests'])
+
+    def test_bitops(self):
+        """
+        The integer helpers must agree with the list helpers of bitutils.
+        """
+
+        bits = '1101001011110000101'
+        value = int(bits, 2)
+        width = len(bits)
+
+        self.assertEquals(bitutils.rotate_left(bits, 3),
+                          bitops.int_to_bits(bitops.rotl(value, 3, width),
+                                             width))
+        self.assertEquals(value, bitops.rotr(bitops.rotl(value, 5, width),
+                                             5, width))
+        self.assertEquals(tuple(int(h, 2) for h in bitutils.split_list(bits)),
+                          bitops.split(value, width))
+        self.assertEquals(int(bitutils.swap_list(bits), 2),
+                          bitops.swap(value, width))
+        self.assertEquals(value, bitops.bits_to_int(bitarray(bits)))
+        self.assertEquals(value, bitutils.bin_to_int([b == '1' for b in bits]))
+        self.assertEquals(bits.count('1'), bitops.popcount(value))
+
+        data = 'stiansandve'
+        self.assertEquals(data, bitops.int_to_bytes(bitops.bytes_to_int(data),
+                                                    len(data)))
+        self.assertEquals(bitarray(bitops.bytes_to_bits(data)).tobytes(),
+                          data)
+        self.assertEquals(data, bitops.bits_to_bytes(
+            bitops.bytes_to_bits(data)))
+        self.assertEquals(bitarray(bits).tobytes(), bitops.bits_to_bytes(bits))
+
+    def test_block_cache(self):
+        """
+        With the block cache enabled, repeated blocks must be served from
+        the cache and give the same result as an uncached cipher.
+        """
+
+        key = 'stiansandvestiansandv'
+        text = ('stiansan' * 20 + 'sandvest' * 10 + self.long_string[:64] +
+                'stiansan')
+
+        for backend in BACKENDS:
+            f = FeistelCipher(backend=backend)
+            cached = FeistelCipher(backend=backend, block_cache_size=16)
+
+            self.assertEquals(f.triple_encrypt(text, key),
+                              cached.triple_encrypt(text, key))
+            self.assertEquals(f.encrypt_bytes(text, key[:7]),
+                              cached.encrypt_bytes(text, key[:7]))
+            self.assertEquals(f.decrypt('1011' * 30, key[:7]),
+                              cached.decrypt('1011' * 30, key[:7]))
+
+            stats = cached.block_cache_stats()
+            self.assertEquals(3, stats['schedules'])
+            # 39 blocks of which 10 are distinct, twice, and two distinct
+            # blocks of binary text.
+            self.assertEquals(10 + 10 + 2, stats['misses'])
+            self.assertEquals(29 + 29, stats['hits'])
+            self.assertEquals(22, stats['blocks'])
+
+    def test_lru_cache_eviction(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertEquals(len(cache), 2)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,146 @@
+# !/usr/bin/python
+
+##############################################################################
+# @file    hash_index.py
+# @brief   Compact array backed hash index from 64 bit blocks to 32 bit keys.
+# Entries are inserted and looked up a whole array at a time, and every slot
+# costs nine bytes.
+###############################################################################
+
+
+import numpy
+
+
+# Odd multiplier of the hash. Multiplying by an odd number is a bijection
+# modulo 2**64, so distinct blocks never share a hash.
+MULTIPLIER = numpy.uint64(0x9e3779b97f4a7c15)
+
+
+def mix(values):
+    """
+    :param values: array or list of 64 bit blocks.
+    :return: uint64 array of their hashes.
+    """
+
+    with numpy.errstate(over='ignore'):
+        return numpy.asarray(values, dtype=numpy.uint64) * MULTIPLIER
+
+
+class HashIndex(object):
+
+    # Fraction of the slots that may be filled before probe sequences grow
+    # long.
+    MAX_LOAD = 0.7
+
+    # Bytes per slot: a 32 bit fingerprint, a 32 bit key and an occupancy
+    # flag.
+    SLOT_SIZE = 9
+
+    def __init__(self, capacity):
+        """
+        Open addressing hash table with linear probing. The home slot of a
+        block is taken from the top bits of its hash and only the low 32
+        bits are stored as a fingerprint, so a lookup may return keys of
+        other blocks that share a fingerprint. Callers verify the keys.
+
+        :param capacity: number of entries the index must hold.
+        """
+
+        slots = self.slots_for(capacity)
+        self.bits = slots.bit_length() - 1
+        self.mask = slots - 1
+        self.fingerprints = numpy.zeros(slots, dtype=numpy.uint32)
+        self.keys = numpy.zeros(slots, dtype=numpy.uint32)
+        # Kept apart from the keys so that every 32 bit key can be stored.
+        self.used = numpy.zeros(slots, dtype=bool)
+        self.count = 0
+
+    @classmethod
+    def slots_for(cls, capacity):
+        """
+        :return: number of slots an index of the given capacity uses.
+        """
+
+        slots = 2
+        while slots * cls.MAX_LOAD < capacity:
+            slots <<= 1
+        return slots
+
+    @property
+    def nbytes(self):
+        return self.fingerprints.nbytes + self.keys.nbytes + self.used.nbytes
+
+    def __len__(self):
+        return self.count
+
+    def hash(self, values):
+        """
+        :return: tuple of the home slots and the fingerprints of the blocks.
+        """
+
+        h = mix(values)
+        slots = (h >> numpy.uint64(64 - self.bits)).astype(numpy.intp)
+        fingerprints = (h & numpy.uint64(0xffffffff)).astype(numpy.uint32)
+        return slots, fingerprints
+
+    def insert(self, values, keys):
+        """
+        :param values: array of 64 bit blocks.
+        :param keys: array of keys below 2**32, one per block.
+        """
+
+        if self.count + len(values) > self.mask:
+            raise ValueError('Index is full')
+
+        slots, fingerprints = self.hash(values)
+        keys = numpy.asarray(keys, dtype=numpy.uint32)
+        pending = numpy.arange(len(slots))
+
+        while len(pending):
+            s = slots[pending]
+            free = ~self.used[s]
+
+            # Of the entries that want the same free slot, the first one
+            # takes it and the others find it occupied in the next pass.
+            taken, first = numpy.unique(s[free], return_index=True)
+            winners = pending[free][first]
+            self.keys[taken] = keys[winners]
+            self.fingerprints[taken] = fingerprints[winners]
+            self.used[taken] = True
+
+            slots[pending[~free]] = (s[~free] + 1) & self.mask
+            placed = numpy.zeros(len(pending), dtype=bool)
+            placed[numpy.nonzero(free)[0][first]] = True
+            pending = pending[~placed]
+
+        self.count += len(keys)
+
+    def lookup(self, values):
+        """
+        :param values: array of 64 bit blocks.
+        :return: tuple of two arrays holding, for every entry whose
+        fingerprint matches a block, the position of the block in values
+        and the key of the entry.
+        """
+
+        slots, fingerprints = self.hash(values)
+        pending = numpy.arange(len(slots))
+        positions = []
+        keys = []
+
+        while len(pending):
+            s = slots[pending]
+            occupied = self.used[s]
+            pending = pending[occupied]
+            s = s[occupied]
+            stored = self.keys[s]
+
+            hits = self.fingerprints[s] == fingerprints[pending]
+            positions.append(pending[hits])
+            keys.append(stored[hits].astype(numpy.int64))
+            slots[pending] = (s + 1) & self.mask
+
+        if not positions:
+            return (numpy.empty(0, dtype=numpy.intp),
+                    numpy.empty(0, dtype=numpy.int64))
+        return numpy.concatenate(positions), numpy.concatenate(keys)
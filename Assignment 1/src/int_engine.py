@@ -0,0 +1,479 @@
+# !/usr/bin/python
+
+##############################################################################
+# @file    int_engine.py
+# @brief   This class provides an integer based round engine for the Feistel
+# cipher. Every block is kept as a native integer and the permutation and
+# substitution steps are replaced by precomputed lookup tables.
+###############################################################################
+
+
+import struct
+
+from bitarray import bitarray
+
+import bitops
+from des import DES
+
+
+def byte_tables(permutation_table, width):
+    """
+    Splits a permutation over an integer of the given width into one lookup
+    table per input byte. Permuting a value is then a matter of OR-ing
+    together one lookup per byte.
+
+    Positions in the permutation table are 1-indexed from the most
+    significant bit, like the tables in DES.
+
+    :param permutation_table: permutation lookup table.
+    :param width: number of bits in the input value.
+    :return: list of 256-entry tables, least significant byte first.
+    """
+
+    out_width = len(permutation_table)
+    tables = []
+
+    for j in range((width + 7) // 8):
+        # (bit within the byte, output mask) pairs for every output bit
+        # taken from this byte.
+        sources = []
+        for i, p in enumerate(permutation_table):
+            src = width - p
+            if 8 * j <= src < 8 * j + 8:
+                sources.append((src - 8 * j, 1 << (out_width - 1 - i)))
+
+        table = []
+        for v in range(256):
+            out = 0
+            for bit, mask in sources:
+                if (v >> bit) & 1:
+                    out |= mask
+            table.append(out)
+        tables.append(table)
+
+    return tables
+
+
+def permute_int(value, tables):
+    """
+    Applies a permutation compiled with byte_tables() to an integer.
+
+    :param value: integer to be permuted.
+    :param tables: per byte lookup tables.
+    :return: permuted integer.
+    """
+
+    out = 0
+    for table in tables:
+        out |= table[value & 0xff]
+        value >>= 8
+    return out
+
+
+def sp_tables(s_boxes, p_table):
+    """
+    Merges the S-boxes with the P permutation that follows them. The result
+    holds one 64-entry table per S-box, indexed by the 6-bit S-box input and
+    containing the permuted 32-bit contribution of that box.
+
+    The lookups mirror FeistelCipher.substitute(): the row is given by the
+    outer bits and the column by bits 1-3 of the chunk. An output wider than
+    four bits is truncated to its four most significant bits, which is what
+    the 32-bit P lookup does to the last S-box in the reference code.
+
+    :param s_boxes: list of S-boxes.
+    :param p_table: permutation applied to the substituted bits.
+    :return: list of lookup tables, one per S-box.
+    """
+
+    width = 4 * len(s_boxes)
+    p = byte_tables(p_table, width)
+    tables = []
+
+    for i, box in enumerate(s_boxes):
+        table = []
+        for chunk in range(64):
+            row = ((chunk >> 4) & 2) | (chunk & 1)
+            col = (chunk >> 2) & 7
+            b = '{0:04b}'.format(box[row][col])
+            if len(b) > 4 and i != len(s_boxes) - 1:
+                raise ValueError('S-box %d produces values wider than four '
+                                 'bits' % (i + 1))
+            value = int(b[:4], 2) << (width - 4 * (i + 1))
+            table.append(permute_int(value, p))
+        tables.append(table)
+
+    return tables
+
+
+def sp_lookups(s_boxes):
+    """
+    Generates the expression that looks up every S-box input of the expanded
+    and keyed half block x in its SP table and ORs the results together.
+
+    :param s_boxes: number of S-boxes.
+    :return: source code of the expression.
+    """
+
+    terms = []
+    for i in range(s_boxes):
+        shift = 6 * (s_boxes - 1 - i)
+        if i == 0:
+            index = 'x >> %d' % shift if shift else 'x'
+        elif shift:
+            index = '(x >> %d) & 0x3f' % shift
+        else:
+            index = 'x & 0x3f'
+        terms.append('s%d[%s]' % (i, index))
+    return ' |\n            '.join(terms)
+
+
+def compile_function(name, template, s_boxes):
+    """
+    Generates a function from a template whose round loop is written out
+    for the given number of S-boxes, like the hand written loops are for
+    the eight S-boxes of DES.
+
+    :param name: name of the function defined by the template.
+    :param template: source code with %(s_tables)s and %(lookups)s fields.
+    :param s_boxes: number of S-boxes.
+    :return: the compiled function.
+    """
+
+    source = template % {
+        's_tables': ''.join('s%d, ' % i for i in range(s_boxes)),
+        'lookups': sp_lookups(s_boxes),
+    }
+    namespace = {}
+    exec(compile(source, '<%s %d>' % (name, s_boxes), 'exec'), namespace)
+    return namespace[name]
+
+
+ENCRYPT_BLOCKS_TEMPLATE = '''
+def encrypt_blocks(self, blocks, *stages):
+    e0, e1, e2, e3 = self.e_tables
+    %(s_tables)s= self.sp_tables
+    result = []
+
+    for block in blocks:
+        left = block >> 32
+        right = block & 0xffffffff
+
+        for sub_keys in stages:
+            for k in sub_keys:
+                x = (e0[right & 0xff] | e1[(right >> 8) & 0xff] |
+                     e2[(right >> 16) & 0xff] | e3[right >> 24]) ^ k
+                left, right = right, left ^ (
+            %(lookups)s)
+
+            left, right = right, left
+
+        result.append((left << 32) | right)
+
+    return result
+'''
+
+
+# Engine classes generated by IntEngine.specialized(), keyed by the class
+# they specialize and the number of S-boxes.
+_specialized = {}
+
+
+class IntEngine(object):
+
+    # Number of blocks converted at a time by encrypt_into().
+    BATCH_SIZE = 8192
+
+    # Number of S-boxes the round loops of this class are written for. Tables
+    # with another number of S-boxes need a class from specialized().
+    S_BOXES = 8
+
+    def __init__(self, number_of_rounds=16, block_size=64, tables=DES):
+
+        if (block_size != 64 or len(tables.E) != 6 * len(tables.S) or
+                max(tables.E) > 32 or len(tables.P) != 32):
+            raise ValueError('IntEngine requires 64 bit blocks and S-boxes '
+                             'with 6 bit inputs')
+        if len(tables.S) != self.S_BOXES:
+            raise ValueError('%s is written for %d S-boxes, use '
+                             'specialized(%d)' % (type(self).__name__,
+                                                  self.S_BOXES,
+                                                  len(tables.S)))
+
+        self.number_of_rounds = number_of_rounds
+        self.block_size = block_size
+        self.half_size = block_size // 2
+        self.tables = tables
+
+        self.e_tables = byte_tables(tables.E, self.half_size)
+        self.sp_tables = sp_tables(tables.S, tables.P)
+        # PC2 tables depend on the length of the key, so they are built
+        # the first time a key of a given length is seen.
+        self.pc2_tables = {}
+
+    @classmethod
+    def specialized(cls, s_boxes):
+        """
+        Returns an engine class whose round loops are generated for the given
+        number of S-boxes. The generated code is the same straight-line code
+        as the hand written loops, so custom tables run as fast as DES.
+        Classes are generated once and then reused.
+
+        :param s_boxes: number of S-boxes in the tables.
+        :return: this class if it already handles that many S-boxes, else a
+        generated subclass.
+        """
+
+        if s_boxes == cls.S_BOXES:
+            return cls
+
+        engine = _specialized.get((cls, s_boxes))
+        if engine is None:
+            bases = (cls,)
+            if cls is not IntEngine:
+                # Places the generated scalar loop below cls in the MRO, so
+                # that the fallbacks of the vectorized engines reach it.
+                bases += (IntEngine.specialized(s_boxes),)
+
+            namespace = {'S_BOXES': s_boxes, '__module__': cls.__module__}
+            namespace.update(cls.compile_round_loops(s_boxes))
+            engine = type('%s%d' % (cls.__name__, s_boxes), bases, namespace)
+            _specialized[(cls, s_boxes)] = engine
+
+        return engine
+
+    @classmethod
+    def compile_round_loops(cls, s_boxes):
+        """
+        :param s_boxes: number of S-boxes.
+        :return: dict of the methods of this class that depend on the number
+        of S-boxes, generated for the given number.
+        """
+
+        return {'encrypt_blocks': compile_function(
+            'encrypt_blocks', ENCRYPT_BLOCKS_TEMPLATE, s_boxes)}
+
+    def encrypt(self, bits, *stages):
+        """
+        Integer counterpart of FeistelCipher.encrypt_bits(). Produces output
+        that is identical to the reference implementation.
+
+        :param bits: bitarray of plaintext or ciphertext.
+        :param stages: one list of integer sub keys per encryption stage, in
+        the order they should be applied, i.e. reversed for decryption.
+        :return: a bitarray of the encrypted/decrypted data.
+        """
+
+        return self.from_blocks(self.encrypt_blocks(self.to_blocks(bits),
+                                                    *stages))
+
+    def encrypt_bytes(self, data, *stages):
+        """
+        Same as encrypt(), but works directly on byte strings so that no
+        bitarray is built for either the input or the output.
+
+        :param data: byte string of plaintext or ciphertext.
+        :param stages: one list of integer sub keys per encryption stage.
+        :return: byte string of the encrypted/decrypted data.
+        """
+
+        return self.pack_blocks(self.encrypt_blocks(self.unpack_blocks(data),
+                                                    *stages))
+
+    def encrypt_into(self, src, dst, *stages):
+        """
+        Encrypts the bytes of one buffer into another without building an
+        intermediate byte string. Blocks are unpacked from src and packed
+        into dst in batches; dst may be the same buffer as src.
+
+        :param src: readable buffer, e.g. an mmap.
+        :param dst: writable buffer with room for len(src) rounded up to a
+        whole number of blocks.
+        :param stages: one list of integer sub keys per encryption stage.
+        :return: number of bytes written to dst.
+        """
+
+        length = len(src)
+        full = length - length % 8
+        step = 8 * self.BATCH_SIZE
+
+        for start in range(0, full, step):
+            fmt = '>%dQ' % (min(step, full - start) // 8)
+            blocks = struct.unpack_from(fmt, src, start)
+            struct.pack_into(fmt, dst, start,
+                             *self.encrypt_blocks(blocks, *stages))
+
+        return full + self.encrypt_tail_into(src, dst, full, *stages)
+
+    def encrypt_tail_into(self, src, dst, full, *stages):
+        """
+        Encrypts the short last block of a buffer, if there is one.
+
+        :param src: readable buffer.
+        :param dst: writable buffer.
+        :param full: offset of the first byte that is not part of a whole
+        block.
+        :param stages: one list of integer sub keys per encryption stage.
+        :return: number of bytes written to dst.
+        """
+
+        if full == len(src):
+            return 0
+
+        tail = bitops.bytes_to_int(src[full:len(src)])
+        block = self.encrypt_blocks([tail], *stages)[0]
+        struct.pack_into('>Q', dst, full, int(block))
+        return 8
+
+    def encrypt_blocks(self, blocks, *stages):
+        """
+        Encrypts a list of 64 bit integer blocks. Every block is pushed
+        through all stages before the next block is processed, with the
+        halves swapped after each stage just like a separate encryption
+        would.
+
+        :param blocks: list of integers.
+        :param stages: one list of 48 bit integer sub keys per stage.
+        :return: list of encrypted blocks.
+        """
+
+        e0, e1, e2, e3 = self.e_tables
+        s0, s1, s2, s3, s4, s5, s6, s7 = self.sp_tables
+        result = []
+
+        for block in blocks:
+            left = block >> 32
+            right = block & 0xffffffff
+
+            for sub_keys in stages:
+                for k in sub_keys:
+                    x = (e0[right & 0xff] | e1[(right >> 8) & 0xff] |
+                         e2[(right >> 16) & 0xff] | e3[right >> 24]) ^ k
+                    left, right = right, left ^ (
+                        s0[x >> 42] | s1[(x >> 36) & 0x3f] |
+                        s2[(x >> 30) & 0x3f] | s3[(x >> 24) & 0x3f] |
+                        s4[(x >> 18) & 0x3f] | s5[(x >> 12) & 0x3f] |
+                        s6[(x >> 6) & 0x3f] | s7[x & 0x3f])
+
+                left, right = right, left
+
+            result.append((left << 32) | right)
+
+        return result
+
+    def round_function(self, bits, sub_key):
+        """
+        Integer counterpart of FeistelCipher.round_function().
+
+        :param bits: 32 bit integer.
+        :param sub_key: 48 bit integer sub key.
+        :return: 32 bit integer.
+        """
+
+        x = permute_int(bits, self.e_tables) ^ sub_key
+        out = 0
+        last = len(self.sp_tables) - 1
+        for i, table in enumerate(self.sp_tables):
+            out |= table[(x >> (6 * (last - i))) & 0x3f]
+        return out
+
+    def generate_sub_keys(self, key):
+        """
+        Integer counterpart of FeistelCipher.generate_sub_keys().
+
+        :param key: bitarray of the key.
+        :return: list of 48 bit integer sub keys, one per round.
+        """
+
+        size = len(key)
+        left_size = size // 2
+        right_size = size - left_size
+        left = bitops.bits_to_int(key[:left_size])
+        right = bitops.bits_to_int(key[left_size:])
+
+        pc2 = self.pc2_tables.get(size)
+        if pc2 is None:
+            if max(self.tables.PC2) > size:
+                raise IndexError('key is too short for PC2')
+            pc2 = self.pc2_tables[size] = byte_tables(self.tables.PC2, size)
+
+        sub_keys = []
+
+        for i in range(self.number_of_rounds):
+            shift = self.tables.key_shifts[i]
+            left = rotate_left(left, shift, left_size)
+            right = rotate_left(right, shift, right_size)
+            sub_keys.append(permute_int((left << right_size) | right, pc2))
+
+        return sub_keys
+
+    @staticmethod
+    def to_blocks(bits):
+        """
+        Converts a bitarray into a list of 64 bit integer blocks. Like
+        FeistelCipher.chunks(), the last block is padded with leading zeros.
+
+        :param bits: bitarray to convert.
+        :return: list of integers.
+        """
+
+        full = len(bits) - len(bits) % 64
+        blocks = IntEngine.unpack_blocks(bits[:full].tobytes())
+
+        if full != len(bits):
+            blocks.append(bitops.bits_to_int(bits[full:]))
+
+        return blocks
+
+    def from_blocks(self, blocks):
+        """
+        Converts a list of 64 bit integer blocks into a bitarray.
+
+        :param blocks: list of integers.
+        :return: bitarray of the concatenated blocks.
+        """
+
+        result = bitarray()
+        result.frombytes(self.pack_blocks(blocks))
+        return result
+
+    @staticmethod
+    def unpack_blocks(data):
+        """
+        Converts a byte string into a list of 64 bit integer blocks. A short
+        last block is padded with leading zeros. The blocks are read in
+        place, so buffers such as bytearrays and memoryviews are not copied.
+
+        :param data: byte string or buffer to convert.
+        :return: list of integers.
+        """
+
+        full = len(data) - len(data) % 8
+        blocks = list(struct.unpack_from('>%dQ' % (full // 8), data))
+
+        if full != len(data):
+            blocks.append(bitops.bytes_to_int(data[full:]))
+
+        return blocks
+
+    @staticmethod
+    def pack_blocks(blocks):
+        """
+        Converts a list of 64 bit integer blocks into a byte string.
+
+        :param blocks: list of integers.
+        :return: byte string of the concatenated blocks.
+        """
+
+        return struct.pack('>%dQ' % len(blocks), *blocks)
+
+
+def rotate_left(value, places, width):
+    """
+    Rotates an integer of a given width. Like bitutils.rotate_left(), a
+    rotation by the full width or more leaves the value unchanged.
+    """
+
+    if places >= width:
+        return value
+    return bitops.rotl(value, places, width)
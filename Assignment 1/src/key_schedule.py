@@ -0,0 +1,31 @@
+# !/usr/bin/python
+
+##############################################################################
+# @file    key_schedule.py
+# @brief   This class holds an expanded key, i.e. the sub keys used for
+# encryption and the reversed sub keys used for decryption.
+###############################################################################
+
+
+class KeySchedule(object):
+    def __init__(self, sub_keys, backend='bitarray', tables=None):
+        """
+        :param sub_keys: list of sub keys, one per round, in the native
+        representation of the backend that generated them.
+        :param backend: name of the backend the sub keys belong to.
+        :param tables: lookup tables the sub keys were generated with.
+        """
+
+        self.forward = tuple(sub_keys)
+        self.reverse = tuple(reversed(self.forward))
+        self.backend = backend
+        self.tables = tables
+        self.number_of_rounds = len(self.forward)
+
+    def sub_keys(self, encrypt=True):
+        """
+        :param encrypt: If set to False, the decryption schedule is returned.
+        :return: tuple of sub keys in the order they should be applied.
+        """
+
+        return self.forward if encrypt else self.reverse
@@ -0,0 +1,434 @@
+# !/usr/bin/python
+
+##############################################################################
+# @file    key_search.py
+# @brief   Exhaustive known-plaintext key search for reduced variants of the
+# Feistel cipher. A range of the key space is split into chunks that are
+# searched by a pool of worker processes, with progress reports and a
+# checkpoint file that lets an interrupted search resume.
+###############################################################################
+
+
+import json
+import multiprocessing
+import os
+import timeit
+
+from bitarray import bitarray
+
+import bitops
+from feistel_cipher import FeistelCipher
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# The searcher owned by a worker process. Like the cipher of a ParallelCipher
+# worker, it is created once when the worker starts.
+_worker_searcher = None
+
+
+def _init_worker(config, pairs, base_key, positions, batch_size):
+    global _worker_searcher
+    _worker_searcher = ChunkSearcher(FeistelCipher(*config[:4],
+                                                   tables=config[4]),
+                                     pairs, base_key, positions, batch_size)
+
+
+def _search_chunk(args):
+    start, stop = args
+    return start, stop, _worker_searcher.search(start, stop)
+
+
+def to_block(value):
+    """
+    :param value: integer block, bitarray, or text of at most one block that
+    is parsed like FeistelCipher.encrypt() does.
+    :return: the block as an integer.
+    """
+
+    if isinstance(value, (int, long)):
+        return value
+    if not isinstance(value, bitarray):
+        value = FeistelCipher.parse_text(value)
+    return bitops.bits_to_int(value)
+
+
+class ChunkSearcher(object):
+    def __init__(self, cipher, pairs, base_key, positions, batch_size=4096):
+        """
+        Tests the candidate keys of one chunk at a time. Candidate i is the
+        base key with the bits of i written into the searched positions, the
+        least significant bit of i going into the last position.
+
+        Sub keys are linear in the key bits, since the key schedule only
+        rotates and selects bits. The schedule of a candidate is therefore
+        the XOR of the schedule of its high bits, computed once per batch,
+        and a precomputed schedule of its low bits.
+
+        :param cipher: FeistelCipher with an integer based backend.
+        :param pairs: list of (plaintext, ciphertext) integer blocks.
+        :param base_key: integer key holding the bits that are not searched.
+        :param positions: key bit positions that are searched, counted from
+        the most significant bit of the key.
+        :param batch_size: number of candidates encrypted at a time. Rounded
+        down to a power of two.
+        """
+
+        if cipher.engine is None:
+            raise ValueError('Key search requires an integer based backend')
+
+        self.engine = cipher.engine
+        self.key_size = cipher.key_size
+        self.pairs = pairs
+        self.positions = positions
+
+        # Schedule of the base key and of every searched bit on its own.
+        self.base = self.schedule(base_key)
+        self.deltas = [self.schedule(1 << (self.key_size - 1 - p))
+                       for p in reversed(positions)]
+
+        self.low_bits = min(len(positions), batch_size.bit_length() - 1)
+        low = [[0] * len(self.base)]
+        for delta in self.deltas[:self.low_bits]:
+            low += [[a ^ b for a, b in zip(row, delta)] for row in low]
+        self.low = low
+
+        self.vectorized = (numpy is not None and
+                           hasattr(self.engine, 'encrypt_batch'))
+        if self.vectorized:
+            # One column of round keys per low bit pattern.
+            self.np_low = numpy.array(low, dtype=numpy.uint64).T.copy()
+
+    def schedule(self, key):
+        """
+        :param key: integer key of key_size bits.
+        :return: list of integer sub keys.
+        """
+
+        bits = bitarray(bitops.int_to_bits(key, self.key_size))
+        return self.engine.generate_sub_keys(bits)
+
+    def high_schedule(self, start):
+        """
+        :return: schedule shared by the candidates of the batch that starts
+        at start, i.e. of the bits of start above the low bits.
+        """
+
+        schedule = list(self.base)
+        high = start >> self.low_bits
+        bit = self.low_bits
+        while high:
+            if high & 1:
+                schedule = [a ^ b for a, b in zip(schedule, self.deltas[bit])]
+            high >>= 1
+            bit += 1
+        return schedule
+
+    def sub_keys(self, candidate):
+        """
+        :return: list of integer sub keys of a candidate.
+        """
+
+        low = self.low[candidate & ((1 << self.low_bits) - 1)]
+        return [a ^ b for a, b in zip(self.high_schedule(candidate), low)]
+
+    def encrypt_range(self, block, start, stop, encrypt=True):
+        """
+        Encrypts one block under every candidate from start up to but not
+        including stop.
+
+        :param block: integer block.
+        :param encrypt: If set to False, the block is decrypted instead.
+        :return: list, or uint64 array if vectorized, of the resulting
+        blocks in candidate order.
+        """
+
+        parts = []
+        mask = (1 << self.low_bits) - 1
+
+        while start < stop:
+            end = min(stop, (start | mask) + 1)
+            high = self.high_schedule(start)
+            offset = start & mask
+
+            if self.vectorized:
+                keys = (self.np_low[:, offset:offset + end - start] ^
+                        numpy.array(high, dtype=numpy.uint64)[:, None])
+                if not encrypt:
+                    keys = keys[::-1]
+                blocks = numpy.full(end - start, block, dtype=numpy.uint64)
+                parts.append(self.engine.encrypt_batch(blocks, [list(keys)]))
+            else:
+                for i in range(offset, offset + end - start):
+                    sub_keys = [a ^ b for a, b in zip(high, self.low[i])]
+                    if not encrypt:
+                        sub_keys.reverse()
+                    parts.append(self.engine.encrypt_blocks([block],
+                                                            sub_keys))
+            start = end
+
+        if self.vectorized:
+            return (numpy.concatenate(parts) if parts else
+                    numpy.empty(0, dtype=numpy.uint64))
+        return [int(b) for part in parts for b in part]
+
+    def search(self, start, stop):
+        """
+        Tests the candidates start up to but not including stop.
+
+        :return: list of the candidates that match every pair.
+        """
+
+        found = []
+        step = 1 << self.low_bits
+        mask = step - 1
+
+        while start < stop:
+            end = min(stop, (start | mask) + 1)
+            high = self.high_schedule(start)
+            if self.vectorized:
+                matches = self.batch_matches(high, start & mask,
+                                             end - start)
+            else:
+                matches = self.scalar_matches(high, start & mask,
+                                              end - start)
+
+            for i in matches:
+                sub_keys = [a ^ b for a, b in zip(high, self.low[i])]
+                if self.verify(sub_keys):
+                    found.append((start & ~mask) | i)
+            start = end
+
+        return found
+
+    def batch_matches(self, high, offset, count):
+        """
+        Encrypts the first plaintext under a batch of candidates at once.
+        Only the rounds up to the last are run: the right half after them
+        is the left half of the ciphertext, which rules out nearly every
+        candidate without running the last round.
+
+        :return: low bit patterns of the candidates that passed.
+        """
+
+        p, c = self.pairs[0]
+        keys = self.np_low[:, offset:offset + count] ^ numpy.array(
+            high, dtype=numpy.uint64)[:, None]
+        blocks = numpy.full(count, p, dtype=numpy.uint64)
+        out = self.engine.encrypt_batch(blocks, [list(keys[:-1])])
+        hits = numpy.nonzero((out >> 32) == (c & 0xffffffff))[0]
+        return [offset + int(i) for i in hits]
+
+    def scalar_matches(self, high, offset, count):
+        """
+        Scalar counterpart of batch_matches().
+        """
+
+        p, c = self.pairs[0]
+        expected = c & 0xffffffff
+        encrypt_blocks = self.engine.encrypt_blocks
+        matches = []
+
+        for i in range(offset, offset + count):
+            sub_keys = [a ^ b for a, b in zip(high, self.low[i][:-1])]
+            if encrypt_blocks([p], sub_keys)[0] >> 32 == expected:
+                matches.append(i)
+
+        return matches
+
+    def verify(self, sub_keys):
+        """
+        :return: True if the schedule maps every plaintext to its
+        ciphertext.
+        """
+
+        for p, c in self.pairs:
+            if self.engine.encrypt_blocks([p], sub_keys)[0] != c:
+                return False
+        return True
+
+
+class SearchProgress(object):
+    def __init__(self, done, total, seconds, found):
+        """
+        :param done: number of candidates tested in this run.
+        :param total: number of candidates left when this run started.
+        :param seconds: time spent so far in this run.
+        :param found: keys found so far.
+        """
+
+        self.done = done
+        self.total = total
+        self.seconds = seconds
+        self.found = found
+
+    def rate(self):
+        """
+        :return: keys tested per second in this run.
+        """
+
+        return self.done / self.seconds if self.seconds else 0.0
+
+    def __repr__(self):
+        return ('SearchProgress(done=%d, total=%d, rate=%.0f keys/s, '
+                'found=%d)' % (self.done, self.total, self.rate(),
+                               len(self.found)))
+
+
+class KeySearch(object):
+    def __init__(self, pairs, key_bits, base_key=None, cipher=None,
+                 processes=None, chunk_size=1 << 16, batch_size=4096):
+        """
+        :param pairs: list of known (plaintext, ciphertext) pairs of single
+        blocks, given as integers, bitarrays or text.
+        :param key_bits: number of key bits to search, taken from the end of
+        the key, or a list of the key bit positions to search, counted from
+        the most significant bit.
+        :param base_key: raw key holding the known bits. Defaults to zeros.
+        :param cipher: FeistelCipher describing the variant under attack,
+        e.g. with reduced rounds. Defaults to the 'numpy' backend if NumPy
+        is installed, else the 'int' backend.
+        :param processes: number of worker processes. Defaults to the number
+        of cores; 1 searches in the calling process.
+        :param chunk_size: number of candidates handed to a worker at a
+        time, which is also the granularity of progress and checkpoints.
+        :param batch_size: number of candidates encrypted at a time.
+        """
+
+        if cipher is None:
+            cipher = FeistelCipher(backend='numpy' if numpy else 'int')
+        if isinstance(key_bits, (int, long)):
+            key_bits = range(cipher.key_size - key_bits, cipher.key_size)
+
+        self.cipher = cipher
+        self.pairs = [(to_block(p), to_block(c)) for p, c in pairs]
+        self.positions = list(key_bits)
+        self.base_key = 0
+        if base_key is not None:
+            self.base_key = to_block(base_key)
+            for p in self.positions:
+                self.base_key &= ~(1 << (cipher.key_size - 1 - p))
+        self.processes = processes or multiprocessing.cpu_count()
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+
+    @property
+    def size(self):
+        """
+        :return: number of candidate keys.
+        """
+
+        return 1 << len(self.positions)
+
+    def key(self, candidate):
+        """
+        :param candidate: candidate number returned by a search.
+        :return: the full key as a binary string, which FeistelCipher
+        accepts as a raw key.
+        """
+
+        key = self.base_key
+        for i, p in enumerate(reversed(self.positions)):
+            if (candidate >> i) & 1:
+                key |= 1 << (self.cipher.key_size - 1 - p)
+        return bitops.int_to_bits(key, self.cipher.key_size)
+
+    def search(self, start=0, stop=None, find_all=False, progress=None,
+               checkpoint=None):
+        """
+        Searches the candidates start up to but not including stop.
+
+        :param start: first candidate.
+        :param stop: end of the range. Defaults to the whole key space.
+        :param find_all: If set to False, the search ends at the first key
+        that matches every pair.
+        :param progress: callable that is given a SearchProgress after every
+        chunk.
+        :param checkpoint: path of a JSON file recording the chunks that are
+        done. An existing checkpoint of the same search is resumed.
+        :return: list of the matching keys as binary strings.
+        """
+
+        stop = self.size if stop is None else stop
+        chunks = [(s, min(stop, s + self.chunk_size))
+                  for s in range(start, stop, self.chunk_size)]
+        state = {'start': start, 'stop': stop, 'chunk_size': self.chunk_size,
+                 'positions': self.positions, 'done': [], 'found': []}
+
+        if checkpoint is not None and os.path.exists(checkpoint):
+            with open(checkpoint) as f:
+                saved = json.load(f)
+            if any(saved[k] != state[k] for k in
+                   ('start', 'stop', 'chunk_size', 'positions')):
+                raise ValueError('Checkpoint belongs to a different search')
+            state = saved
+
+        done = set(state['done'])
+        found = state['found']
+        pending = [c for c in chunks if c[0] not in done]
+        total = sum(b - a for a, b in pending)
+        tested = 0
+        began = timeit.default_timer()
+
+        if not (found and not find_all):
+            for chunk_start, chunk_stop, keys in self.run(pending):
+                tested += chunk_stop - chunk_start
+                found.extend(keys)
+                state['done'].append(chunk_start)
+
+                if checkpoint is not None:
+                    self.save_checkpoint(checkpoint, state)
+                if progress is not None:
+                    progress(SearchProgress(
+                        tested, total, timeit.default_timer() - began,
+                        [self.key(k) for k in found]))
+                if found and not find_all:
+                    break
+
+        return [self.key(k) for k in sorted(found)]
+
+    def run(self, chunks):
+        """
+        Generator that searches the chunks in the worker processes, or in
+        the calling process if only one process is used.
+
+        :return: generator of (start, stop, candidates found) tuples, in
+        the order the chunks complete.
+        """
+
+        args = (self.pairs, self.base_key, self.positions, self.batch_size)
+
+        if self.processes == 1:
+            searcher = ChunkSearcher(self.cipher, *args)
+            for start, stop in chunks:
+                yield start, stop, searcher.search(start, stop)
+            return
+
+        c = self.cipher
+        config = (c.number_of_rounds, c.block_size, c.key_size, c.backend,
+                  c.tables)
+        pool = multiprocessing.Pool(self.processes, _init_worker,
+                                    (config,) + args)
+        try:
+            for result in pool.imap_unordered(_search_chunk, chunks):
+                yield result
+        finally:
+            pool.terminate()
+            pool.join()
+
+    @staticmethod
+    def save_checkpoint(path, state):
+        """
+        Writes the state of a search. The file is replaced in one step, so
+        an interrupted write never leaves a broken checkpoint behind.
+        """
+
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+        os.rename(tmp, path)
@@ -0,0 +1,67 @@
+# !/usr/bin/python
+
+##############################################################################
+# @file    lru_cache.py
+# @brief   A small bounded mapping that evicts the least recently used entry
+# when it grows beyond its maximum size.
+###############################################################################
+
+
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    def __init__(self, max_size=64):
+
+        if max_size < 1:
+            raise ValueError('max_size must be at least 1')
+
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        """
+        Looks up a key and marks it as the most recently used entry.
+
+        :param key: key to look up.
+        :param default: value returned if the key is not present.
+        :return: the cached value or default.
+        """
+
+        try:
+            value = self.entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+
+        self.entries[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """
+        Stores a value, evicting the least recently used entry if the cache
+        is full.
+
+        :param key: key to store the value under.
+        :param value: value to store.
+        """
+
+        self.entries.pop(key, None)
+        self.entries[key] = value
+
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
@@ -6,14 +6,76 @@
 # @version V1.0.0
 # @date    9-Sep-2014
 # @brief   The main script provides a console user interface for encryption
-# and decryption utilizing the FeistelCipher.
+# and decryption utilizing the FeistelCipher. When called with arguments it
+# encrypts or decrypts a file without prompting.
 ###############################################################################
 
+import argparse
+import sys
+
 from feistel_cipher import FeistelCipher
+import mapped_file
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description='Triple encrypt or decrypt a file with a 168 bit key.')
+    parser.add_argument('mode', choices=['encrypt', 'decrypt'])
+    parser.add_argument('input', help="input file, or '-' for stdin")
+    parser.add_argument('output', help="output file, or '-' for stdout")
+    parser.add_argument('-k', '--key',
+                        help='168 bit key (21 characters). Prompted for if '
+                             'omitted.')
+    parser.add_argument('-b', '--backend', default='int',
+                        choices=FeistelCipher.BACKENDS)
+    parser.add_argument('--buffer-size', type=int,
+                        default=FeistelCipher.STREAM_BUFFER_SIZE,
+                        help='number of bytes read at a time')
+    parser.add_argument('--mmap', action='store_true',
+                        help='memory-map the files instead of streaming '
+                             'them; the output may equal the input to '
+                             'process the file in place')
+    return parser.parse_args(argv)
+
+
+def process_file(args):
+    feistel = FeistelCipher(backend=args.backend)
+    key = args.key
+    if key is None:
+        key = raw_input('Enter 168 bit key (21 characters): ')
+
+    if args.mmap:
+        if args.mode == 'encrypt':
+            mapped_file.triple_encrypt_file(feistel, key, args.input,
+                                            args.output)
+        else:
+            mapped_file.triple_decrypt_file(feistel, key, args.input,
+                                            args.output)
+        return
+
+    reader = sys.stdin if args.input == '-' else open(args.input, 'rb')
+    writer = sys.stdout if args.output == '-' else open(args.output, 'wb')
+
+    try:
+        if args.mode == 'encrypt':
+            feistel.triple_encrypt_stream(reader, writer, key,
+                                          args.buffer_size)
+        else:
+            feistel.triple_decrypt_stream(reader, writer, key,
+                                          args.buffer_size)
+    finally:
+        if reader is not sys.stdin:
+            reader.close()
+        if writer is not sys.stdout:
+            writer.close()
 
 
 def main():
 
+    if len(sys.argv) > 1:
+        process_file(parse_args(sys.argv[1:]))
+        return
+
     feistel = FeistelCipher()
 
     while True:
@@ -0,0 +1,147 @@
+# !/usr/bin/python
+
+##############################################################################
+# @file    mapped_file.py
+# @brief   Functions for encrypting and decrypting files that are too large
+# to be read into memory. The files are memory-mapped one window at a time
+# and the cipher works directly on the mapped buffers.
+###############################################################################
+
+
+import mmap
+import os
+
+
+# Default number of bytes mapped at a time. Always rounded down to a multiple
+# of the allocation granularity, which is a multiple of the block size.
+WINDOW_SIZE = 16 << 20
+
+
+def encrypt_file(cipher, key, input_path, output_path=None,
+                 window_size=WINDOW_SIZE):
+    """
+    Encrypts a file using memory-mapped windows. The last block is padded
+    with cipher.add_padding(), so decrypt_file() restores the exact length.
+
+    :param cipher: the FeistelCipher to use.
+    :param key: key used to encrypt the file, either raw or as a KeySchedule.
+    :param input_path: file to encrypt.
+    :param output_path: file to write the ciphertext to. If omitted the input
+    file is encrypted in place.
+    :param window_size: number of bytes mapped at a time.
+    :return: size of the encrypted file.
+    """
+
+    stages = [cipher.key_schedule(key).sub_keys(True)]
+    return process_file(cipher, stages, input_path, output_path, window_size,
+                        'add')
+
+
+def decrypt_file(cipher, key, input_path, output_path=None,
+                 window_size=WINDOW_SIZE):
+    """
+    Reverses encrypt_file().
+    """
+
+    stages = [cipher.key_schedule(key).sub_keys(False)]
+    return process_file(cipher, stages, input_path, output_path, window_size,
+                        'remove')
+
+
+def triple_encrypt_file(cipher, key, input_path, output_path=None,
+                        window_size=WINDOW_SIZE):
+    """
+    Triple encrypts a file using memory-mapped windows.
+    """
+
+    return process_file(cipher, cipher.triple_stages(key, True), input_path,
+                        output_path, window_size, 'add')
+
+
+def triple_decrypt_file(cipher, key, input_path, output_path=None,
+                        window_size=WINDOW_SIZE):
+    """
+    Reverses triple_encrypt_file().
+    """
+
+    return process_file(cipher, cipher.triple_stages(key, False), input_path,
+                        output_path, window_size, 'remove')
+
+
+def process_file(cipher, stages, input_path, output_path=None,
+                 window_size=WINDOW_SIZE, padding=None):
+    """
+    Runs a file through the given stages. The output file is preallocated to
+    the padded size of the input, and both files are then mapped one window
+    at a time so that only a single window of each is resident at once.
+
+    :param cipher: the FeistelCipher to use.
+    :param stages: one list of sub keys per stage.
+    :param input_path: file to process.
+    :param output_path: file to write the result to. If omitted, or equal to
+    input_path, the input file is overwritten in place.
+    :param window_size: number of bytes mapped at a time.
+    :param padding: 'add' to pad the last block with cipher.add_padding(),
+    'remove' to strip that padding from the result and truncate the output
+    to the original length, or None to pad a short last block with zeros.
+    :return: size of the output file.
+    """
+
+    granularity = mmap.ALLOCATIONGRANULARITY
+    window_size = max(granularity, window_size - window_size % granularity)
+    block_bytes = cipher.block_size // 8
+
+    in_place = (output_path is None or
+                os.path.abspath(output_path) == os.path.abspath(input_path))
+
+    reader = open(input_path, 'r+b' if in_place else 'rb')
+    writer = reader if in_place else open(output_path, 'w+b')
+
+    try:
+        size = os.fstat(reader.fileno()).st_size
+        if padding == 'remove' and (size == 0 or size % block_bytes):
+            raise ValueError('Padded ciphertext must be a whole number of '
+                             'blocks')
+
+        if padding == 'add':
+            # The partial last block is read before an in place truncate
+            # overwrites it, and padded and processed on its own.
+            full = size - size % block_bytes
+            reader.seek(full)
+            tail = reader.read()
+            out_size = full + block_bytes
+        else:
+            full = size
+            out_size = (size + block_bytes - 1) // block_bytes * block_bytes
+        writer.truncate(out_size)
+
+        for offset in range(0, full, window_size):
+            length = min(window_size, full - offset)
+            out_length = min(window_size, out_size - offset)
+
+            src = mmap.mmap(reader.fileno(), length, access=mmap.ACCESS_READ,
+                            offset=offset)
+            dst = mmap.mmap(writer.fileno(), out_length,
+                            access=mmap.ACCESS_WRITE, offset=offset)
+            try:
+                cipher.process_into(src, dst, stages)
+                dst.flush()
+            finally:
+                dst.close()
+                src.close()
+
+        if padding == 'add':
+            writer.seek(full)
+            writer.write(cipher.process_bytes(cipher.add_padding(tail),
+                                              stages))
+        elif padding == 'remove':
+            writer.seek(out_size - block_bytes)
+            last = cipher.remove_padding(writer.read(block_bytes))
+            out_size -= block_bytes - len(last)
+            writer.truncate(out_size)
+    finally:
+        if writer is not reader:
+            writer.close()
+        reader.close()
+
+    return out_size
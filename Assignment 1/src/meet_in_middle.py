@@ -0,0 +1,291 @@
+# !/usr/bin/python
+
+##############################################################################
+# @file    meet_in_middle.py
+# @brief   Meet-in-the-middle attack on double encryption with reduced key
+# spaces. The known plaintext is encrypted under every candidate first key
+# and the results are stored in a compact hash index. The known ciphertext
+# is then decrypted under every candidate second key and looked up in the
+# index. Both sweeps run in a pool of worker processes, and an index that
+# would exceed its memory budget is split into partitions spilled to disk.
+###############################################################################
+
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import timeit
+
+import numpy
+
+from feistel_cipher import FeistelCipher
+from hash_index import HashIndex, mix
+from key_search import ChunkSearcher, KeySearch, SearchProgress
+
+
+# Layout of a spilled entry: the intermediate block and its candidate.
+RECORD = numpy.dtype([('value', '<u8'), ('key', '<u4')])
+
+
+# The searchers of the first and the second key owned by a worker process.
+_worker_searchers = None
+
+
+def _init_worker(config, base_keys, positions, batch_size):
+    global _worker_searchers
+    cipher = FeistelCipher(*config[:4], tables=config[4])
+    _worker_searchers = [ChunkSearcher(cipher, [], k, positions, batch_size)
+                         for k in base_keys]
+
+
+def _sweep_chunk(args):
+    side, block, start, stop = args
+    return start, sweep_range(_worker_searchers[side], side, block, start,
+                              stop)
+
+
+def sweep_range(searcher, side, block, start, stop):
+    """
+    :param side: 0 to encrypt the block under the candidates of the first
+    key, 1 to decrypt it under the candidates of the second key.
+    :return: uint64 array of the intermediate blocks in candidate order.
+    """
+
+    return numpy.asarray(searcher.encrypt_range(block, start, stop, side == 0),
+                         dtype=numpy.uint64)
+
+
+class MeetInTheMiddle(object):
+    def __init__(self, pairs, key_bits, base_key=None, cipher=None,
+                 processes=None, chunk_size=1 << 16, batch_size=4096,
+                 memory_budget=1 << 28, directory=None):
+        """
+        :param pairs: list of known (plaintext, ciphertext) pairs of single
+        blocks, given as integers, bitarrays or text. The ciphertext is the
+        plaintext encrypted under the first and then the second key.
+        :param key_bits: number of bits to search in each key, taken from
+        the end of the key, or a list of the key bit positions to search.
+        At most 32 bits may be searched.
+        :param base_key: raw 112 bit key, or a sequence of two raw keys,
+        holding the known bits. Defaults to zeros.
+        :param cipher: FeistelCipher describing the variant under attack.
+        Defaults to the 'numpy' backend.
+        :param processes: number of worker processes. Defaults to the number
+        of cores; 1 runs both sweeps in the calling process.
+        :param chunk_size: number of candidates handed to a worker at a
+        time.
+        :param batch_size: number of candidates encrypted at a time.
+        :param memory_budget: number of bytes the index may use. Larger
+        indexes are split into partitions that are joined one at a time.
+        :param directory: directory the partitions are spilled to. Defaults
+        to the temporary directory of the system.
+        """
+
+        if cipher is None:
+            cipher = FeistelCipher(backend='numpy')
+        if base_key is None:
+            base_key = (None, None)
+        elif not isinstance(base_key, (tuple, list)):
+            base_key = (base_key[:7], base_key[7:14])
+        if len(base_key) != 2:
+            raise ValueError('Double encryption requires two keys')
+
+        self.searches = [KeySearch(pairs, key_bits, k, cipher, 1, chunk_size,
+                                   batch_size) for k in base_key]
+        if len(self.searches[0].positions) > 32:
+            raise ValueError('At most 32 key bits can be searched')
+
+        self.cipher = cipher
+        self.pairs = self.searches[0].pairs
+        self.searchers = [ChunkSearcher(cipher, [], s.base_key, s.positions,
+                                        batch_size) for s in self.searches]
+        self.processes = processes or multiprocessing.cpu_count()
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.memory_budget = memory_budget
+        self.directory = directory
+
+    @property
+    def size(self):
+        """
+        :return: number of candidates of each key.
+        """
+
+        return self.searches[0].size
+
+    def partitions(self):
+        """
+        :return: number of partitions the index is split into to stay
+        within the memory budget.
+        """
+
+        partitions = 1
+        while (partitions < self.size and
+               HashIndex.slots_for(-(-self.size // partitions)) *
+               HashIndex.SLOT_SIZE > self.memory_budget):
+            partitions <<= 1
+        return partitions
+
+    def search(self, progress=None):
+        """
+        Runs the attack over the whole key space.
+
+        :param progress: callable that is given a SearchProgress after every
+        chunk of either sweep.
+        :return: sorted list of (first key, second key) tuples of binary
+        strings that map every plaintext to its ciphertext.
+        """
+
+        self.tested = 0
+        self.found = []
+        self.began = timeit.default_timer()
+        self.progress = progress
+
+        pool = None
+        if self.processes > 1:
+            c = self.cipher
+            config = (c.number_of_rounds, c.block_size, c.key_size, c.backend,
+                      c.tables)
+            pool = multiprocessing.Pool(
+                self.processes, _init_worker,
+                (config, [s.base_key for s in self.searches],
+                 self.searches[0].positions, self.batch_size))
+
+        try:
+            partitions = self.partitions()
+            if partitions == 1:
+                self.join_in_memory(pool)
+            else:
+                self.join_on_disk(pool, partitions)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+        return sorted(self.keys(self.found))
+
+    def keys(self, found):
+        return [(self.searches[0].key(a), self.searches[1].key(b))
+                for a, b in found]
+
+    def join_in_memory(self, pool):
+        p, c = self.pairs[0]
+        index = HashIndex(self.size)
+
+        for start, values in self.sweep(pool, 0, p):
+            index.insert(values, numpy.arange(start, start + len(values)))
+
+        for start, values in self.sweep(pool, 1, c):
+            positions, keys = index.lookup(values)
+            self.verify(keys, positions + start)
+
+    def join_on_disk(self, pool, partitions):
+        """
+        Spills the results of both sweeps into partitions by their hash,
+        then joins the partitions one at a time. Matching blocks always end
+        up in partitions with the same number.
+        """
+
+        p, c = self.pairs[0]
+        directory = tempfile.mkdtemp(dir=self.directory)
+
+        try:
+            paths = [[os.path.join(directory, '%d.%d' % (side, i))
+                      for i in range(partitions)] for side in (0, 1)]
+            self.spill(pool, 0, p, paths[0])
+            self.spill(pool, 1, c, paths[1])
+
+            for first, second in zip(*paths):
+                index = HashIndex(os.path.getsize(first) // RECORD.itemsize)
+                for records in self.read_records(first):
+                    index.insert(records['value'], records['key'])
+                for records in self.read_records(second):
+                    positions, keys = index.lookup(records['value'])
+                    self.verify(keys, records['key'][positions])
+        finally:
+            shutil.rmtree(directory)
+
+    def spill(self, pool, side, block, paths):
+        files = [open(path, 'wb') for path in paths]
+
+        try:
+            for start, values in self.sweep(pool, side, block):
+                part = ((mix(values) >> numpy.uint64(32)) &
+                        numpy.uint64(len(paths) - 1)).astype(numpy.intp)
+                order = numpy.argsort(part, kind='mergesort')
+                bounds = numpy.searchsorted(part[order],
+                                            numpy.arange(len(paths) + 1))
+
+                for i, f in enumerate(files):
+                    selected = order[bounds[i]:bounds[i + 1]]
+                    records = numpy.empty(len(selected), dtype=RECORD)
+                    records['value'] = values[selected]
+                    records['key'] = selected + start
+                    records.tofile(f)
+        finally:
+            for f in files:
+                f.close()
+
+    def read_records(self, path):
+        """
+        Generator that reads a spilled partition chunk_size records at a
+        time.
+        """
+
+        with open(path, 'rb') as f:
+            while True:
+                records = numpy.fromfile(f, dtype=RECORD,
+                                         count=self.chunk_size)
+                if not len(records):
+                    return
+                yield records
+
+    def sweep(self, pool, side, block):
+        """
+        Generator that encrypts or decrypts the block under every candidate
+        of one key, in the worker processes if a pool is given.
+
+        :return: generator of (start, intermediate blocks) tuples, in the
+        order the chunks complete.
+        """
+
+        chunks = [(side, block, s, min(self.size, s + self.chunk_size))
+                  for s in range(0, self.size, self.chunk_size)]
+
+        if pool is None:
+            results = (
+                (start, sweep_range(self.searchers[side], side, block, start,
+                                    stop))
+                for _, _, start, stop in chunks)
+        else:
+            results = pool.imap_unordered(_sweep_chunk, chunks)
+
+        for start, values in results:
+            yield start, values
+
+            self.tested += len(values)
+            if self.progress is not None:
+                self.progress(SearchProgress(
+                    self.tested, 2 * self.size,
+                    timeit.default_timer() - self.began,
+                    self.keys(self.found)))
+
+    def verify(self, first, second):
+        """
+        Checks the candidate pairs that met in the index against every
+        known pair and records those that match.
+
+        :param first: candidates of the first key.
+        :param second: candidates of the second key.
+        """
+
+        encrypt_blocks = self.cipher.engine.encrypt_blocks
+
+        for a, b in zip(first, second):
+            a, b = int(a), int(b)
+            stages = (self.searchers[0].sub_keys(a),
+                      self.searchers[1].sub_keys(b))
+            if all(int(encrypt_blocks([p], *stages)[0]) == c
+                   for p, c in self.pairs):
+                self.found.append((a, b))
@@ -0,0 +1,191 @@
+# !/usr/bin/python
+
+##############################################################################
+# @file    modes.py
+# @brief   Block cipher modes of operation (CBC and CTR) built on top of the
+# FeistelCipher.
+###############################################################################
+
+
+import struct
+
+import bitutils
+
+
+def stages_for(cipher, key, triple, encrypt=True):
+    """
+    :param cipher: FeistelCipher or ParallelCipher.
+    :param key: raw key or prepared key schedule(s).
+    :param triple: If set to True, the stages of triple encryption are
+    returned.
+    :param encrypt: If set to False, the stages for decryption are returned.
+    :return: one list of sub keys per stage.
+    """
+
+    if triple:
+        return cipher.triple_stages(key, encrypt)
+    return [cipher.key_schedule(key).sub_keys(encrypt)]
+
+
+def bulk_cipher(cipher, parallel):
+    """
+    :return: the cipher that processes whole messages, the ParallelCipher if
+    one is given and cipher otherwise.
+    """
+
+    if parallel is None:
+        return cipher
+    if parallel.block_size != cipher.block_size:
+        raise ValueError('Parallel cipher must have the same block size')
+    return parallel
+
+
+class CBCMode(object):
+    def __init__(self, cipher, key, iv, triple=False, parallel=None):
+        """
+        :param cipher: the FeistelCipher to use.
+        :param key: key, either raw or as a KeySchedule. A 168 bit key or
+        three KeySchedules if triple is True.
+        :param iv: initialization vector of block_size bits, as a byte string.
+        :param triple: If set to True, every block is triple encrypted.
+        :param parallel: optional ParallelCipher used for decryption. Its
+        backend may differ from that of cipher, as the decryption stages are
+        derived from it.
+        """
+
+        if len(iv) * 8 != cipher.block_size:
+            raise ValueError('IV must be exactly one block long')
+
+        self.cipher = cipher
+        self.bulk = bulk_cipher(cipher, parallel)
+        self.iv = iv
+        self.block_bytes = cipher.block_size // 8
+        self.encrypt_stages = stages_for(cipher, key, triple, True)
+        self.decrypt_stages = stages_for(self.bulk, key, triple, False)
+
+    def encrypt(self, data):
+        """
+        Encrypts a byte string. Like FeistelCipher.encrypt(), a short last
+        block is padded with leading zeros. Every block depends on the one
+        before it, so encryption is sequential.
+
+        :param data: byte string to be encrypted.
+        :return: byte string of the ciphertext.
+        """
+
+        n = self.block_bytes
+        short = len(data) % n
+        if short:
+            full = len(data) - short
+            data = data[:full] + '\x00' * (n - short) + data[full:]
+
+        count = len(data) // n
+        blocks = struct.unpack('>%dQ' % count, data)
+        previous = struct.unpack('>Q', self.iv)[0]
+        result = []
+
+        for block in blocks:
+            previous = int(self.cipher.process_blocks(
+                [block ^ previous], self.encrypt_stages)[0])
+            result.append(previous)
+
+        return struct.pack('>%dQ' % count, *result)
+
+    def decrypt(self, data):
+        """
+        Decrypts a byte string. Every block is decrypted independently, so
+        the whole ciphertext is decrypted in one bulk call and then XORed
+        with the ciphertext shifted by one block.
+
+        :param data: byte string of the ciphertext.
+        :return: byte string of the padded plaintext.
+        """
+
+        if len(data) % self.block_bytes:
+            raise ValueError('CBC ciphertext must be a whole number of '
+                             'blocks')
+
+        decrypted = self.bulk.process_bytes(data, self.decrypt_stages)
+        previous = self.iv + data[:len(data) - self.block_bytes]
+        return bitutils.xor_bytes(decrypted, previous)
+
+
+class CTRMode(object):
+
+    # Number of keystream blocks generated per bulk call.
+    BATCH_SIZE = 1 << 16
+
+    def __init__(self, cipher, key, nonce, triple=False, parallel=None):
+        """
+        :param cipher: the FeistelCipher to use.
+        :param key: key, either raw or as a KeySchedule. A 168 bit key or
+        three KeySchedules if triple is True.
+        :param nonce: initial counter block of block_size bits, as a byte
+        string. Block i of the message is XORed with the encryption of
+        nonce + i (mod 2^block_size).
+        :param triple: If set to True, the keystream is triple encrypted.
+        :param parallel: optional ParallelCipher used to generate the
+        keystream. The stages are derived from it.
+        """
+
+        if len(nonce) * 8 != cipher.block_size:
+            raise ValueError('Nonce must be exactly one block long')
+
+        self.bulk = bulk_cipher(cipher, parallel)
+        self.block_bytes = cipher.block_size // 8
+        self.counter = struct.unpack('>Q', nonce)[0]
+        self.stages = stages_for(self.bulk, key, triple, True)
+
+    def keystream(self, first, count):
+        """
+        Generates keystream blocks in batches.
+
+        :param first: index of the first block.
+        :param count: number of blocks.
+        :return: byte string of count keystream blocks.
+        """
+
+        mask = (1 << 64) - 1
+        result = []
+
+        for start in range(first, first + count, self.BATCH_SIZE):
+            n = min(self.BATCH_SIZE, first + count - start)
+            counters = struct.pack(
+                '>%dQ' % n,
+                *[(self.counter + i) & mask for i in xrange(start, start + n)])
+            result.append(self.bulk.process_bytes(counters, self.stages))
+
+        return ''.join(result)
+
+    def process(self, data, offset=0):
+        """
+        Encrypts or decrypts a byte string. The data may be any slice of a
+        message, as long as offset gives its position in that message, which
+        allows random access into large ciphertexts.
+
+        :param data: byte string to be processed.
+        :param offset: byte offset of data within the message.
+        :return: byte string of the same length as data.
+        """
+
+        first, skip = divmod(offset, self.block_bytes)
+        count = (skip + len(data) + self.block_bytes - 1) // self.block_bytes
+        keystream = self.keystream(first, count)[skip:skip + len(data)]
+        return bitutils.xor_bytes(data, keystream)
+
+    encrypt = process
+    decrypt = process
+
+    def decrypt_range(self, ciphertext, start, length):
+        """
+        Decrypts a byte range of a message without touching the blocks
+        before it.
+
+        :param ciphertext: the whole ciphertext, or any object that can be
+        sliced, e.g. an mmap of an encrypted file.
+        :param start: offset of the first byte to decrypt.
+        :param length: number of bytes to decrypt.
+        :return: byte string of the plaintext range.
+        """
+
+        return self.process(ciphertext[start:start + length], start)
@@ -0,0 +1,214 @@
+# !/usr/bin/python
+
+##############################################################################
+# @file    numpy_engine.py
+# @brief   This class provides a vectorized round engine for the Feistel
+# cipher. The blocks of a message are loaded into a NumPy array and every
+# round is applied to all of them at once.
+###############################################################################
+
+
+import numpy
+
+import bitops
+from des import DES
+from int_engine import IntEngine, compile_function
+
+
+ENCRYPT_BATCH_TEMPLATE = '''
+def encrypt_batch(self, blocks, stages):
+    e0, e1, e2, e3 = self.np_e_tables
+    %(s_tables)s= self.np_sp_tables
+
+    left = blocks >> 32
+    right = blocks & 0xffffffff
+
+    for sub_keys in stages:
+        for k in sub_keys:
+            x = (e0[right & 0xff] | e1[(right >> 8) & 0xff] |
+                 e2[(right >> 16) & 0xff] | e3[right >> 24]) ^ k
+            left, right = right, left ^ (
+            %(lookups)s)
+
+        left, right = right, left
+
+    return (left << 32) | right
+'''
+
+
+def block_view(data, count):
+    """
+    Views the first count blocks of a buffer as an array of big endian 64 bit
+    integers, without copying.
+
+    :param data: byte string or buffer.
+    :param count: number of blocks.
+    :return: '>u8' array sharing memory with data.
+    """
+
+    if isinstance(data, memoryview):
+        # numpy.frombuffer() does not accept memoryviews on Python 2.
+        return numpy.asarray(data)[:8 * count].view('>u8')
+    return numpy.frombuffer(data, dtype='>u8', count=count)
+
+
+class NumpyEngine(IntEngine):
+
+    # Below this number of blocks the per call overhead of NumPy outweighs
+    # the gain, so the scalar loop of IntEngine is used instead.
+    MIN_VECTOR_SIZE = 16
+
+    def __init__(self, number_of_rounds=16, block_size=64, tables=DES,
+                 batch_size=1 << 16):
+        """
+        :param batch_size: number of blocks processed per vectorized pass.
+        Bounds the size of the temporary arrays for large messages.
+        """
+
+        super(NumpyEngine, self).__init__(number_of_rounds, block_size, tables)
+
+        self.batch_size = batch_size
+        self.np_e_tables = [numpy.array(t, dtype=numpy.uint64)
+                            for t in self.e_tables]
+        self.np_sp_tables = [numpy.array(t, dtype=numpy.uint64)
+                             for t in self.sp_tables]
+
+    @classmethod
+    def compile_round_loops(cls, s_boxes):
+        """
+        :param s_boxes: number of S-boxes.
+        :return: encrypt_batch() generated for the given number of S-boxes.
+        The scalar loop comes from IntEngine.specialized().
+        """
+
+        return {'encrypt_batch': compile_function(
+            'encrypt_batch', ENCRYPT_BATCH_TEMPLATE, s_boxes)}
+
+    def encrypt_blocks(self, blocks, *stages):
+        """
+        Vectorized counterpart of IntEngine.encrypt_blocks().
+
+        :param blocks: array or list of 64 bit blocks.
+        :param stages: one list of 48 bit integer sub keys per stage.
+        :return: uint64 array of encrypted blocks, or a list for inputs
+        shorter than MIN_VECTOR_SIZE.
+        """
+
+        if len(blocks) < self.MIN_VECTOR_SIZE:
+            return super(NumpyEngine, self).encrypt_blocks(
+                [int(b) for b in blocks], *stages)
+
+        blocks = numpy.asarray(blocks, dtype=numpy.uint64)
+        stages = [[numpy.uint64(k) for k in sub_keys] for sub_keys in stages]
+        result = numpy.empty_like(blocks)
+
+        for start in range(0, len(blocks), self.batch_size):
+            end = start + self.batch_size
+            result[start:end] = self.encrypt_batch(blocks[start:end], stages)
+
+        return result
+
+    def encrypt_into(self, src, dst, *stages):
+        """
+        Vectorized counterpart of IntEngine.encrypt_into(). Both buffers are
+        viewed as arrays of big endian blocks, so the only copies made are
+        the working arrays of the current batch.
+
+        :param src: readable buffer, e.g. an mmap.
+        :param dst: writable buffer with room for len(src) rounded up to a
+        whole number of blocks.
+        :param stages: one list of integer sub keys per encryption stage.
+        :return: number of bytes written to dst.
+        """
+
+        full = len(src) - len(src) % 8
+        blocks = block_view(src, full // 8)
+        out = block_view(dst, full // 8)
+        np_stages = [[numpy.uint64(k) for k in sub_keys]
+                     for sub_keys in stages]
+
+        for start in range(0, len(blocks), self.batch_size):
+            end = start + self.batch_size
+            batch = blocks[start:end].astype(numpy.uint64)
+            out[start:end] = self.encrypt_batch(batch, np_stages)
+
+        return full + self.encrypt_tail_into(src, dst, full, *stages)
+
+    def encrypt_batch(self, blocks, stages):
+        """
+        Applies every round of every stage to a batch of blocks.
+
+        :param blocks: uint64 array of blocks.
+        :param stages: one list of numpy.uint64 sub keys per stage. A sub
+        key may also be a uint64 array with one key per block, which lets
+        every block be encrypted under its own key.
+        :return: uint64 array of encrypted blocks.
+        """
+
+        e0, e1, e2, e3 = self.np_e_tables
+        s0, s1, s2, s3, s4, s5, s6, s7 = self.np_sp_tables
+
+        left = blocks >> 32
+        right = blocks & 0xffffffff
+
+        for sub_keys in stages:
+            for k in sub_keys:
+                x = (e0[right & 0xff] | e1[(right >> 8) & 0xff] |
+                     e2[(right >> 16) & 0xff] | e3[right >> 24]) ^ k
+                left, right = right, left ^ (
+                    s0[x >> 42] | s1[(x >> 36) & 0x3f] |
+                    s2[(x >> 30) & 0x3f] | s3[(x >> 24) & 0x3f] |
+                    s4[(x >> 18) & 0x3f] | s5[(x >> 12) & 0x3f] |
+                    s6[(x >> 6) & 0x3f] | s7[x & 0x3f])
+
+            left, right = right, left
+
+        return (left << 32) | right
+
+    def to_blocks(self, bits):
+        """
+        Converts a bitarray into a uint64 array of blocks. The last block is
+        padded with leading zeros.
+
+        :param bits: bitarray to convert.
+        :return: uint64 array.
+        """
+
+        full = len(bits) - len(bits) % 64
+        blocks = self.unpack_blocks(bits[:full].tobytes())
+
+        if full != len(bits):
+            blocks = numpy.append(blocks,
+                                  numpy.uint64(int(bits[full:].to01(), 2)))
+
+        return blocks
+
+    @staticmethod
+    def unpack_blocks(data):
+        """
+        Converts a byte string into a uint64 array of blocks. A short last
+        block is padded with leading zeros.
+
+        :param data: byte string or buffer to convert.
+        :return: uint64 array.
+        """
+
+        full = len(data) - len(data) % 8
+        blocks = block_view(data, full // 8).astype(numpy.uint64)
+
+        if full != len(data):
+            tail = bitops.bytes_to_int(data[full:])
+            blocks = numpy.append(blocks, numpy.uint64(tail))
+
+        return blocks
+
+    @staticmethod
+    def pack_blocks(blocks):
+        """
+        Converts an array of blocks into a byte string.
+
+        :param blocks: uint64 array or list of blocks.
+        :return: byte string of the concatenated blocks.
+        """
+
+        return numpy.asarray(blocks, dtype=numpy.uint64).astype('>u8').tobytes()
@@ -0,0 +1,293 @@
+# !/usr/bin/python
+
+##############################################################################
+# @file    parallel_cipher.py
+# @brief   This class spreads the blocks of large messages over a pool of
+# worker processes, each running its own FeistelCipher.
+###############################################################################
+
+
+import cPickle
+import hashlib
+import multiprocessing
+from collections import OrderedDict
+
+from bitarray import bitarray
+
+from feistel_cipher import FeistelCipher
+from lru_cache import LRUCache
+import bitutils
+
+
+# Number of key schedules kept in the shared dictionary and in every worker.
+STAGE_CACHE_SIZE = 64
+
+# The cipher owned by a worker process. It is created once when the worker
+# starts, so the lookup tables of the backend are only built once per worker.
+_worker_cipher = None
+
+# Key schedules published by the parent process, keyed by schedule id, and
+# the ones this worker has fetched from there so far.
+_shared_stages = None
+_worker_stages = None
+
+
+def _init_worker(number_of_rounds, block_size, key_size, backend, tables,
+                 shared_stages):
+    global _worker_cipher, _shared_stages, _worker_stages
+    _worker_cipher = FeistelCipher(number_of_rounds, block_size, key_size,
+                                   backend, tables=tables)
+    _shared_stages = shared_stages
+    _worker_stages = LRUCache(STAGE_CACHE_SIZE)
+
+
+def _stages(schedule_id):
+    stages = _worker_stages.get(schedule_id)
+    if stages is None:
+        stages = _shared_stages[schedule_id]
+        _worker_stages.put(schedule_id, stages)
+    return stages
+
+
+def _process_shard(args):
+    schedule_id, data, length = args
+    stages = _stages(schedule_id)
+
+    if length is None:
+        return _worker_cipher.process_bytes(data, stages)
+
+    bits = bitarray()
+    bits.frombytes(data)
+    del bits[length:]
+    return _worker_cipher.encrypt_bits(bits, stages).tobytes()
+
+
+class ParallelCipher(object):
+    def __init__(self, cipher=None, processes=None, threshold=1 << 20,
+                 shards_per_process=4):
+        """
+        :param cipher: the FeistelCipher whose configuration the workers
+        copy. Defaults to a FeistelCipher using the 'int' backend.
+        :param processes: number of worker processes. Defaults to the number
+        of cores.
+        :param threshold: inputs smaller than this many bytes are encrypted
+        in the calling process.
+        :param shards_per_process: number of shards per worker that a large
+        input is split into, which evens out the load between workers.
+        """
+
+        if cipher is None:
+            cipher = FeistelCipher(backend='int')
+
+        self.cipher = cipher
+        self.processes = processes or multiprocessing.cpu_count()
+        self.threshold = threshold
+        self.shards_per_process = shards_per_process
+        self.pool = None
+        self.manager = None
+        # Ids of the key schedules in the shared dictionary, oldest first.
+        self.schedule_ids = OrderedDict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Shuts down the worker pool. A new pool is started if the cipher is
+        used again.
+        """
+
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+            self.manager.shutdown()
+            self.manager = None
+            self.schedule_ids.clear()
+
+    def get_pool(self):
+        """
+        :return: the worker pool, started on first use and reused by every
+        later call.
+        """
+
+        if self.pool is None:
+            c = self.cipher
+            self.manager = multiprocessing.Manager()
+            self.shared_stages = self.manager.dict()
+            self.pool = multiprocessing.Pool(
+                self.processes, _init_worker,
+                (c.number_of_rounds, c.block_size, c.key_size, c.backend,
+                 c.tables, self.shared_stages))
+        return self.pool
+
+    def schedule_id(self, stages):
+        """
+        Publishes the stages to the workers, unless they already were, so
+        that every worker fetches a key schedule once rather than with
+        every shard.
+
+        :param stages: one list of sub keys per stage.
+        :return: id the workers look the stages up by.
+        """
+
+        self.get_pool()
+        schedule_id = hashlib.sha1(cPickle.dumps(stages, 2)).digest()
+
+        if schedule_id in self.schedule_ids:
+            del self.schedule_ids[schedule_id]
+        else:
+            self.shared_stages[schedule_id] = stages
+            while len(self.schedule_ids) >= STAGE_CACHE_SIZE:
+                del self.shared_stages[self.schedule_ids.popitem(False)[0]]
+        self.schedule_ids[schedule_id] = True
+
+        return schedule_id
+
+    @property
+    def block_size(self):
+        return self.cipher.block_size
+
+    def key_schedule(self, key):
+        """
+        Same as FeistelCipher.key_schedule() of the wrapped cipher.
+        """
+
+        return self.cipher.key_schedule(key)
+
+    def triple_stages(self, key, encrypt=True):
+        """
+        Same as FeistelCipher.triple_stages() of the wrapped cipher.
+        """
+
+        return self.cipher.triple_stages(key, encrypt)
+
+    def encrypt(self, text, key, encrypt=True):
+        """
+        Parallel counterpart of FeistelCipher.encrypt().
+        """
+
+        stages = [self.cipher.key_schedule(key).sub_keys(encrypt)]
+        return self.encrypt_bits(self.cipher.parse_text(text), stages)
+
+    def decrypt(self, ciphertext, key):
+        """
+        Parallel counterpart of FeistelCipher.decrypt().
+        """
+
+        return self.encrypt(ciphertext, key, encrypt=False)
+
+    def triple_encrypt(self, text, key):
+        """
+        Parallel counterpart of FeistelCipher.triple_encrypt().
+        """
+
+        return self.encrypt_bits(self.cipher.parse_text(text),
+                                 self.cipher.triple_stages(key, True))
+
+    def triple_decrypt(self, text, key):
+        """
+        Parallel counterpart of FeistelCipher.triple_decrypt().
+        """
+
+        return self.encrypt_bits(self.cipher.parse_text(text),
+                                 self.cipher.triple_stages(key, False))
+
+    def encrypt_bytes(self, data, key):
+        """
+        Parallel counterpart of FeistelCipher.encrypt_bytes().
+        """
+
+        stages = [self.cipher.key_schedule(key).sub_keys(True)]
+        return self.process_bytes(data, stages)
+
+    def decrypt_bytes(self, data, key):
+        """
+        Parallel counterpart of FeistelCipher.decrypt_bytes().
+        """
+
+        stages = [self.cipher.key_schedule(key).sub_keys(False)]
+        return self.process_bytes(data, stages)
+
+    def triple_encrypt_bytes(self, data, key):
+        """
+        Parallel counterpart of FeistelCipher.triple_encrypt_bytes().
+        """
+
+        return self.process_bytes(data, self.cipher.triple_stages(key, True))
+
+    def triple_decrypt_bytes(self, data, key):
+        """
+        Parallel counterpart of FeistelCipher.triple_decrypt_bytes().
+        """
+
+        return self.process_bytes(data, self.cipher.triple_stages(key, False))
+
+    def encrypt_bits(self, bits, stages):
+        """
+        Splits parsed data into shards of whole blocks, encrypts the shards
+        in the worker pool and joins the results in their original order.
+
+        :param bits: bitarray of plaintext or ciphertext.
+        :param stages: one list of sub keys per stage.
+        :return: a bitarray of the encrypted/decrypted data.
+        """
+
+        if len(bits) < self.threshold * 8 or self.processes < 2:
+            return self.cipher.encrypt_bits(bits, stages)
+
+        schedule_id = self.schedule_id(stages)
+        shard_size = self.shard_size(len(bits), self.cipher.block_size)
+        tasks = []
+        for start in range(0, len(bits), shard_size):
+            shard = bits[start:start + shard_size]
+            tasks.append((schedule_id, shard.tobytes(), len(shard)))
+
+        result = bitarray()
+        result.frombytes(''.join(self.get_pool().map(_process_shard, tasks,
+                                                     1)))
+        return result
+
+    def process_bytes(self, data, stages, out=None):
+        """
+        Byte string counterpart of encrypt_bits().
+
+        :param data: byte string, bytearray or memoryview to be processed.
+        :param stages: one list of sub keys per stage.
+        :param out: optional writable buffer to write the result into.
+        :return: byte string of the result, or the number of bytes written
+        if out was given.
+        """
+
+        if len(data) < self.threshold or self.processes < 2:
+            return self.cipher.process_bytes(data, stages, out)
+
+        schedule_id = self.schedule_id(stages)
+        shard_size = self.shard_size(len(data), self.cipher.block_size // 8)
+        tasks = [(schedule_id,
+                  bitutils.to_bytes(data[start:start + shard_size]), None)
+                 for start in range(0, len(data), shard_size)]
+        results = self.get_pool().map(_process_shard, tasks, 1)
+
+        if out is None:
+            return ''.join(results)
+
+        offset = 0
+        for result in results:
+            out[offset:offset + len(result)] = result
+            offset += len(result)
+        return offset
+
+    def shard_size(self, length, unit):
+        """
+        :param length: length of the input.
+        :param unit: length of a block in the same unit as the input.
+        :return: shard length, a whole number of blocks.
+        """
+
+        shards = self.processes * self.shards_per_process
+        blocks = (length + unit - 1) // unit
+        return max(1, (blocks + shards - 1) // shards) * unit
@@ -0,0 +1,257 @@
+# !/usr/bin/python
+
+##############################################################################
+# @file    profiler.py
+# @brief   Opt-in instrumentation of a FeistelCipher. While a Profiler is
+# attached, the stages of the cipher and its backend are wrapped with timers
+# and counters. Nothing is wrapped otherwise, so an unprofiled cipher runs
+# exactly the same code as before.
+###############################################################################
+
+
+import timeit
+
+from bitarray import bitarray
+
+
+# Methods of FeistelCipher that are timed. The flag tells whether the size of
+# the first argument is recorded as the number of bytes processed.
+CIPHER_STAGES = [
+    ('parse_text', True),
+    ('chunks', True),
+    ('expand_key', False),
+    ('generate_sub_keys', False),
+    ('encrypt_bits', True),
+    ('join_blocks', False),
+    ('encrypt_round', False),
+    ('round_function', False),
+    ('permute', False),
+    ('substitute', False),
+]
+
+# Methods of the integer based engines that are timed, where the engine has
+# them. The last four belong to the bitsliced engine.
+ENGINE_STAGES = [
+    ('generate_sub_keys', False),
+    ('encrypt', True),
+    ('encrypt_bytes', True),
+    ('encrypt_into', True),
+    ('encrypt_blocks', False),
+    ('to_blocks', True),
+    ('from_blocks', False),
+    ('unpack_blocks', True),
+    ('pack_blocks', False),
+    ('encrypt_data', True),
+    ('transpose_in', True),
+    ('encrypt_slices', False),
+    ('transpose_out', False),
+]
+
+# Public entry points. The outermost call of these is also counted in the
+# totals of the backend.
+ENTRY_POINTS = ['process_text', 'process_bytes', 'process_into']
+
+
+def size_of(data):
+    """
+    :return: size of data in bytes, or 0 if it has no length.
+    """
+
+    if isinstance(data, bitarray):
+        return len(data) // 8
+    try:
+        return len(data)
+    except TypeError:
+        return 0
+
+
+class StageStats(object):
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.self_seconds = 0.0
+        self.bytes = 0
+
+    def __repr__(self):
+        return ('StageStats(calls=%d, seconds=%f, self_seconds=%f, '
+                'bytes=%d)' % (self.calls, self.seconds, self.self_seconds,
+                               self.bytes))
+
+
+class ProfileStats(object):
+    def __init__(self):
+        self.stages = {}
+
+    def __getitem__(self, name):
+        return self.stages[name]
+
+    def __contains__(self, name):
+        return name in self.stages
+
+    def stage(self, name):
+        """
+        :param name: name of the stage, e.g. 'cipher.permute'.
+        :return: the StageStats of the stage, created if needed.
+        """
+
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = StageStats()
+        return stats
+
+    def as_dict(self):
+        """
+        :return: flat dict mapping '<stage>.<counter>' to its value, e.g.
+        {'cipher.permute.calls': 96, 'cipher.permute.seconds': 0.01, ...}.
+        """
+
+        flat = {}
+        for name, stats in self.stages.items():
+            flat[name + '.calls'] = stats.calls
+            flat[name + '.seconds'] = stats.seconds
+            flat[name + '.self_seconds'] = stats.self_seconds
+            flat[name + '.bytes'] = stats.bytes
+        return flat
+
+    def breakdown(self):
+        """
+        Splits the time of the profiled calls over the stages by their self
+        time. The time the entry points spend outside every timed stage,
+        e.g. turning the output of an engine into a bitarray, is reported
+        as 'other', so that the parts add up to 'total'.
+
+        :return: dict mapping every stage that was called, 'other' and
+        'total' to seconds.
+        """
+
+        parts = {'other': 0.0, 'total': 0.0}
+        entry_points = set('cipher.' + name for name in ENTRY_POINTS)
+
+        for name, stats in self.stages.items():
+            if name == 'total':
+                parts['total'] = stats.seconds
+            elif name in entry_points:
+                parts['other'] += stats.self_seconds
+            elif not name.startswith('backend.') and stats.calls:
+                parts[name] = stats.self_seconds
+
+        return parts
+
+    def reset(self):
+        self.stages.clear()
+
+
+class Profiler(object):
+    def __init__(self, cipher=None):
+        """
+        :param cipher: optional FeistelCipher to attach to right away.
+        """
+
+        self.stats = ProfileStats()
+        self.cipher = None
+        self.wrapped = []
+        # Time spent in timed callees, one entry per active timed call. Used
+        # to compute the self time of every stage.
+        self.stack = []
+        self.entry_depth = 0
+
+        if cipher is not None:
+            self.attach(cipher)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.detach()
+
+    def attach(self, cipher):
+        """
+        Wraps the stages of a cipher and its engine with timers.
+
+        :param cipher: the FeistelCipher to instrument.
+        """
+
+        if self.cipher is not None:
+            raise ValueError('Profiler is already attached')
+
+        self.cipher = cipher
+
+        for name, count_bytes in CIPHER_STAGES:
+            self.wrap(cipher, name, ['cipher.' + name], count_bytes)
+
+        if cipher.engine is not None:
+            for name, count_bytes in ENGINE_STAGES:
+                if hasattr(cipher.engine, name):
+                    self.wrap(cipher.engine, name, ['engine.' + name],
+                              count_bytes)
+
+        for name in ENTRY_POINTS:
+            self.wrap(cipher, name, ['cipher.' + name], True,
+                      'backend.' + cipher.backend)
+
+    def detach(self):
+        """
+        Removes every wrapper, restoring the original methods.
+        """
+
+        for obj, name in self.wrapped:
+            delattr(obj, name)
+        self.wrapped = []
+        self.cipher = None
+
+    def wrap(self, obj, name, stage_names, count_bytes, backend_stage=None):
+        """
+        Replaces a method on an instance with a timed wrapper.
+
+        :param obj: instance whose method is wrapped.
+        :param name: name of the method.
+        :param stage_names: stages the call is recorded in.
+        :param count_bytes: whether the size of the first argument is
+        recorded.
+        :param backend_stage: if given, the outermost call is also recorded
+        in this stage.
+        """
+
+        func = getattr(obj, name)
+        stages = [self.stats.stage(s) for s in stage_names]
+        backend = self.stats.stage(backend_stage) if backend_stage else None
+        # Time of the outermost timed calls, which the self times of all
+        # stages add up to.
+        total = self.stats.stage('total')
+        stack = self.stack
+        timer = timeit.default_timer
+
+        def wrapper(*args, **kwargs):
+            outermost = backend is not None and self.entry_depth == 0
+            if backend is not None:
+                self.entry_depth += 1
+            stack.append(0.0)
+            start = timer()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = timer() - start
+                children = stack.pop()
+                if stack:
+                    stack[-1] += elapsed
+                else:
+                    total.calls += 1
+                    total.seconds += elapsed
+                    total.self_seconds += elapsed
+                if backend is not None:
+                    self.entry_depth -= 1
+
+                size = size_of(args[0]) if count_bytes and args else 0
+                for stats in stages:
+                    stats.calls += 1
+                    stats.seconds += elapsed
+                    stats.self_seconds += elapsed - children
+                    stats.bytes += size
+                if outermost:
+                    backend.calls += 1
+                    backend.seconds += elapsed
+                    backend.self_seconds += elapsed
+                    backend.bytes += size
+
+        setattr(obj, name, wrapper)
+        self.wrapped.append((obj, name))
@@ -9,10 +9,16 @@
 # and decryption utilizing the RSA cryptosystem.
 ###############################################################################
 
-import rsa
-from bitarray import bitarray
+import os
 import sys
 
+# The bit manipulation helpers are shared with Assignment 1.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..', 'Assignment 1', 'src'))
+
+import bitops
+import rsa
+
 
 def main():
     length = 32
@@ -37,40 +43,29 @@ def main():
                     binary = False
 
             if binary:
-                parsed = bitarray(m)
-                m = 0
-                for b in parsed:
-                    m = (m << 1) | b
+                m = bitops.bits_to_int(m)
             else:
                 print 'Input is not binary!'
         elif encrypt == '4':
             m = m.split(',')
-            m = [bitarray(c) for c in m]
 
         if encrypt == '1':
             cipher = rsa.encrypt(e, n, int(m))
             print 'Cipher: %d' % cipher
-            print 'Cipher binary: %s' % bitarray("{0:b}".format(cipher)).to01()
+            print 'Cipher binary: %s' % bitops.int_to_bits(cipher)
         elif encrypt == '2':
             cipher = rsa.encrypt_str(e, n, m)
             cipher_str = [str(c) for c in cipher]
             print 'Cipher: %s' % ''.join(cipher_str)
-            binary_str = [bitarray("{0:b}".format(int(number))).to01() for number in cipher_str]
+            binary_str = [bitops.int_to_bits(c) for c in cipher]
             print 'Cipher binary: %s' % ','.join(binary_str)
         elif encrypt == '3':
             plaintext = rsa.decrypt(d, n, m)
             print 'Plaintext: %d' % plaintext
-            b = bitarray("{0:b}".format(plaintext))
-            print 'Plaintext binary: %s' % b.to01()
+            print 'Plaintext binary: %s' % bitops.int_to_bits(plaintext)
         elif encrypt == '4':
-            numberic_cipher = []
-            for c in m:
-                i = 0
-                for b in c:
-                    i = (i << 1) | b
-                numberic_cipher.append(i)
-            decrypted_list = rsa.decrypt_list(d, n, numberic_cipher)
-            print ''.join([chr(c) for c in decrypted_list])
+            numberic_cipher = [bitops.bits_to_int(c) for c in m]
+            print rsa.decrypt_str(d, n, numberic_cipher)
 
 if __name__ == '__main__':
     main()
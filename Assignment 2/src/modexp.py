@@ -0,0 +1,269 @@
+# !/usr/bin/python
+
+##############################################################################
+# @file    modexp.py
+# @brief   Modular exponentiation. A context is built once per modulus and
+# holds its Montgomery constants, so that repeated exponentiations modulo
+# the same number only pay for the setup once. Every context picks the
+# fastest of the available methods for the size of its modulus.
+###############################################################################
+
+import random
+import timeit
+from collections import OrderedDict
+
+
+# Methods of exponentiation. 'builtin' is the three argument pow(),
+# 'binary' is plain square-and-multiply and 'window' is sliding window
+# exponentiation in Montgomery form.
+METHODS = ('builtin', 'binary', 'window')
+
+# Fastest method per modulus size, as a list of (bits, method) sorted by
+# bits. A modulus uses the method of the first entry that is at least as
+# large as it, or of the last entry. Measured with calibrate() on CPython
+# 2.7: the builtin pow() is as fast as the sliding window in Montgomery form
+# at 1024 bits and 5-18% faster from 2048 to 4096 bits. At 8192 bits the
+# two trade places from run to run, so there is no crossover to switch at.
+# Run calibrate() to measure the crossover on another interpreter.
+FASTEST = [(4096, 'builtin')]
+
+# Contexts of the most recently used moduli, see context(). Ordered from
+# the least to the most recently used, like Assignment 1's LRUCache.
+CONTEXT_CACHE_SIZE = 64
+_contexts = OrderedDict()
+
+
+def binary_pow(a, b, n):
+    """
+    Compute (a ** b) % n with square-and-multiply.
+    """
+    f = 1
+    while b:
+        if b & 1:
+            f = f * a % n
+        b >>= 1
+        a = a * a % n
+    return f % n
+
+
+def context(n):
+    """
+    :return: the ModContext of a modulus, reused while the modulus is among
+    the CONTEXT_CACHE_SIZE most recently used ones. Moduli that are only
+    used once should get a ModContext of their own instead.
+    """
+    ctx = _contexts.pop(n, None)
+    if ctx is None:
+        ctx = ModContext(n)
+        while len(_contexts) >= CONTEXT_CACHE_SIZE:
+            _contexts.popitem(last=False)
+    _contexts[n] = ctx
+    return ctx
+
+
+def method_for(bits):
+    """
+    :return: the fastest method for a modulus of the given size.
+    """
+    for size, method in FASTEST:
+        if bits <= size:
+            return method
+    return FASTEST[-1][1]
+
+
+def window_size(bits):
+    """
+    :return: window width for an exponent of the given size.
+    """
+    for limit, width in ((671, 6), (239, 5), (79, 4), (23, 3)):
+        if bits > limit:
+            return width
+    return 1
+
+
+class ModContext(object):
+    def __init__(self, n, method=None):
+        """
+        :param n: modulus.
+        :param method: one of METHODS. Defaults to the fastest method for
+        the size of n.
+        """
+        self.n = n
+        self.method = method or method_for(n.bit_length())
+        self.montgomery = None
+
+    def setup_montgomery(self):
+        """
+        Computes the Montgomery constants of an odd modulus: the width k of
+        R = 2**k, n' with n * n' = -1 (mod R) and R**2 mod n.
+        """
+        n = self.n
+        k = n.bit_length()
+        mask = (1 << k) - 1
+
+        # Newton iteration for the inverse of n modulo R. Every step doubles
+        # the number of correct low bits, and n is its own inverse modulo 8.
+        inverse = n
+        bits = 3
+        while bits < k:
+            inverse = inverse * (2 - n * inverse) & mask
+            bits *= 2
+
+        self.montgomery = (k, mask, -inverse & mask, (1 << (2 * k)) % n)
+
+    def pow(self, base, exp):
+        """
+        :return: (base ** exp) % n.
+        """
+        if self.method == 'builtin':
+            return pow(base, exp, self.n)
+        if self.method == 'binary':
+            return binary_pow(base, exp, self.n)
+        return self.window_pow(base, exp)
+
+    def window_pow(self, base, exp):
+        """
+        Left to right sliding window exponentiation. Odd moduli are reduced
+        with Montgomery multiplication, even moduli with plain remainders.
+        """
+        n = self.n
+        if exp == 0:
+            return 1 % n
+
+        if n & 1:
+            if self.montgomery is None:
+                self.setup_montgomery()
+            k, mask, n_prime, r2 = self.montgomery
+
+            def mul(a, b):
+                t = a * b
+                u = (t + ((t & mask) * n_prime & mask) * n) >> k
+                return u - n if u >= n else u
+
+            x = mul(base % n, r2)
+            one = (1 << k) % n
+        else:
+            def mul(a, b):
+                return a * b % n
+
+            x = base % n
+            one = 1 % n
+
+        # Odd powers x, x**3, ..., x**(2**width - 1).
+        width = window_size(exp.bit_length())
+        odd = [x]
+        square = mul(x, x)
+        for _ in range((1 << (width - 1)) - 1):
+            odd.append(mul(odd[-1], square))
+
+        result = one
+        i = exp.bit_length() - 1
+        while i >= 0:
+            if not (exp >> i) & 1:
+                result = mul(result, result)
+                i -= 1
+                continue
+
+            # Longest window of at most width bits that ends in a one.
+            j = max(i - width + 1, 0)
+            while not (exp >> j) & 1:
+                j += 1
+            for _ in range(i - j + 1):
+                result = mul(result, result)
+            result = mul(result, odd[((exp >> j) & ((1 << (i - j + 1)) - 1))
+                                     >> 1])
+            i = j - 1
+
+        if n & 1:
+            result = mul(result, 1)
+        return result
+
+    def fixed_base(self, base, exp_bits, width=4):
+        """
+        :return: a FixedBase for raising base to exponents of up to
+        exp_bits bits modulo n.
+        """
+        return FixedBase(self, base, exp_bits, width)
+
+
+class FixedBase(object):
+    def __init__(self, context, base, exp_bits, width=4):
+        """
+        Precomputes base ** (d * 2 ** (width * i)) for every window i of
+        the exponent and every digit d, so that an exponentiation is one
+        multiplication per window and needs no squarings.
+
+        :param context: ModContext of the modulus.
+        :param base: the fixed base.
+        :param exp_bits: largest exponent size. Larger exponents fall back
+        to the context.
+        :param width: number of exponent bits per window.
+        """
+        n = context.n
+        self.context = context
+        self.base = base
+        self.exp_bits = exp_bits
+        self.width = width
+        self.tables = []
+
+        power = base % n
+        for _ in range(-(-exp_bits // width)):
+            table = [1 % n, power]
+            for _ in range((1 << width) - 2):
+                table.append(table[-1] * power % n)
+            self.tables.append(table)
+            power = table[-1] * power % n
+
+    def pow(self, exp):
+        """
+        :return: (base ** exp) % n.
+        """
+        if exp.bit_length() > self.exp_bits:
+            return self.context.pow(self.base, exp)
+
+        n = self.context.n
+        mask = (1 << self.width) - 1
+        result = 1 % n
+        for table in self.tables:
+            if not exp:
+                break
+            digit = exp & mask
+            if digit:
+                result = result * table[digit] % n
+            exp >>= self.width
+        return result
+
+
+def calibrate(bit_sizes=(64, 128, 256, 512, 1024, 2048), repeats=3,
+              update=True):
+    """
+    Times every method on random operands with full size exponents and
+    records the fastest method per modulus size in FASTEST.
+
+    :param bit_sizes: modulus sizes to measure.
+    :param repeats: exponentiations timed per method and size.
+    :param update: If set to False, FASTEST is left unchanged.
+    :return: dictionary mapping every size to a dictionary of the seconds
+    per exponentiation of every method.
+    """
+    timings = {}
+    fastest = []
+
+    for bits in bit_sizes:
+        n = random.getrandbits(bits) | 1 << (bits - 1) | 1
+        operands = [(random.randrange(n), random.getrandbits(bits))
+                    for _ in range(repeats)]
+        timings[bits] = {}
+
+        for method in METHODS:
+            context = ModContext(n, method)
+            start = timeit.default_timer()
+            for base, exp in operands:
+                context.pow(base, exp)
+            timings[bits][method] = (timeit.default_timer() - start) / repeats
+
+        fastest.append((bits, min(METHODS, key=timings[bits].get)))
+
+    if update:
+        FASTEST[:] = fastest
+    return timings
@@ -0,0 +1,166 @@
+# !/usr/bin/python
+
+##############################################################################
+# @file    parallel_keygen.py
+# @brief   RSA key generation with the search for p and q spread over worker
+# processes. Every worker searches its own random stream of candidates, the
+# first two distinct primes found become p and q, and the remaining workers
+# are told to stop.
+###############################################################################
+
+import multiprocessing
+import Queue
+import random
+import timeit
+
+import rsa
+
+
+def _search(bits, seed, worker, results, stop):
+    rng = random.Random(seed)
+    try:
+        while not stop.is_set():
+            p = rsa.generate_random_prime(bits, rsa.miller_rabin, rng=rng,
+                                          cancelled=stop.is_set)
+            if p is None:
+                break
+            results.put((worker, p, None))
+    except Exception as e:
+        # Handed to the parent, which would otherwise wait for primes that
+        # never come. The worker exits once the parent has read it.
+        results.put((worker, None, e))
+    else:
+        # The parent stops reading once it has its primes, so a cancelled
+        # worker must be able to exit with results still buffered.
+        results.cancel_join_thread()
+
+
+class KeygenReport(object):
+    def __init__(self, bits, processes):
+        """
+        Latencies of one parallel key generation.
+
+        :param bits: number of bits of the modulus.
+        :param processes: number of worker processes.
+        """
+        self.bits = bits
+        self.processes = processes
+        # (worker, seconds) of p and q, in the order they were found.
+        self.primes = []
+        self.total = None
+
+    def as_dict(self):
+        return {'bits': self.bits, 'processes': self.processes,
+                'primes': [{'worker': w, 'seconds': s}
+                           for w, s in self.primes],
+                'total': self.total}
+
+    def __repr__(self):
+        found = ', '.join('worker %d after %.3f s' % p for p in self.primes)
+        return ('KeygenReport(%d bits, %d processes: %s, total %.3f s)' %
+                (self.bits, self.processes, found, self.total or 0.0))
+
+
+class ParallelKeyGenerator(object):
+    def __init__(self, processes=None, seed=None, timeout=1.0,
+                 poll_interval=0.1):
+        """
+        :param processes: number of worker processes. Defaults to the number
+        of cores.
+        :param seed: seed of the candidate streams. Worker i always searches
+        the same stream for the same seed, so every prime it finds is
+        reproducible. Which workers find p and q first still depends on
+        timing; one process makes the keys fully reproducible.
+        :param timeout: seconds a cancelled worker is given to stop before
+        it is terminated.
+        :param poll_interval: seconds between checks that the workers are
+        still running while waiting for primes.
+        """
+        self.processes = processes or multiprocessing.cpu_count()
+        self.seed = seed
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.report = None
+
+    def seeds(self):
+        """
+        :return: list of the seeds of every worker, or of None for streams
+        seeded from the system when no seed is given.
+        """
+        if self.seed is None:
+            return [None] * self.processes
+        return [(self.seed << 32) + i for i in range(self.processes)]
+
+    def find_primes(self, bits):
+        """
+        Runs the workers until two distinct primes have been found, then
+        cancels the others. An exception raised in a worker is raised again
+        here, and a RuntimeError is raised if every worker has exited
+        without finding the primes.
+
+        :return: tuple of the two primes, in the order they were found.
+        """
+        report = self.report
+        start = timeit.default_timer()
+        results = multiprocessing.Queue()
+        stop = multiprocessing.Event()
+        workers = [multiprocessing.Process(target=_search,
+                                           args=(bits, s, i, results, stop))
+                   for i, s in enumerate(self.seeds())]
+
+        found = []
+        try:
+            for w in workers:
+                w.daemon = True
+                w.start()
+            while len(found) < 2:
+                try:
+                    worker, p, error = results.get(
+                        timeout=self.poll_interval)
+                except Queue.Empty:
+                    # A worker may put its result just before it exits.
+                    if (any(w.is_alive() for w in workers) or
+                            not results.empty()):
+                        continue
+                    raise RuntimeError('All workers exited before two '
+                                       'primes were found')
+                if error is not None:
+                    raise error
+                if p not in found:
+                    found.append(p)
+                    report.primes.append(
+                        (worker, timeit.default_timer() - start))
+        finally:
+            stop.set()
+            for w in workers:
+                w.join(self.timeout)
+                if w.is_alive():
+                    w.terminate()
+                    w.join()
+        return tuple(found)
+
+    def generate(self, length):
+        """
+        :param length: number of bits of the modulus.
+        :return: tuple of the public exponent, the private key and the
+        modulus. The latencies are left in self.report.
+        """
+        self.report = KeygenReport(length, self.processes)
+        start = timeit.default_timer()
+
+        if self.processes < 2:
+            keys = rsa.generate_keys(length, 1, self.seed)
+        else:
+            p, q = self.find_primes(length // 2)
+            rng = random.Random(self.seed) if self.seed is not None else None
+            keys = rsa.keys_from_primes(p, q, rng)
+
+        self.report.total = timeit.default_timer() - start
+        return keys
+
+
+def generate_keys(length, processes=None, seed=None):
+    """
+    Parallel counterpart of rsa.generate_keys().
+    """
+    return ParallelKeyGenerator(processes, seed).generate(length)
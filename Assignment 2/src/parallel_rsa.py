@@ -0,0 +1,132 @@
+# !/usr/bin/python
+
+##############################################################################
+# @file    parallel_rsa.py
+# @brief   Bulk RSA encryption and decryption on a pool of worker processes.
+# The key is handed to every worker once when the pool starts, and the
+# results come back in the order of the input.
+###############################################################################
+
+import multiprocessing
+
+import rsa
+
+
+# The (exponent, modulus) pair owned by a worker process.
+_worker_key = None
+
+
+def _init_worker(exponent, n):
+    global _worker_key
+    _worker_key = (exponent, n)
+
+
+def _process_chunk(chunk):
+    exponent, n = _worker_key
+    return [rsa.decrypt(exponent, n, x) for x in chunk]
+
+
+class BulkRSA(object):
+    def __init__(self, exponent, n, processes=None, threshold=64,
+                 chunks_per_process=4):
+        """
+        Raises lists of numbers to one exponent modulo n. A PrivateKey as
+        exponent is used with CRT, just like rsa.decrypt() does.
+
+        :param exponent: public exponent to encrypt, or private exponent
+        to decrypt.
+        :param n: modulus.
+        :param processes: number of worker processes. Defaults to the number
+        of cores.
+        :param threshold: inputs shorter than this are processed in the
+        calling process.
+        :param chunks_per_process: number of chunks per worker that a large
+        input is split into, which evens out the load between workers.
+        """
+        self.exponent = exponent
+        self.n = n
+        self.processes = processes or multiprocessing.cpu_count()
+        self.threshold = threshold
+        self.chunks_per_process = chunks_per_process
+        self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Shuts down the worker pool. A new pool is started if it is used
+        again.
+        """
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def get_pool(self):
+        """
+        :return: the worker pool, started on first use and reused by every
+        later call.
+        """
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(self.processes, _init_worker,
+                                             (self.exponent, self.n))
+        return self.pool
+
+    def imap(self, values):
+        """
+        Generator of the results, in the order of values. Chunks are
+        processed ahead while earlier results are consumed.
+
+        :param values: list of numbers below n.
+        """
+        if len(values) < self.threshold or self.processes < 2:
+            for x in values:
+                yield rsa.decrypt(self.exponent, self.n, x)
+            return
+
+        chunks = self.processes * self.chunks_per_process
+        size = max(1, -(-len(values) // chunks))
+        tasks = [values[i:i + size] for i in range(0, len(values), size)]
+        for chunk in self.get_pool().imap(_process_chunk, tasks):
+            for result in chunk:
+                yield result
+
+    def map(self, values):
+        """
+        :return: list of the results, in the order of values.
+        """
+        return list(self.imap(values))
+
+    def map_into(self, values, out, offset=0):
+        """
+        Writes the results into a preallocated sequence.
+
+        :param out: list or other sequence with room for the results.
+        :param offset: index of out that the first result is written to.
+        :return: number of results written.
+        """
+        i = offset
+        for result in self.imap(values):
+            out[i] = result
+            i += 1
+        return i - offset
+
+
+def encrypt_list(e, n, l, processes=None):
+    """
+    Parallel counterpart of rsa.encrypt_list().
+    """
+    with BulkRSA(e, n, processes) as bulk:
+        return bulk.map(l)
+
+
+def decrypt_list(d, n, l, processes=None):
+    """
+    Parallel counterpart of rsa.decrypt_list().
+    """
+    with BulkRSA(d, n, processes) as bulk:
+        return bulk.map(l)
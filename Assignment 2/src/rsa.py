@@ -1,3 +1,9 @@
+import binascii
+import struct
+
+import modexp
+
+
 def encrypt(e, n, m):
     return pow_mod(m, e, n)
 
@@ -7,15 +13,106 @@ def encrypt_list(e, n, l):
 
 
 def encrypt_str(e, n, s):
-    return encrypt_list(e, n, [ord(c) for c in list(s)])
+    """
+    Encrypts a string with as many bytes per block as fit under n. Unicode
+    strings are encoded as UTF-8 first.
+    """
+    if isinstance(s, unicode):
+        s = s.encode('utf-8')
+    return encrypt_bytes(e, n, s)
+
+
+def decrypt_str(d, n, l):
+    """
+    Reverses encrypt_str(). Text that was given as unicode is returned
+    UTF-8 encoded.
+    """
+    return decrypt_bytes(d, n, l)
+
+
+def block_size(n):
+    """
+    Returns the number of bytes packed into a block, the most for which
+    every block value is below n.
+    """
+    size = (n.bit_length() - 1) // 8
+    if size < 1:
+        raise ValueError('Modulus is too small to hold a byte')
+    return size
+
+
+def encode_bytes(data, size):
+    """
+    Frames data with its length as a 4 byte prefix, pads it with zeros to
+    whole blocks of size bytes and returns the blocks as numbers.
+    """
+    framed = struct.pack('>I', len(data)) + data
+    framed += '\x00' * (-len(framed) % size)
+    return [int(binascii.hexlify(framed[i:i + size]), 16)
+            for i in range(0, len(framed), size)]
+
+
+def decode_bytes(blocks, size):
+    """
+    Reverses encode_bytes().
+    """
+    framed = ''.join(binascii.unhexlify('%0*x' % (2 * size, b))
+                     for b in blocks)
+    if len(framed) < 4:
+        raise ValueError('Message is too short')
+    length = struct.unpack('>I', framed[:4])[0]
+    if length > len(framed) - 4:
+        raise ValueError('Message is truncated')
+    return framed[4:4 + length]
+
+
+def encrypt_bytes(e, n, data):
+    return encrypt_list(e, n, encode_bytes(data, block_size(n)))
+
+
+def decrypt_bytes(d, n, l):
+    return decode_bytes(decrypt_list(d, n, l), block_size(n))
+
+
+class PrivateKey(long):
+    """
+    Private exponent that also carries the factors of the modulus and the
+    CRT parameters derived from them. It is still the number d, so it can
+    be used wherever a plain private exponent is expected.
+    """
+
+    def __new__(cls, d, p, q):
+        key = long.__new__(cls, d)
+        key.p = p
+        key.q = q
+        key.n = p * q
+        key.d_p = d % (p - 1)
+        key.d_q = d % (q - 1)
+        key.q_inv = modulo_inverse(q, p)
+        return key
+
+    def __reduce__(self):
+        return PrivateKey, (long(self), self.p, self.q)
+
+    def decrypt(self, c):
+        """
+        Decrypts with two half size exponentiations, recombined with
+        Garner's formula.
+        """
+        m1 = pow_mod(c % self.p, self.d_p, self.p)
+        m2 = pow_mod(c % self.q, self.d_q, self.q)
+        h = self.q_inv * (m1 - m2) % self.p
+        return m2 + h * self.q
 
 
 def decrypt(d, n, c):
+    if isinstance(d, PrivateKey) and d.n == n:
+        return d.decrypt(c)
     return pow_mod(c, d, n)
 
 
 def decrypt_list(d, n, l):
-    return [pow_mod(x, d, n) for x in l]
+    return [decrypt(d, n, x) for x in l]
 
 
 def gcd(a, b):
@@ -49,38 +146,65 @@ def modulo_inverse(a, m):
         return x % m
 
 
-def generate_random_prime(bits, primality_test):
+def generate_random_prime(bits, primality_test, window=None, rng=None,
+                          cancelled=None):
     """
     Generate random prime number with n bits.
+
+    Odd candidates from a random starting point are sieved by the small
+    primes a window at a time, and only the survivors are handed to the
+    primality test. The residues of the start modulo every small prime are
+    computed once and moved along with the window.
+
+    :param rng: random.Random the starting point is drawn from. Defaults
+    to the random module.
+    :param cancelled: callable that is checked before every primality
+    test. The search gives up and returns None once it returns True.
     """
     import random
-    import itertools
+    from primes import first_thousand_primes
 
+    if rng is None:
+        rng = random
     # Always set the most significant bit to one to ensure that the
     # number is large enough.
-    get_random_number = lambda: random.getrandbits(bits) | 1 << bits | 1
-    p = get_random_number()
-    for i in itertools.count(1):
-        if primality_test(p):
-            return p
-        else:
-            if i % (bits * 2) == 0:
-                p = get_random_number()
-            else:
-                p += 2
+    p = rng.getrandbits(bits) | 1 << bits | 1
+    if window is None:
+        window = max(64, 4 * bits)
+    small = first_thousand_primes[1:]
+    residues = [p % q for q in small]
+    marked = '\x01' * window
+
+    while True:
+        # sieve[i] is set if p + 2 * i has a small prime factor.
+        sieve = bytearray(window)
+        for q, r in zip(small, residues):
+            # First i with p + 2 * i = 0 (mod q), (q + 1) // 2 being the
+            # inverse of 2.
+            i = (q - r) * ((q + 1) // 2) % q
+            if p + 2 * i == q:
+                i += q
+            if i < window:
+                sieve[i::q] = marked[:(window - 1 - i) // q + 1]
+
+        i = sieve.find('\x00')
+        while i != -1:
+            if cancelled is not None and cancelled():
+                return None
+            if primality_test(p + 2 * i):
+                return p + 2 * i
+            i = sieve.find('\x00', i + 1)
+
+        p += 2 * window
+        residues = [(r + 2 * window) % q for q, r in zip(small, residues)]
 
 
 def pow_mod(a, b, n):
     """
-    Compute (a ** b) % n efficiently.
+    Compute (a ** b) % n efficiently, with the fastest method for the size
+    of n.
     """
-    f = 1
-    while b:
-        if b & 1:
-            f = f * a % n
-        b >>= 1
-        a = a * a % n
-    return f
+    return modexp.context(n).pow(a, b)
 
 
 def probably_prime(n, k=20):
@@ -89,7 +213,6 @@ def probably_prime(n, k=20):
     test. Return False if n is proved to be
     composite.
     """
-    from random import randrange
     from primes import first_thousand_primes
 
     if n < 2:
@@ -99,17 +222,33 @@ def probably_prime(n, k=20):
             return True
         if n % p == 0:
             return False
+    return miller_rabin(n, k)
+
+
+def miller_rabin(n, k=20):
+    """
+    Rabin-Miller test without trial division first, for candidates that
+    have already been sieved by the small primes.
+    """
+    from random import randrange
+
+    if n < 5:
+        return n in (2, 3)
+    if n % 2 == 0:
+        return False
     r, s = 0, n - 1
     while s % 2 == 0:
         r += 1
         s //= 2
+    # Every candidate is a new modulus, so its context is not cached.
+    ctx = modexp.ModContext(n)
     for _ in range(k):
         a = randrange(2, n - 1)
-        x = pow_mod(a, s, n)
+        x = ctx.pow(a, s)
         if x == 1 or x == n - 1:
             continue
         for _ in range(r - 1):
-            x = pow_mod(x, 2, n)
+            x = x * x % n
             if x == n - 1:
                 break
         else:
@@ -117,24 +256,51 @@ def probably_prime(n, k=20):
     return True
 
 
-def generate_keys(length):
+def generate_keys(length, processes=1, seed=None):
+    """
+    :param length: number of bits of the modulus.
+    :param processes: number of worker processes searching for p and q at
+    the same time, see parallel_keygen. None uses every core.
+    :param seed: seed that makes the keys reproducible.
+    :return: tuple of the public exponent, the private key and the modulus.
+    """
     import random
 
-    p = generate_random_prime(length // 2, probably_prime)
+    if processes != 1:
+        import parallel_keygen
+        return parallel_keygen.generate_keys(length, processes, seed)
+
+    rng = random.Random(seed) if seed is not None else random
+    p = generate_random_prime(length // 2, miller_rabin, rng=rng)
     #print 'P: %d' % p
-    q = generate_random_prime(length // 2, probably_prime)
+    q = generate_random_prime(length // 2, miller_rabin, rng=rng)
     #print 'Q: %d' % q
     # Ensure that p != q
     while q == p:
-        q = generate_random_prime(length // 2, probably_prime)
+        q = generate_random_prime(length // 2, miller_rabin, rng=rng)
+    return keys_from_primes(p, q, rng)
+
+
+def keys_from_primes(p, q, rng=None):
+    """
+    :param p: prime.
+    :param q: prime other than p.
+    :param rng: random.Random the public exponent is drawn from. Defaults
+    to the random module.
+    :return: tuple of the public exponent, the private key and the modulus.
+    """
+    import random
+
+    if rng is None:
+        rng = random
     n = p * q
     #print 'N: %d' % n
     phi_n = phi(p, q)
     while True:
-        e = random.randint(3, phi_n - 1)
+        e = rng.randint(3, phi_n - 1)
         if gcd(e, phi_n) == 1:
             break
     #e = 65537
-    d = modulo_inverse(e, phi_n)
+    d = PrivateKey(modulo_inverse(e, phi_n), p, q)
     #print 'D: %d' % d
     return e, d, n
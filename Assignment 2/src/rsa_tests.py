@@ -0,0 +1,358 @@
+# !/usr/bin/python
+
+##############################################################################
+# @file    rsa_tests.py
+# @brief   Unit tests of the RSA cryptosystem and the modular arithmetic it
+# is built on.
+###############################################################################
+
+
+import random
+import unittest
+
+import modexp
+import parallel_keygen
+import parallel_rsa
+import rsa
+
+
+def worker_key_type(_):
+    return type(parallel_rsa._worker_key[0])
+
+
+class FixedRandom(object):
+    """
+    Stands in for random.Random with a fixed starting point.
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+    def getrandbits(self, bits):
+        return self.value & ((1 << bits) - 1)
+
+
+class RSATests(unittest.TestCase):
+    def setUp(self):
+        self.e, self.d, self.n = rsa.generate_keys(256, seed=1)
+
+    def test_crt_decryption(self):
+        """
+        Decryption with the CRT parameters of the private key must give the
+        same result as a plain exponentiation with the private exponent,
+        also for ciphertexts that are multiples of one of the factors.
+        """
+
+        d, n = self.d, self.n
+        rng = random.Random(2)
+        values = [0, 1, 2, n - 1, d.p, d.q, 5 * d.q]
+        values += [rng.randrange(n) for _ in range(50)]
+
+        for c in values:
+            self.assertEquals(pow(c, long(d), n), d.decrypt(c))
+            self.assertEquals(pow(c, long(d), n), rsa.decrypt(d, n, c))
+        for m in values:
+            self.assertEquals(m, rsa.decrypt(d, n, rsa.encrypt(self.e, n, m)))
+
+    def test_crt_parameters(self):
+        """
+        The private key must keep its factors and survive pickling.
+        """
+
+        import pickle
+
+        d = self.d
+        self.assertEquals(self.n, d.p * d.q)
+        self.assertEquals(1, d.q * d.q_inv % d.p)
+        self.assertEquals(1, self.e * d % ((d.p - 1) * (d.q - 1)))
+
+        copy = pickle.loads(pickle.dumps(d))
+        self.assertIsInstance(copy, rsa.PrivateKey)
+        self.assertEquals((long(d), d.p, d.q), (long(copy), copy.p, copy.q))
+
+    def test_block_size(self):
+        """
+        A block must hold the most whole bytes for which every value is
+        below n.
+        """
+
+        self.assertEquals(1, rsa.block_size(256))
+        self.assertEquals(1, rsa.block_size(257))
+        self.assertEquals(1, rsa.block_size(65535))
+        self.assertEquals(2, rsa.block_size(65536))
+        self.assertRaises(ValueError, rsa.block_size, 255)
+        size = rsa.block_size(self.n)
+        self.assertTrue(256 ** size <= self.n < 256 ** (size + 2))
+
+    def test_byte_packing(self):
+        """
+        Encoding bytes into blocks and decoding them must give back the
+        input, whatever its length and content.
+        """
+
+        for size in [1, 3, 8, 31]:
+            # The last two fill whole blocks, with and without the prefix.
+            for data in ['', '\x00', '\x00\x00abc', 'abc\x00\x00',
+                         '\xff' * 100, 'y' * (4 * size - 4), 'z' * 8 * size]:
+                blocks = rsa.encode_bytes(data, size)
+                self.assertEquals(-(-(4 + len(data)) // size), len(blocks))
+                self.assertTrue(all(0 <= b < 256 ** size for b in blocks))
+                self.assertEquals(data, rsa.decode_bytes(blocks, size))
+
+        for data in ['', '\x00leading zeros', u'unicode \xe6\xf8\xe5']:
+            blocks = rsa.encrypt_str(self.e, self.n, data)
+            self.assertTrue(all(b < self.n for b in blocks))
+            self.assertEquals(data.encode('utf-8') if isinstance(data, unicode)
+                              else data,
+                              rsa.decrypt_str(self.d, self.n, blocks))
+
+    def test_bad_length_prefix(self):
+        """
+        Decoding must reject input that is too short to hold the length
+        prefix, or whose prefix claims more bytes than there are.
+        """
+
+        blocks = rsa.encode_bytes('abcdefgh', 4)
+        self.assertRaises(ValueError, rsa.decode_bytes, [], 4)
+        self.assertRaises(ValueError, rsa.decode_bytes, [1], 2)
+        self.assertRaises(ValueError, rsa.decode_bytes, blocks[:-1], 4)
+        self.assertRaises(ValueError, rsa.decode_bytes,
+                          [0xffffffff] + blocks[1:], 4)
+
+
+class BulkRSATests(unittest.TestCase):
+    def setUp(self):
+        self.e, self.d, self.n = rsa.generate_keys(256, seed=1)
+        rng = random.Random(4)
+        self.values = [rng.randrange(self.n) for _ in range(37)]
+
+    def test_order(self):
+        """
+        Results split over several chunks and workers must come back in
+        the order of the input.
+        """
+
+        expected = [pow(m, self.e, self.n) for m in self.values]
+        with parallel_rsa.BulkRSA(self.e, self.n, processes=2, threshold=0,
+                                  chunks_per_process=3) as bulk:
+            self.assertEquals(expected, bulk.map(self.values))
+            self.assertEquals(expected, list(bulk.imap(self.values)))
+            self.assertIsNotNone(bulk.pool)
+        self.assertIsNone(bulk.pool)
+        self.assertEquals(expected, parallel_rsa.encrypt_list(
+            self.e, self.n, self.values, processes=2))
+
+    def test_map_into(self):
+        """
+        map_into() must write the results from the offset on and leave the
+        rest of the output untouched.
+        """
+
+        expected = [pow(m, self.e, self.n) for m in self.values]
+        out = [None] * (len(self.values) + 5)
+        with parallel_rsa.BulkRSA(self.e, self.n, processes=2,
+                                  threshold=0) as bulk:
+            self.assertEquals(len(self.values),
+                              bulk.map_into(self.values, out, 3))
+        self.assertEquals([None] * 3 + expected + [None] * 2, out)
+
+    def test_serial_below_threshold(self):
+        """
+        Inputs shorter than the threshold must be processed without
+        starting the pool.
+        """
+
+        bulk = parallel_rsa.BulkRSA(self.e, self.n, processes=2,
+                                    threshold=len(self.values) + 1)
+        self.assertEquals([pow(m, self.e, self.n) for m in self.values],
+                          bulk.map(self.values))
+        self.assertIsNone(bulk.pool)
+
+    def test_private_key(self):
+        """
+        A PrivateKey must reach the workers with its CRT parameters and
+        decrypt to the same result as a plain private exponent.
+        """
+
+        ciphertexts = [pow(m, self.e, self.n) for m in self.values]
+        with parallel_rsa.BulkRSA(self.d, self.n, processes=2,
+                                  threshold=0) as bulk:
+            self.assertEquals([rsa.PrivateKey] * 2, bulk.get_pool().map(
+                worker_key_type, range(2)))
+            self.assertEquals(self.values, bulk.map(ciphertexts))
+        self.assertEquals(self.values, parallel_rsa.decrypt_list(
+            long(self.d), self.n, ciphertexts, processes=2))
+
+
+class KeyGenerationTests(unittest.TestCase):
+    def check_keys(self, keys):
+        e, d, n = keys
+        self.assertNotEqual(d.p, d.q)
+        self.assertEquals(n, d.p * d.q)
+        self.assertTrue(rsa.probably_prime(d.p) and rsa.probably_prime(d.q))
+        self.assertEquals(1, e * d % ((d.p - 1) * (d.q - 1)))
+
+    def test_seed(self):
+        """
+        The same seed must give the same keys, and other seeds other keys.
+        """
+
+        keys = rsa.generate_keys(256, seed=5)
+        self.check_keys(keys)
+        self.assertEquals(keys, rsa.generate_keys(256, seed=5))
+        self.assertEquals(keys, parallel_keygen.generate_keys(256, 1, 5))
+        self.assertNotEqual(keys, rsa.generate_keys(256, seed=6))
+
+    def test_sieve(self):
+        """
+        The sieve must find the first prime from the starting point, like a
+        plain scan of the odd numbers, also with windows smaller than the
+        gap to that prime and when it is one of the small primes.
+        """
+
+        rng = random.Random(8)
+        for bits in range(4, 17):
+            for start in [0, (1 << bits) - 1] + [rng.getrandbits(bits)
+                                                 for _ in range(5)]:
+                expected = start | 1 << bits | 1
+                while not rsa.probably_prime(expected):
+                    expected += 2
+                for window in [1, 2, 3, 8, None]:
+                    self.assertEquals(expected, rsa.generate_random_prime(
+                        bits, rsa.miller_rabin, window, FixedRandom(start)))
+
+    def test_cancelled_search(self):
+        """
+        A cancelled prime search must give up and return None.
+        """
+
+        self.assertIsNone(rsa.generate_random_prime(
+            512, rsa.miller_rabin, cancelled=lambda: True))
+
+        calls = []
+        cancelled = lambda: calls.append(1) or len(calls) > 3
+        self.assertIsNone(rsa.generate_random_prime(
+            512, lambda n: False, cancelled=cancelled))
+        self.assertEquals(4, len(calls))
+
+    def test_parallel(self):
+        """
+        Parallel key generation must find two distinct primes, stop all of
+        its workers and report when every prime was found.
+        """
+
+        import multiprocessing
+
+        generator = parallel_keygen.ParallelKeyGenerator(3, seed=7)
+        self.check_keys(generator.generate(512))
+        self.assertEquals([], multiprocessing.active_children())
+
+        report = generator.report
+        self.assertEquals((512, 3), (report.bits, report.processes))
+        self.assertEquals(2, len(report.primes))
+        workers, seconds = zip(*report.primes)
+        self.assertTrue(all(0 <= w < 3 for w in workers))
+        self.assertTrue(0 < seconds[0] <= seconds[1] <= report.total)
+        self.assertEquals(report.total, report.as_dict()['total'])
+
+        # Every worker searches a stream of its own.
+        seeds = generator.seeds()
+        self.assertEquals(3, len(set(seeds)))
+        self.assertEquals(seeds, parallel_keygen.ParallelKeyGenerator(
+            3, seed=7).seeds())
+
+    def test_parallel_errors(self):
+        """
+        An exception in the workers must reach the caller instead of leaving
+        it waiting for primes, and the workers must still be stopped.
+        """
+
+        import multiprocessing
+
+        self.assertRaises(ValueError, rsa.generate_keys, 1)
+        self.assertRaises(ValueError, rsa.generate_keys, 1, processes=2)
+        self.assertEquals([], multiprocessing.active_children())
+
+
+class ModExpTests(unittest.TestCase):
+    def setUp(self):
+        self.rng = random.Random(3)
+        # Odd and even moduli, with sizes on both sides of a word.
+        self.moduli = [3, 4, 97, 1000, 2 ** 61 - 1, 2 ** 64,
+                       self.rng.getrandbits(512) | 1 << 511 | 1,
+                       (self.rng.getrandbits(512) | 1 << 511) & ~1]
+
+    def test_methods(self):
+        """
+        Every method of exponentiation must agree with the builtin pow(),
+        for zero exponents, bases not reduced modulo n and exponents of
+        every window width.
+        """
+
+        # Exponent sizes on both sides of every change of window width.
+        sizes = [1, 2, 23, 24, 79, 80, 239, 240, 671, 672, 1024]
+        self.assertEquals(set(modexp.window_size(b) for b in range(1, 4096)),
+                          set(modexp.window_size(b) for b in sizes))
+
+        for n in self.moduli:
+            for method in modexp.METHODS:
+                ctx = modexp.ModContext(n, method)
+                for base in [0, 1, n - 1, n, n + 1, 3 * n + 2,
+                             self.rng.randrange(n)]:
+                    self.assertEquals(pow(base, 0, n), ctx.pow(base, 0))
+                    for bits in sizes:
+                        exp = self.rng.getrandbits(bits) | 1 << (bits - 1)
+                        self.assertEquals(pow(base, exp, n),
+                                          ctx.pow(base, exp))
+
+    def test_montgomery_constants(self):
+        """
+        The Newton iteration must find n' with n * n' = -1 modulo R.
+        """
+
+        for n in self.moduli:
+            if n & 1:
+                ctx = modexp.ModContext(n, 'window')
+                ctx.setup_montgomery()
+                k, mask, n_prime, r2 = ctx.montgomery
+                self.assertEquals(mask, n * n_prime & mask)
+                self.assertEquals(pow(2, 2 * k, n), r2)
+
+    def test_fixed_base(self):
+        """
+        Fixed base exponentiation must agree with the builtin pow(), also
+        for exponents wider than the precomputed tables.
+        """
+
+        for n in self.moduli:
+            for width in [1, 4, 5]:
+                base = self.rng.randrange(2 * n)
+                fixed = modexp.context(n).fixed_base(base, 100, width)
+                for exp in [0, 1, 2 ** 100 - 1, self.rng.getrandbits(100),
+                            2 ** 100, self.rng.getrandbits(300)]:
+                    self.assertEquals(pow(base, exp, n), fixed.pow(exp))
+
+    def test_context_cache(self):
+        """
+        The context cache must evict only the least recently used moduli,
+        and primality tests must not push contexts out of it.
+        """
+
+        size = modexp.CONTEXT_CACHE_SIZE
+        first = modexp.context(1001)
+        for n in range(3, 2 * size + 3, 2):
+            modexp.context(n)
+            self.assertIs(first, modexp.context(1001))
+        self.assertTrue(len(modexp._contexts) <= size)
+
+        others = [modexp.context(n) for n in range(5001, 5001 + 2 * size, 2)]
+        self.assertIsNot(first, modexp.context(1001))
+        self.assertIs(others[-1], modexp.context(5001 + 2 * size - 2))
+
+        key = modexp.context(self.moduli[-2])
+        rsa.generate_random_prime(256, rsa.miller_rabin)
+        self.assertIs(key, modexp.context(self.moduli[-2]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,300 @@
+# !/usr/bin/python
+
+##############################################################################
+# @file    benchmark.py
+# @brief   Throughput and latency benchmarks for the Feistel cipher
+# (Assignment 1) and RSA (Assignment 2). Results are written as JSON and can
+# be compared against a saved baseline to catch regressions.
+###############################################################################
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import timeit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, 'Assignment 1', 'src'))
+sys.path.insert(0, os.path.join(HERE, 'Assignment 2', 'src'))
+
+from feistel_cipher import FeistelCipher
+import modexp
+import parallel_keygen
+import parallel_rsa
+import rsa
+
+
+FEISTEL_SIZES = [8, 1 << 10, 64 << 10, 1 << 20, 10 << 20, 100 << 20]
+RSA_BITS = [256, 512, 1024, 2048]
+
+KEY = 'sandves'
+TRIPLE_KEY = 'stiansandvestiansandv'
+
+
+def measure(func, repeats, warmup):
+    """
+    Calls a function warmup times without timing it, and then repeats
+    times while recording the duration of every call.
+
+    :return: list of durations in seconds.
+    """
+
+    for _ in range(warmup):
+        func()
+
+    samples = []
+    for _ in range(repeats):
+        start = timeit.default_timer()
+        func()
+        samples.append(timeit.default_timer() - start)
+    return samples
+
+
+def percentile(samples, p):
+    """
+    :param samples: list of numbers.
+    :param p: percentile between 0 and 100.
+    :return: the p-th percentile, interpolated linearly between samples.
+    """
+
+    ordered = sorted(samples)
+    pos = (len(ordered) - 1) * p / 100.0
+    low = int(pos)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (pos - low)
+
+
+def result(name, samples, work, unit, higher_is_better=True):
+    """
+    Summarizes the samples of one benchmark.
+
+    :param name: unique name of the benchmark.
+    :param samples: durations in seconds.
+    :param work: amount of work done per call, in the unit of the metric
+    multiplied by seconds, e.g. megabytes for MB/s. None for latencies,
+    which are reported in milliseconds.
+    :param unit: unit of the metric.
+    :param higher_is_better: direction used when comparing to a baseline.
+    :return: dict that is stored in the JSON results.
+    """
+
+    median = percentile(samples, 50)
+    value = work / median if work is not None else median * 1000
+    return {
+        'name': name,
+        'unit': unit,
+        'value': value,
+        'higher_is_better': higher_is_better,
+        'repeats': len(samples),
+        'seconds': {
+            'min': min(samples),
+            'p50': median,
+            'p90': percentile(samples, 90),
+            'p99': percentile(samples, 99),
+            'max': max(samples),
+        },
+    }
+
+
+def report(res):
+    print ('%-45s %12.4f %s' % (res['name'], res['value'], res['unit']))
+    sys.stdout.flush()
+
+
+def bench_feistel(args):
+    results = []
+
+    for backend in args.backends:
+        try:
+            cipher = FeistelCipher(backend=backend)
+        except ImportError:
+            print ('%-45s skipped, backend not available' % backend)
+            continue
+
+        samples = measure(lambda: cipher.expand_key(KEY), args.repeats,
+                          args.warmup)
+        res = result('feistel/key_schedule/%s' % backend, samples, None,
+                     'ms', False)
+        results.append(res)
+        report(res)
+
+        for mode in ['single', 'triple']:
+            if mode == 'single':
+                run = lambda data: cipher.encrypt_bytes(data, KEY)
+            else:
+                run = lambda data: cipher.triple_encrypt_bytes(data,
+                                                               TRIPLE_KEY)
+
+            rate = None
+            for size in args.sizes:
+                # Skip sizes that would exceed the time budget, estimated
+                # from the throughput of the previous size.
+                if rate is not None:
+                    estimate = size * (args.repeats + args.warmup) / rate
+                    if estimate > args.budget:
+                        print ('%-45s skipped, estimated %.0fs' %
+                               ('feistel/%s/%s/%d' % (mode, backend, size),
+                                estimate))
+                        break
+
+                data = os.urandom(size)
+                samples = measure(lambda: run(data), args.repeats,
+                                  args.warmup)
+                res = result('feistel/%s/%s/%d' % (mode, backend, size),
+                             samples, size / 1e6, 'MB/s')
+                rate = size / res['seconds']['p50']
+                results.append(res)
+                report(res)
+
+    return results
+
+
+def bench_rsa(args):
+    results = []
+
+    for bits in args.rsa_bits:
+        samples = measure(lambda: rsa.generate_keys(bits),
+                          args.keygen_repeats, 0)
+        res = result('rsa/generate_keys/%d' % bits, samples, None, 'ms',
+                     False)
+        results.append(res)
+        report(res)
+
+        samples = measure(lambda: parallel_keygen.generate_keys(bits),
+                          args.keygen_repeats, 0)
+        res = result('rsa/generate_keys_parallel/%d' % bits, samples, None,
+                     'ms', False)
+        results.append(res)
+        report(res)
+
+        e, d, n = rsa.generate_keys(bits)
+        messages = [random.randrange(2, n - 1) for _ in range(args.rsa_ops)]
+        ciphers = [rsa.encrypt(e, n, m) for m in messages]
+
+        samples = measure(lambda: rsa.encrypt_list(e, n, messages),
+                          args.repeats, args.warmup)
+        res = result('rsa/encrypt/%d' % bits, samples, args.rsa_ops, 'ops/s')
+        results.append(res)
+        report(res)
+
+        samples = measure(lambda: rsa.decrypt_list(d, n, ciphers),
+                          args.repeats, args.warmup)
+        res = result('rsa/decrypt/%d' % bits, samples, args.rsa_ops, 'ops/s')
+        results.append(res)
+        report(res)
+
+        with parallel_rsa.BulkRSA(d, n, threshold=0) as bulk:
+            samples = measure(lambda: bulk.map(ciphers), args.repeats,
+                              args.warmup + 1)
+        res = result('rsa/decrypt_parallel/%d' % bits, samples,
+                     args.rsa_ops, 'ops/s')
+        results.append(res)
+        report(res)
+
+        # Every exponentiation method with full size exponents, as used by
+        # decryption without CRT.
+        exponents = [random.getrandbits(bits) for _ in messages]
+        for method in modexp.METHODS:
+            context = modexp.ModContext(n, method)
+            run = lambda: [context.pow(m, x)
+                           for m, x in zip(messages, exponents)]
+            samples = measure(run, args.repeats, args.warmup)
+            res = result('rsa/pow_mod/%s/%d' % (method, bits), samples,
+                         args.rsa_ops, 'ops/s')
+            results.append(res)
+            report(res)
+
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compares results with a baseline.
+
+    :param results: list of result dicts.
+    :param baseline: list of result dicts loaded from a previous run.
+    :param tolerance: allowed relative regression, e.g. 0.1 for 10%.
+    :return: list of (name, baseline value, value, relative change) for
+    every benchmark that regressed beyond the tolerance.
+    """
+
+    previous = dict((r['name'], r) for r in baseline)
+    regressions = []
+
+    for res in results:
+        base = previous.get(res['name'])
+        if base is None or not base['value']:
+            continue
+
+        change = (res['value'] - base['value']) / base['value']
+        if not res['higher_is_better']:
+            change = -change
+
+        if change < -tolerance:
+            regressions.append((res['name'], base['value'], res['value'],
+                                change))
+
+    return regressions
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the Feistel cipher and RSA.')
+    parser.add_argument('--suite', choices=['all', 'feistel', 'rsa'],
+                        default='all')
+    parser.add_argument('--backends', nargs='+',
+                        default=['int', 'numpy', 'bitsliced'],
+                        choices=FeistelCipher.BACKENDS)
+    parser.add_argument('--sizes', nargs='+', type=int, default=FEISTEL_SIZES,
+                        help='payload sizes in bytes')
+    parser.add_argument('--rsa-bits', nargs='+', type=int, default=RSA_BITS)
+    parser.add_argument('--rsa-ops', type=int, default=100,
+                        help='operations per RSA encrypt/decrypt sample')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--keygen-repeats', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--budget', type=float, default=60,
+                        help='skip payload sizes estimated to take longer '
+                             'than this many seconds')
+    parser.add_argument('-o', '--output', help='write results to this JSON '
+                                               'file')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='fail if any result regressed compared to this '
+                             'JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='allowed relative regression when comparing')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    results = []
+
+    if args.suite in ('all', 'feistel'):
+        results.extend(bench_feistel(args))
+    if args.suite in ('all', 'rsa'):
+        results.extend(bench_rsa(args))
+
+    if args.output:
+        with open(args.output, 'w') as out:
+            json.dump({'python': platform.python_version(),
+                       'machine': platform.machine(),
+                       'results': results}, out, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        for name, before, after, change in regressions:
+            print ('REGRESSION %s: %.4f -> %.4f (%+.1f%%)' %
+                   (name, before, after, change * 100))
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())